@@ -0,0 +1,288 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+from cancellation import CancelToken, CompressionCancelled
+from fileio import run_io
+from scheduler import CompressionScheduler
+
+# Controle de admissão: estima quanto um novo upload esperaria pela compressão
+# a partir dos bytes que o escalonador poria à frente dele e da vazão recente
+# por MB. Se a estimativa passar do limite, o upload é recusado antes de o
+# corpo ser lido, com 503 e um Retry-After coerente com o tempo de drenagem.
+
+MB = 1024 * 1024
+
+
+class AdmissionController:
+    def __init__(self, stage: CompressionScheduler, max_wait: float, initial_mb_per_second: float):
+        self.stage = stage
+        self.max_wait = max_wait
+        # Segundos de CPU por byte em uma vaga, média móvel exponencial
+        self.seconds_per_byte = 1 / (initial_mb_per_second * MB)
+        self.queued_bytes = 0
+        self.rejected = 0
+        self.completed = 0
+
+    def record(self, nbytes: int, elapsed: float):
+        if nbytes <= 0:
+            return
+        sample = elapsed / nbytes
+        self.seconds_per_byte = 0.8 * self.seconds_per_byte + 0.2 * sample
+        self.completed += 1
+
+    @staticmethod
+    def _timed(func, args, token: Optional[CancelToken]):
+        started = time.thread_time()
+        try:
+            if token:
+                token.check()
+            return func(*args)
+        finally:
+            if token:
+                token.add_cpu(time.thread_time() - started)
+
+    @staticmethod
+    async def _guard(awaitable, token: Optional[CancelToken], cancel: bool = True):
+        # Corre a espera contra o token; se ele disparar primeiro, desiste sem esperar
+        if token is None:
+            return await awaitable
+        task = asyncio.ensure_future(awaitable)
+        cancelled = asyncio.ensure_future(token.event.wait())
+        try:
+            await asyncio.wait({task, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+        except BaseException:
+            if cancel:
+                task.cancel()
+            raise
+        finally:
+            cancelled.cancel()
+        if task.done():
+            return task.result()
+        if cancel:
+            task.cancel()
+        raise CompressionCancelled()
+
+    async def _in_thread(self, func, args, token: Optional[CancelToken]):
+        # Cancelar a task não para a thread: ela segue registrada no token até o
+        # próximo ponto de cancelamento, para quem limpa os arquivos esperar por ela
+        work = asyncio.get_running_loop().run_in_executor(None, self._timed, func, args, token)
+        if token:
+            token.track(work)
+        return await self._guard(work, token, cancel=False)
+
+    async def run(self, nbytes: int, func, *args, token: Optional[CancelToken] = None, api_key: Optional[str] = None):
+        """Executa uma compressão no estágio de CPU, contando os bytes na fila até terminar.
+
+        Com um token, a espera pela vaga e a própria compressão são
+        abandonadas assim que ele é cancelado, liberando a vaga na hora; a
+        thread para no próximo ponto de cancelamento da função, e
+        token.settle() espera por isso.
+        """
+        self.queued_bytes += nbytes
+        try:
+            job = await self._guard(self.stage.acquire(nbytes, api_key), token)
+            try:
+                started = time.monotonic()
+                result = await self._in_thread(func, args, token)
+                self.record(nbytes, time.monotonic() - started)
+                return result
+            finally:
+                self.stage.release(job)
+        finally:
+            self.queued_bytes -= nbytes
+
+    async def run_blocks(self, nbytes: int, job, token: Optional[CancelToken] = None, api_key: Optional[str] = None):
+        """Executa uma compressão em blocos (job.step() até retornar False), com preempção.
+
+        Entre um bloco e outro o escalonador pode pedir a vaga de volta; o
+        job então volta para a fila e continua do mesmo ponto quando for
+        escolhido de novo.
+        """
+        self.queued_bytes += nbytes
+        slot = None
+        ran = 0.0
+        try:
+            slot = await self._guard(self.stage.acquire(nbytes, api_key), token)
+            while True:
+                started = time.monotonic()
+                more = await self._in_thread(job.step, (), token)
+                ran += time.monotonic() - started
+                if not more:
+                    break
+                if self.stage.should_yield(slot, max(nbytes - job.bytes_in, 0)):
+                    preempted, slot = slot, None
+                    self.stage.preempt(preempted)
+                    slot = await self._guard(self.stage.acquire(resume=preempted), token)
+            self.record(nbytes, ran)
+        finally:
+            if slot:
+                self.stage.release(slot)
+            self.queued_bytes -= nbytes
+
+    def estimate_wait(self, nbytes: int = 0, api_key: Optional[str] = None) -> float:
+        """Espera estimada por uma vaga para um job deste tamanho, pela política do escalonador."""
+        ahead, slots = self.stage.backlog(nbytes, api_key)
+        return ahead * self.seconds_per_byte / slots
+
+    def retry_after(self, wait: float) -> int:
+        """Segundos até a fila drenar abaixo do limite de espera."""
+        return max(math.ceil(wait - self.max_wait), 1)
+
+    def check(self, nbytes: int = 0, api_key: Optional[str] = None) -> float:
+        """Retorna a espera estimada, contando uma recusa se passar do limite."""
+        wait = self.estimate_wait(nbytes, api_key)
+        if wait > self.max_wait:
+            self.rejected += 1
+        return wait
+
+    def stats(self, nbytes: int = 0) -> Dict:
+        wait = self.estimate_wait(nbytes)
+        accepting = wait <= self.max_wait
+        return {
+            "accepting": accepting,
+            "estimated_wait_seconds": round(wait, 3),
+            "max_wait_seconds": self.max_wait,
+            "retry_after": None if accepting else self.retry_after(wait),
+            "queued_jobs": self.stage.active + self.stage.queued,
+            "queued_bytes": self.queued_bytes,
+            "throughput_mb_per_second": round(self.stage.limit / self.seconds_per_byte / MB, 3),
+            "rejected": self.rejected,
+        }
+
+
+class QueueAdmission:
+    """Admissão com EXTERNAL_WORKERS: a compressão roda nos processos worker.py,
+    fora do estágio de CPU deste servidor, então a espera é estimada pela fila
+    persistente. Os bytes à frente são divididos pelos jobs em andamento (um
+    por thread de worker ocupada), com a vazão por byte e os limites do
+    controlador local.
+    """
+
+    def __init__(self, controller: AdmissionController, depth: Callable[[], Tuple[int, int, int]], interval: float):
+        self.controller = controller
+        self.depth = depth
+        self.interval = interval
+        self.queued_jobs = 0
+        self.queued_bytes = 0
+        self.running = 0
+
+    @property
+    def max_wait(self) -> float:
+        return self.controller.max_wait
+
+    async def run(self):
+        # A consulta à fila roda no pool de I/O; cada upload só lê o último retrato
+        while True:
+            try:
+                self.queued_jobs, self.queued_bytes, self.running = await run_io(self.depth)
+            except Exception:
+                pass
+            await asyncio.sleep(self.interval)
+
+    def estimate_wait(self, nbytes: int = 0, api_key: Optional[str] = None) -> float:
+        return self.queued_bytes * self.controller.seconds_per_byte / max(self.running, 1)
+
+    def retry_after(self, wait: float) -> int:
+        return self.controller.retry_after(wait)
+
+    def check(self, nbytes: int = 0, api_key: Optional[str] = None) -> float:
+        wait = self.estimate_wait(nbytes, api_key)
+        if wait > self.max_wait:
+            self.controller.rejected += 1
+        return wait
+
+    def stats(self, nbytes: int = 0) -> Dict:
+        wait = self.estimate_wait(nbytes)
+        accepting = wait <= self.max_wait
+        return {
+            "accepting": accepting,
+            "estimated_wait_seconds": round(wait, 3),
+            "max_wait_seconds": self.max_wait,
+            "retry_after": None if accepting else self.retry_after(wait),
+            "queued_jobs": self.queued_jobs + self.running,
+            "queued_bytes": self.queued_bytes,
+            "throughput_mb_per_second": round(max(self.running, 1) / self.controller.seconds_per_byte / MB, 3),
+            "rejected": self.controller.rejected,
+        }
+
+
+class UploadQuota:
+    """Bytes enviados por API Key em uma janela deslizante.
+
+    Contados pelo Content-Length antes do corpo, ou, sem ele, à medida que o
+    corpo chega; uploads recusados adiante (503/507) são devolvidos à cota.
+    """
+
+    def __init__(self, max_bytes: int, window: float):
+        self.max_bytes = max_bytes
+        self.window = window
+        self.usage: Dict[str, Deque[Tuple[float, int]]] = {}
+        self.totals: Dict[str, int] = {}
+
+    def _expire(self, key: str, now: float):
+        entries = self.usage.get(key)
+        while entries and entries[0][0] <= now - self.window:
+            self.totals[key] -= entries.popleft()[1]
+        if entries is not None and not entries:
+            del self.usage[key]
+            del self.totals[key]
+
+    def try_consume(self, key: str, nbytes: int) -> int:
+        """Registra o upload e retorna 0, ou os segundos até caber na cota."""
+        if not self.max_bytes:
+            return 0
+        now = time.monotonic()
+        self._expire(key, now)
+        entries = self.usage.get(key)
+        used = self.totals.get(key, 0)
+        if used and used + nbytes > self.max_bytes:
+            # Espera até sair da janela o suficiente para o novo upload caber
+            freed = 0
+            for timestamp, size in entries:
+                freed += size
+                if used - freed + nbytes <= self.max_bytes:
+                    return max(math.ceil(timestamp + self.window - now), 1)
+            # Maior que a cota inteira: só passa com a janela vazia
+            return max(math.ceil(entries[-1][0] + self.window - now), 1)
+        if nbytes:
+            self.usage.setdefault(key, deque()).append((now, nbytes))
+            self.totals[key] = used + nbytes
+        return 0
+
+    def charge(self, key: str, nbytes: int) -> bool:
+        """Conta bytes já recebidos de um corpo sem tamanho declarado; False se a chave passou da cota."""
+        if not self.max_bytes:
+            return True
+        now = time.monotonic()
+        self._expire(key, now)
+        entries = self.usage.setdefault(key, deque())
+        if entries and now - entries[-1][0] < 1:
+            # Agrupa as mensagens do mesmo segundo em um registro só
+            timestamp, size = entries[-1]
+            entries[-1] = (timestamp, size + nbytes)
+        else:
+            entries.append((now, nbytes))
+        self.totals[key] = self.totals.get(key, 0) + nbytes
+        return self.totals[key] <= self.max_bytes
+
+    def refund(self, key: str, nbytes: int):
+        """Devolve bytes de um upload recusado sem ter sido processado, a partir dos registros mais recentes."""
+        entries = self.usage.get(key)
+        while entries and nbytes > 0:
+            timestamp, size = entries.pop()
+            taken = min(size, nbytes)
+            nbytes -= taken
+            self.totals[key] -= taken
+            if size > taken:
+                entries.append((timestamp, size - taken))
+        if entries is not None and not entries:
+            del self.usage[key]
+            del self.totals[key]
+
+    def stats(self) -> Dict[str, int]:
+        now = time.monotonic()
+        for key in list(self.usage):
+            self._expire(key, now)
+        return {"keys": len(self.usage), "bytes_in_window": sum(self.totals.values())}
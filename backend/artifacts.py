@@ -0,0 +1,173 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from fileio import run_io
+from sqlitedb import SQLiteStore
+
+# Metadados dos artefatos (dono, tamanhos, codec, nível, hash do original e
+# prazo) em SQLite, com um cache LRU em memória para as leituras. Download,
+# listagem e limpeza consultam o índice pelo nome do artefato em vez de
+# deduzir o formato pelo nome do arquivo e fazer stat no disco.
+#
+# Os registros só mudam em dois casos: quando um artefato preguiçoso é
+# compactado (compressed_size deixa de ser None) e quando expira; o cache de
+# outro processo pode ficar atrasado nesses casos, e quem lê trata um arquivo
+# ausente como artefato expirado.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    original_size INTEGER,
+    compressed_size INTEGER,
+    codec TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    content_hash TEXT,
+    created REAL NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_owner ON artifacts (owner, created);
+"""
+
+COLUMNS = "name, owner, original_size, compressed_size, codec, level, content_hash, created, expires"
+
+
+@dataclass
+class Artifact:
+    name: str
+    owner: Optional[str]  # resumo da API Key (scheduler.tenant_for), nunca a chave
+    original_size: Optional[int]  # None para artefatos anteriores ao índice
+    compressed_size: Optional[int]  # None enquanto o artefato preguiçoso não foi compactado
+    codec: str
+    level: int  # 0 para artefatos anteriores ao índice
+    content_hash: Optional[str]  # sha256 do original, quando calculado na compressão
+    created: float
+    expires: float
+
+    @property
+    def pending(self) -> bool:
+        return self.compressed_size is None
+
+    def expired(self, now: Optional[float] = None) -> bool:
+        return (now or time.time()) >= self.expires
+
+    def summary(self) -> Dict:
+        summary = asdict(self)
+        return {
+            "filename": summary.pop("name"),
+            **summary,
+            "created": datetime.fromtimestamp(self.created).isoformat(),
+            "expires": datetime.fromtimestamp(self.expires).isoformat(),
+        }
+
+
+class ArtifactStore(SQLiteStore):
+    def __init__(self, path: Path, cache_entries: int):
+        super().__init__(path, SCHEMA)
+        self.cache_entries = cache_entries
+        self.cache: "OrderedDict[str, Artifact]" = OrderedDict()
+        # Lock próprio do cache: o do SQLite fica preso do BEGIN ao COMMIT de cada lote,
+        # e a consulta ao cache roda no event loop a cada download
+        self.cache_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cache(self, artifact: Artifact):
+        with self.cache_lock:
+            self.cache[artifact.name] = artifact
+            self.cache.move_to_end(artifact.name)
+            while len(self.cache) > self.cache_entries:
+                self.cache.popitem(last=False)
+
+    def _cached(self, name: str) -> Optional[Artifact]:
+        with self.cache_lock:
+            artifact = self.cache.get(name)
+            if artifact is not None:
+                self.cache.move_to_end(name)
+                self.hits += 1
+            return artifact
+
+    async def put(self, artifact: Artifact):
+        """Registra o artefato; fica visível na hora neste processo e, após o commit, nos demais."""
+        self._cache(artifact)
+        await self._submit(
+            f"INSERT OR REPLACE INTO artifacts ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            tuple(asdict(artifact).values())
+        )
+
+    def set_compressed(self, name: str, compressed_size: int, content_hash: Optional[str] = None):
+        """Artefato preguiçoso compactado: grava o tamanho final sem precisar ser aguardado."""
+        artifact = self._cached(name)
+        if artifact:
+            artifact.compressed_size = compressed_size
+            artifact.content_hash = content_hash or artifact.content_hash
+        self._submit_nowait(
+            "UPDATE artifacts SET compressed_size = ?, content_hash = COALESCE(?, content_hash) WHERE name = ?",
+            (compressed_size, content_hash, name)
+        )
+
+    async def lookup(self, name: str) -> Optional[Artifact]:
+        artifact = self._cached(name)
+        if artifact is not None:
+            return artifact
+        return await run_io(self.get, name)
+
+    # Operações síncronas, para o pool de I/O
+
+    def get(self, name: str) -> Optional[Artifact]:
+        artifact = self._cached(name)
+        if artifact is not None:
+            return artifact
+        with self.lock:
+            self.misses += 1
+            # O módulo sqlite3 mantém as consultas preparadas em cache por conexão
+            row = self.conn.execute(f"SELECT {COLUMNS} FROM artifacts WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        artifact = Artifact(*row)
+        self._cache(artifact)
+        return artifact
+
+    def list_owner(self, owner: str, limit: int) -> List[Artifact]:
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT {COLUMNS} FROM artifacts WHERE owner = ? ORDER BY created DESC LIMIT ?", (owner, limit)
+            ).fetchall()
+        return [Artifact(*row) for row in rows]
+
+    def sizes(self) -> List[Tuple[str, Optional[str], int]]:
+        """Nome, dono e bytes em disco de cada artefato (o original, enquanto pendente)."""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT name, owner, COALESCE(compressed_size, original_size, 0) FROM artifacts"
+            ).fetchall()
+
+    def put_missing(self, artifacts: List[Artifact]) -> int:
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                f"INSERT OR IGNORE INTO artifacts ({COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [tuple(asdict(artifact).values()) for artifact in artifacts]
+            )
+            return self.conn.total_changes - before
+
+    def discard(self, names: List[str]):
+        with self.cache_lock:
+            for name in names:
+                self.cache.pop(name, None)
+        self._transaction([("DELETE FROM artifacts WHERE name = ?", (name,)) for name in names])
+
+    def stats(self) -> Dict:
+        with self.lock:
+            count = self.conn.execute("SELECT COUNT(*) FROM artifacts").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "artifacts": count,
+            "cached": len(self.cache),
+            "cache_hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            **self.batch_stats(),
+        }
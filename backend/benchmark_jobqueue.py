@@ -0,0 +1,46 @@
+import asyncio
+import tempfile
+import time
+from pathlib import Path
+from jobqueue import JobQueue, QueuedJob
+
+# Custo da fila persistente por job (registro + remoção), com uploads
+# concorrentes agrupados no mesmo commit x um commit por operação.
+JOBS = 2000
+CONCURRENCY = [1, 16, 64]
+
+def make_job(index):
+    return QueuedJob(Path(f"uploads/arquivo_{index}"), f"arquivo_{index}", f"arquivo_{index}", "xz", 9, 1024)
+
+async def run_batched(queue, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(index):
+        async with semaphore:
+            job_id = await queue.enqueue(make_job(index))
+            await queue.finish(job_id)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(JOBS)))
+    return time.perf_counter() - start_time
+
+def run_unbatched(queue):
+    start_time = time.perf_counter()
+    for index in range(JOBS):
+        job_id, = queue.enqueue_many([make_job(index)], owner="benchmark")
+        queue.finish_many([job_id])
+    return time.perf_counter() - start_time
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{JOBS} jobs, registro + remoção")
+        queue = JobQueue(Path(directory) / "unbatched.db")
+        print(f"{'sem lote':>16} {run_unbatched(queue) / JOBS * 1000:>8.3f}ms/job")
+        for concurrency in CONCURRENCY:
+            queue = JobQueue(Path(directory) / f"batched_{concurrency}.db")
+            elapsed = asyncio.run(run_batched(queue, concurrency))
+            print(f"{f'{concurrency} simultâneos':>16} {elapsed / JOBS * 1000:>8.3f}ms/job "
+                  f"(lote médio {queue.stats()['average_batch']})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import os
+import threading
+import time
+from shm_ring import CONTEXT, END_OF_STREAM, ShmRing
+
+# Microbenchmark do transporte de chunks para processos de compressão:
+# ring buffer em memória compartilhada x pipe (bytes crus) x pipe com pickle.
+# Mede só o transporte: o consumidor lê um byte por página de cada chunk.
+CHUNK_SIZE = 1024 * 1024  # 1MB, o mesmo chunk do loop de upload
+MB_PER_STREAM = 256
+RING_SLOTS = 4
+CONCURRENT_STREAMS = [1, 4, 16]
+
+def touch(data):
+    """Lê um byte por página para garantir que os dados chegaram ao consumidor"""
+    return sum(data[i] for i in range(0, len(data), 4096))
+
+def consume_ring(ring):
+    while True:
+        length, payload = ring.consume()
+        if length == END_OF_STREAM:
+            payload.release()
+            ring.release_slot()
+            break
+        touch(payload)
+        payload.release()
+        ring.release_slot()
+    ring.close()
+
+def consume_pipe_bytes(conn):
+    while data := conn.recv_bytes():
+        touch(data)
+
+def consume_pipe_pickle(conn):
+    while (data := conn.recv()) is not None:
+        touch(data)
+
+def produce_ring(ring, chunk):
+    for _ in range(MB_PER_STREAM * 1024 * 1024 // CHUNK_SIZE):
+        ring.reserve()
+        ring.fill_slot(chunk)
+        ring.publish()
+    ring.reserve()
+    ring.publish(END_OF_STREAM)
+
+def produce_pipe_bytes(conn, chunk):
+    for _ in range(MB_PER_STREAM * 1024 * 1024 // CHUNK_SIZE):
+        conn.send_bytes(chunk)
+    conn.send_bytes(b"")
+
+def produce_pipe_pickle(conn, chunk):
+    for _ in range(MB_PER_STREAM * 1024 * 1024 // CHUNK_SIZE):
+        conn.send(chunk)
+    conn.send(None)
+
+def run(transport, streams):
+    chunk = os.urandom(CHUNK_SIZE)
+    processes = []
+    producers = []
+    rings = []
+    for _ in range(streams):
+        if transport == "shm":
+            ring = ShmRing(RING_SLOTS, CHUNK_SIZE)
+            rings.append(ring)
+            processes.append(CONTEXT.Process(target=consume_ring, args=(ring,)))
+            producers.append(threading.Thread(target=produce_ring, args=(ring, chunk)))
+        else:
+            parent_conn, child_conn = CONTEXT.Pipe()
+            consumer = consume_pipe_bytes if transport == "pipe" else consume_pipe_pickle
+            producer = produce_pipe_bytes if transport == "pipe" else produce_pipe_pickle
+            processes.append(CONTEXT.Process(target=consumer, args=(child_conn,)))
+            producers.append(threading.Thread(target=producer, args=(parent_conn, chunk)))
+
+    for process in processes:
+        process.start()
+
+    start_time = time.time()
+    for producer in producers:
+        producer.start()
+    for producer in producers:
+        producer.join()
+    for process in processes:
+        process.join()
+    elapsed = time.time() - start_time
+
+    for ring in rings:
+        ring.close(unlink=True)
+
+    return streams * MB_PER_STREAM / elapsed
+
+def main():
+    print(f"Transferindo {MB_PER_STREAM}MB por stream em chunks de {CHUNK_SIZE // 1024}KB")
+    print(f"{'streams':>8} {'shm ring':>12} {'pipe bytes':>12} {'pipe pickle':>12}")
+    for streams in CONCURRENT_STREAMS:
+        results = [run(transport, streams) for transport in ("shm", "pipe", "pickle")]
+        print(f"{streams:>8} " + " ".join(f"{mb_s:>9.0f}MB/s" for mb_s in results))
+
+if __name__ == "__main__":
+    main()
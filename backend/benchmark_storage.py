@@ -0,0 +1,52 @@
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+from storage import ShardedDirectory
+
+# Criação, consulta (stat) e remoção de arquivos vazios num diretório plano
+# x em shards, com o volume de arquivos de produção. Rode no mesmo sistema de
+# arquivos do servidor (ext4/overlayfs); 10^6 arquivos levam alguns minutos.
+#
+#     python benchmark_storage.py --files 1000000
+
+
+def run(directory: ShardedDirectory, names):
+    timings = {}
+    start_time = time.perf_counter()
+    for name in names:
+        os.close(os.open(directory.prepare(name), os.O_CREAT | os.O_WRONLY, 0o644))
+    timings["criação"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for name in names:
+        os.stat(directory.path(name))
+    timings["consulta"] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for name in names:
+        os.unlink(directory.path(name))
+    timings["remoção"] = time.perf_counter() - start_time
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=10 ** 6)
+    parser.add_argument("--dir", type=Path, default=None, help="diretório no sistema de arquivos a medir")
+    args = parser.parse_args()
+
+    names = [f"arquivo_{index}_20240101_120000.txt_20240101_120000.xz" for index in range(args.files)]
+    print(f"{args.files} arquivos")
+    for levels in (0, 1, 2):
+        with tempfile.TemporaryDirectory(dir=args.dir) as root:
+            timings = run(ShardedDirectory(Path(root), levels), names)
+        label = "plano" if levels == 0 else f"{levels} níveis"
+        print(f"{label:>10} " + " ".join(
+            f"{operation} {elapsed / args.files * 1e6:>6.1f}µs" for operation, elapsed in timings.items()
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import aiohttp
+import asyncio
+import os
+from pathlib import Path
+import statistics
+import time
+
+# Compara o upload multipart (/upload/) com o upload de corpo cru (PUT /upload/raw).
+# Para medir as escritas em disco do servidor (Linux), informe o PID do uvicorn:
+#   SERVER_PID=$(pgrep -f "uvicorn main:app") python benchmark_upload.py
+BASE_URL = "http://localhost:8000"
+API_KEY = os.getenv("API_KEY", "dev_key")
+SERVER_PID = os.getenv("SERVER_PID")
+TEST_FILE_SIZE_MB = 64
+REPETITIONS = 5
+
+def generate_test_file(size_mb):
+    """Gera um arquivo de teste com texto repetitivo e um pouco de ruído"""
+    file_path = Path("benchmark_file.txt")
+    with open(file_path, "wb") as f:
+        for _ in range(size_mb):
+            f.write((b"linha de log repetitiva " * 32 + os.urandom(256).hex().encode()) * 512)
+    return file_path
+
+def server_write_bytes():
+    """Bytes passados a write() pelo processo do servidor, segundo /proc/<pid>/io.
+
+    Usa wchar em vez de write_bytes porque este só conta o que já saiu do page cache.
+    """
+    if not SERVER_PID:
+        return None
+    with open(f"/proc/{SERVER_PID}/io") as f:
+        for line in f:
+            if line.startswith("wchar:"):
+                return int(line.split()[1])
+    return None
+
+async def upload_multipart(session, file_path):
+    data = aiohttp.FormData()
+    data.add_field('file', open(file_path, 'rb'), filename=file_path.name)
+    async with session.post(f"{BASE_URL}/upload/", data=data) as response:
+        return response.status, await response.json()
+
+async def upload_raw(session, file_path):
+    headers = {"X-Filename": file_path.name, "Content-Length": str(file_path.stat().st_size)}
+    with open(file_path, 'rb') as f:
+        async with session.put(f"{BASE_URL}/upload/raw", data=f, headers=headers) as response:
+            return response.status, await response.json()
+
+async def run_scenario(name, upload, file_path):
+    latencies = []
+    before = server_write_bytes()
+    async with aiohttp.ClientSession(headers={"X-API-Key": API_KEY}) as session:
+        for _ in range(REPETITIONS):
+            start_time = time.time()
+            status, result = await upload(session, file_path)
+            if status != 200:
+                print(f"{name}: erro {status} - {result}")
+                continue
+            latencies.append(time.time() - start_time)
+    after = server_write_bytes()
+    
+    print(f"\n{name}:")
+    if latencies:
+        print(f"  Latência média: {statistics.mean(latencies):.2f}s (mín {min(latencies):.2f}s, máx {max(latencies):.2f}s)")
+    if before is not None and after is not None and latencies:
+        written = (after - before) / len(latencies) / (1024 * 1024)
+        print(f"  Escrito em disco por upload: {written:.1f}MB (arquivo de {TEST_FILE_SIZE_MB}MB)")
+
+async def main():
+    print(f"Comparando uploads de {TEST_FILE_SIZE_MB}MB, {REPETITIONS} repetições cada")
+    file_path = generate_test_file(TEST_FILE_SIZE_MB)
+    try:
+        await run_scenario("Multipart (POST /upload/)", upload_multipart, file_path)
+        await run_scenario("Corpo cru (PUT /upload/raw)", upload_raw, file_path)
+    finally:
+        os.remove(file_path)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,245 @@
+import asyncio
+import heapq
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from scheduler import INTERNAL_TENANT, tenant_for
+
+# Orçamento de disco dos artefatos e dos uploads em andamento. Os bytes são
+# contados de forma incremental (registro, compactação do pendente, remoção)
+# em vez de somar os diretórios, e cada upload reserva o tamanho declarado
+# antes de o corpo ser lido: se não couber, é recusado na hora.
+#
+# Passando da marca alta, os artefatos saem por GDSF (Greedy-Dual-Size-
+# Frequency) até a marca baixa: a prioridade é L + acessos / tamanho, e L
+# sobe para a prioridade de cada removido, então artefatos grandes e pouco
+# baixados saem primeiro, e os que não são baixados há tempo envelhecem em
+# relação aos novos. Um upload que passaria da cota da API Key é recusado; se
+# ela ainda assim ficar acima (cota reduzida, pendente maior que o previsto),
+# perde os próprios artefatos pelo mesmo critério, antes dos de outras chaves.
+# O artefato cujo registro disparou a remoção nunca é escolhido por ela: não
+# se apaga o upload que acabou de ser aceito.
+#
+# Uma sessão de upload retomável mantém a reserva do tamanho total do arquivo
+# enquanto existir, e os chunks dela não reservam de novo.
+#
+# A conta é deste processo: artefatos de workers externos entram quando o
+# servidor os registra.
+
+
+@dataclass
+class BudgetEntry:
+    owner: str
+    size: int
+    hits: int = 1
+    priority: float = 0.0
+
+
+class DiskBudget:
+    def __init__(self, max_bytes: int, high_watermark: float, low_watermark: float,
+                 quotas: Dict[str, int], default_quota: int):
+        self.max_bytes = max_bytes
+        self.high_bytes = int(max_bytes * high_watermark)
+        self.low_bytes = int(max_bytes * low_watermark)
+        self.quotas = {tenant_for(key): quota for key, quota in quotas.items()}
+        self.default_quota = default_quota
+        self.entries: Dict[str, BudgetEntry] = {}
+        self.heap: List[Tuple[float, str]] = []
+        self.inflation = 0.0
+        self.stored_bytes = 0
+        self.reserved_bytes = 0
+        self.owner_bytes: Dict[str, int] = {}
+        self.owner_reserved: Dict[str, int] = {}
+        self.protected: Set[str] = set()
+        self.lock = threading.Lock()
+        self.pressure = asyncio.Event()
+        # Loop do laço de remoção: reservas de sessões recarregadas sinalizam do pool de I/O
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self.rejected = 0
+
+    def quota(self, owner: str) -> int:
+        # Artefatos sem dono (retomados ou anteriores ao índice) só contam no total
+        if owner == INTERNAL_TENANT:
+            return 0
+        return self.quotas.get(owner, self.default_quota)
+
+    def _over_limits(self, owner: Optional[str] = None) -> bool:
+        if self.max_bytes and self.stored_bytes + self.reserved_bytes > self.high_bytes:
+            return True
+        return owner is not None and bool(self.quota(owner)) and self.owner_bytes.get(owner, 0) > self.quota(owner)
+
+    def _push(self, name: str, entry: BudgetEntry):
+        # Entradas antigas do heap ficam para trás e são descartadas ao sair
+        entry.priority = self.inflation + entry.hits / max(entry.size, 1)
+        heapq.heappush(self.heap, (entry.priority, name))
+        if len(self.heap) > 2 * len(self.entries) + 1024:
+            self.heap = [(other.priority, other_name) for other_name, other in self.entries.items()]
+            heapq.heapify(self.heap)
+
+    def _account(self, entry: BudgetEntry, delta: int):
+        self.stored_bytes += delta
+        self.owner_bytes[entry.owner] = self.owner_bytes.get(entry.owner, 0) + delta
+        if not self.owner_bytes[entry.owner]:
+            del self.owner_bytes[entry.owner]
+
+    def load(self, artifacts: Iterable[Tuple[str, Optional[str], int]]):
+        """Artefatos já existentes na partida; os registrados nesse meio tempo não contam de novo.
+
+        Roda fora do event loop; quem chama sinaliza a pressão depois.
+        """
+        with self.lock:
+            for name, owner, size in artifacts:
+                if name not in self.entries:
+                    self._add(name, owner, size)
+
+    def _add(self, name: str, owner: Optional[str], size: int):
+        entry = BudgetEntry(owner or tenant_for(None), size)
+        self.entries[name] = entry
+        self._account(entry, size)
+        self._push(name, entry)
+
+    def add(self, name: str, owner: Optional[str], size: int):
+        owner = owner or tenant_for(None)
+        with self.lock:
+            self._add(name, owner, size)
+            over = self._over_limits(owner)
+            if over:
+                self.protected.add(name)
+        if over:
+            self.signal_pressure()
+
+    def resize(self, name: str, size: int):
+        """Artefato preguiçoso compactado: o original dá lugar ao artefato final."""
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is None:
+                return
+            self._account(entry, size - entry.size)
+            entry.size = size
+            self._push(name, entry)
+
+    def touch(self, name: str):
+        with self.lock:
+            entry = self.entries.get(name)
+            if entry is not None:
+                entry.hits += 1
+                self._push(name, entry)
+
+    def remove(self, name: str):
+        with self.lock:
+            entry = self.entries.pop(name, None)
+            if entry is not None:
+                self._account(entry, -entry.size)
+
+    def try_reserve(self, api_key: Optional[str], nbytes: int) -> Optional[str]:
+        """Reserva o espaço do upload; retorna o motivo da recusa, ou None se coube."""
+        owner = tenant_for(api_key)
+        quota = self.quota(owner)
+        with self.lock:
+            if quota and nbytes > quota:
+                self.rejected += 1
+                return "Arquivo maior que a cota de disco da API Key"
+            if quota and self.owner_bytes.get(owner, 0) + self.owner_reserved.get(owner, 0) + nbytes > quota:
+                self.rejected += 1
+                return "Cota de disco da API Key esgotada"
+            if self.max_bytes and self.stored_bytes + self.reserved_bytes + nbytes > self.max_bytes:
+                self.rejected += 1
+                return "Espaço em disco esgotado"
+            self._reserve(owner, nbytes)
+        self._signal()
+        return None
+
+    def _reserve(self, owner: str, nbytes: int):
+        self.reserved_bytes += nbytes
+        self.owner_reserved[owner] = self.owner_reserved.get(owner, 0) + nbytes
+        if not self.owner_reserved[owner]:
+            del self.owner_reserved[owner]
+
+    def reserve_owner(self, owner: Optional[str], nbytes: int):
+        """Reserva sem conferir os limites, para espaço que já está ocupado (uma sessão recarregada do disco)."""
+        owner = owner or tenant_for(None)
+        with self.lock:
+            self._reserve(owner, nbytes)
+        self._signal(owner)
+
+    def release_owner(self, owner: Optional[str], nbytes: int):
+        with self.lock:
+            self._reserve(owner or tenant_for(None), -nbytes)
+
+    def release(self, nbytes: int, api_key: Optional[str] = None):
+        self.release_owner(tenant_for(api_key), nbytes)
+
+    def _signal(self, owner: Optional[str] = None):
+        if self._over_limits(owner):
+            self.signal_pressure()
+
+    def signal_pressure(self):
+        """Acorda o laço de remoção; pode ser chamado de qualquer thread."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            if self.loop is not None:
+                # asyncio.Event não é thread-safe: fora do loop, o set vai para ele
+                self.loop.call_soon_threadsafe(self.pressure.set)
+                return
+        self.pressure.set()
+
+    async def wait_pressure(self):
+        self.loop = asyncio.get_running_loop()
+        await self.pressure.wait()
+        self.pressure.clear()
+
+    def victims(self) -> List[str]:
+        """Escolhe e tira da conta os artefatos a remover: primeiro as chaves acima da cota, depois até a marca baixa."""
+        chosen = []
+        with self.lock:
+            protected, self.protected = self.protected, set()
+            for owner, used in list(self.owner_bytes.items()):
+                quota = self.quota(owner)
+                if not quota or used <= quota:
+                    continue
+                candidates = sorted(
+                    (entry.priority, name) for name, entry in self.entries.items()
+                    if entry.owner == owner and name not in protected
+                )
+                for priority, name in candidates:
+                    if self.owner_bytes.get(owner, 0) <= quota:
+                        break
+                    self._evict(name, priority, chosen)
+
+            if self.max_bytes and self.stored_bytes + self.reserved_bytes > self.high_bytes:
+                skipped = []
+                while self.heap and self.stored_bytes + self.reserved_bytes > self.low_bytes:
+                    priority, name = heapq.heappop(self.heap)
+                    entry = self.entries.get(name)
+                    if entry is None or entry.priority != priority:
+                        continue  # Removido ou com prioridade atualizada depois
+                    if name in protected:
+                        skipped.append((priority, name))
+                        continue
+                    self._evict(name, priority, chosen)
+                for item in skipped:
+                    heapq.heappush(self.heap, item)
+        return chosen
+
+    def _evict(self, name: str, priority: float, chosen: List[str]):
+        entry = self.entries.pop(name)
+        self._account(entry, -entry.size)
+        self.inflation = max(self.inflation, priority)
+        self.evicted += 1
+        self.evicted_bytes += entry.size
+        chosen.append(name)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                "max_bytes": self.max_bytes,
+                "stored_bytes": self.stored_bytes,
+                "reserved_bytes": self.reserved_bytes,
+                "artifacts": len(self.entries),
+                "evicted": self.evicted,
+                "evicted_bytes": self.evicted_bytes,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+from threading import Lock
+from typing import Dict, Iterator, List
+from config import settings
+
+# Pool de buffers reutilizáveis para os loops de upload e compressão: em vez
+# de um bytes novo a cada chunk lido, os dados são lidos com readinto em
+# bytearrays pré-alocados e devolvidos ao pool depois de usados.
+
+
+class BufferPool:
+    def __init__(self, buffer_size: int, max_bytes: int):
+        self.buffer_size = buffer_size
+        self.max_free = max(max_bytes // buffer_size, 1)
+        self.free: List[bytearray] = []
+        self.lock = Lock()
+        self.allocated = 0
+        self.hits = 0
+        self.misses = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+
+    def acquire(self) -> bytearray:
+        with self.lock:
+            self.in_use += 1
+            self.peak_in_use = max(self.peak_in_use, self.in_use)
+            if self.free:
+                self.hits += 1
+                return self.free.pop()
+            self.misses += 1
+            self.allocated += 1
+        return bytearray(self.buffer_size)
+
+    def release(self, buffer: bytearray):
+        with self.lock:
+            self.in_use -= 1
+            # Acima do limite o buffer é simplesmente descartado
+            if len(self.free) < self.max_free and len(buffer) == self.buffer_size:
+                self.free.append(buffer)
+
+    @contextmanager
+    def lease(self) -> Iterator[bytearray]:
+        buffer = self.acquire()
+        try:
+            yield buffer
+        finally:
+            self.release(buffer)
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "buffer_size": self.buffer_size,
+                "free": len(self.free),
+                "in_use": self.in_use,
+                "peak_in_use": self.peak_in_use,
+                "allocated": self.allocated,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_POOLS: Dict[int, BufferPool] = {}
+_POOLS_LOCK = Lock()
+
+
+def get_pool(buffer_size: int) -> BufferPool:
+    with _POOLS_LOCK:
+        pool = _POOLS.get(buffer_size)
+        if pool is None:
+            pool = _POOLS[buffer_size] = BufferPool(buffer_size, settings.BUFFER_POOL_MAX_BYTES)
+        return pool
+
+
+def readinto(fileobj, buffer) -> int:
+    """readinto com fallback para objetos que só implementam read."""
+    target = fileobj if hasattr(fileobj, "readinto") else getattr(fileobj, "_file", fileobj)
+    if hasattr(target, "readinto"):
+        return target.readinto(buffer) or 0
+    data = fileobj.read(len(buffer))
+    memoryview(buffer)[:len(data)] = data
+    return len(data)
+
+
+def stats() -> List[Dict[str, int]]:
+    with _POOLS_LOCK:
+        pools = list(_POOLS.values())
+    return [pool.stats() for pool in pools]
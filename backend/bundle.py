@@ -0,0 +1,140 @@
+import asyncio
+import os
+import struct
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, List, Tuple
+from config import settings
+from fileio import run_io
+
+# ZIP em streaming: entradas sem compressão (os artefatos já estão compactados),
+# sempre em ZIP64 e com data descriptor, para que o CRC seja calculado durante
+# a leitura e nada precise ser gravado em disco ou mantido inteiro em memória.
+
+ZIP_VERSION = 45  # 4.5: ZIP64
+FLAGS = 0x0008 | 0x0800  # data descriptor + nomes em UTF-8
+ZIP64_MARKER = 0xFFFFFFFF
+CHUNK_SIZE = 1024 * 1024
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+ZIP64_LOCAL_EXTRA = struct.Struct("<HHQQ")
+DATA_DESCRIPTOR = struct.Struct("<IIQQ")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+ZIP64_CENTRAL_EXTRA = struct.Struct("<HHQQQ")
+ZIP64_END = struct.Struct("<IQHHIIQQQQ")
+ZIP64_LOCATOR = struct.Struct("<IIQI")
+END_RECORD = struct.Struct("<IHHHHIIH")
+
+
+class BundleEntry:
+    def __init__(self, path: Path):
+        self.name = path.name.encode("utf-8")
+        self.file: BinaryIO = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.size = stat.st_size
+        self.dos_time, self.dos_date = _dos_datetime(stat.st_mtime)
+        self.offset = 0
+        self.crc = 0
+
+    def local_header(self) -> bytes:
+        return LOCAL_HEADER.pack(
+            0x04034B50, ZIP_VERSION, FLAGS, 0, self.dos_time, self.dos_date,
+            0, ZIP64_MARKER, ZIP64_MARKER, len(self.name), ZIP64_LOCAL_EXTRA.size
+        ) + self.name + ZIP64_LOCAL_EXTRA.pack(0x0001, 16, 0, 0)
+
+    def data_descriptor(self) -> bytes:
+        return DATA_DESCRIPTOR.pack(0x08074B50, self.crc, self.size, self.size)
+
+    def central_header(self) -> bytes:
+        return CENTRAL_HEADER.pack(
+            0x02014B50, (3 << 8) | ZIP_VERSION, ZIP_VERSION, FLAGS, 0, self.dos_time, self.dos_date,
+            self.crc, ZIP64_MARKER, ZIP64_MARKER, len(self.name), ZIP64_CENTRAL_EXTRA.size, 0,
+            0, 0, 0o100644 << 16, ZIP64_MARKER
+        ) + self.name + ZIP64_CENTRAL_EXTRA.pack(0x0001, 24, self.size, self.size, self.offset)
+
+    def stream_size(self) -> int:
+        return LOCAL_HEADER.size + len(self.name) + ZIP64_LOCAL_EXTRA.size + self.size + DATA_DESCRIPTOR.size
+
+    def central_size(self) -> int:
+        return CENTRAL_HEADER.size + len(self.name) + ZIP64_CENTRAL_EXTRA.size
+
+
+def _dos_datetime(timestamp: float) -> Tuple[int, int]:
+    moment = datetime.fromtimestamp(timestamp)
+    year = max(moment.year, 1980)
+    dos_time = (moment.hour << 11) | (moment.minute << 5) | (moment.second // 2)
+    dos_date = ((year - 1980) << 9) | (moment.month << 5) | moment.day
+    return dos_time, dos_date
+
+
+def _read_chunk(file: BinaryIO, crc: int) -> Tuple[bytes, int]:
+    chunk = file.read(CHUNK_SIZE)
+    return chunk, zlib.crc32(chunk, crc)
+
+
+class ZipBundle:
+    """Monta um ZIP64 a partir de arquivos existentes, com tamanho conhecido de antemão."""
+
+    def __init__(self, paths: List[Path]):
+        self.entries: List[BundleEntry] = []
+        try:
+            for path in paths:
+                self.entries.append(BundleEntry(path))
+        except BaseException:
+            self.close()
+            raise
+
+    def content_length(self) -> int:
+        entries = sum(entry.stream_size() + entry.central_size() for entry in self.entries)
+        return entries + ZIP64_END.size + ZIP64_LOCATOR.size + END_RECORD.size
+
+    def _end_records(self, cd_offset: int, cd_size: int) -> bytes:
+        count = len(self.entries)
+        zip64_end_offset = cd_offset + cd_size
+        return (
+            ZIP64_END.pack(0x06064B50, ZIP64_END.size - 12, (3 << 8) | ZIP_VERSION, ZIP_VERSION,
+                           0, 0, count, count, cd_size, cd_offset)
+            + ZIP64_LOCATOR.pack(0x07064B50, 0, zip64_end_offset, 1)
+            + END_RECORD.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, ZIP64_MARKER, ZIP64_MARKER, 0)
+        )
+
+    async def _produce(self, queue: asyncio.Queue):
+        # Lê do disco em uma thread enquanto o chunk anterior é enviado ao cliente
+        try:
+            offset = 0
+            for entry in self.entries:
+                entry.offset = offset
+                header = entry.local_header()
+                await queue.put(header)
+                while True:
+                    chunk, crc = await run_io(_read_chunk, entry.file, entry.crc)
+                    if not chunk:
+                        break
+                    entry.crc = crc
+                    await queue.put(chunk)
+                await queue.put(entry.data_descriptor())
+                offset += entry.stream_size()
+
+            central = b"".join(entry.central_header() for entry in self.entries)
+            await queue.put(central + self._end_records(offset, len(central)))
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        # A fila limita a memória a BUNDLE_PREFETCH_CHUNKS chunks, qualquer que seja o total
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.BUNDLE_PREFETCH_CHUNKS)
+        producer = asyncio.ensure_future(self._produce(queue))
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            producer.cancel()
+            self.close()
+
+    def close(self):
+        for entry in self.entries:
+            entry.file.close()
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+from typing import Dict, Optional, Set
+from loguru import logger
+
+# Cancelamento cooperativo quando o cliente desconecta: o token é marcado no
+# event loop e verificado pela thread de compressão entre blocos. A vaga de
+# CPU é liberada assim que o token dispara, sem esperar o bloco em andamento,
+# e o tempo de CPU já gasto pelos jobs do token é contado como desperdício.
+
+CANCEL_STATS = {
+    "disconnects": 0,
+    "cancelled_jobs": 0,
+    "wasted_cpu_seconds": 0.0,
+}
+
+
+class CompressionCancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self):
+        self._flag = threading.Event()
+        self._event: Optional[asyncio.Event] = None
+        self.cpu_seconds = 0.0
+        self.lock = threading.Lock()
+        # Compressões em threads que o cancelamento abandonou e ainda não chegaram a um ponto de cancelamento
+        self.running: Set[asyncio.Future] = set()
+
+    @property
+    def event(self) -> asyncio.Event:
+        # Criado sob demanda no event loop
+        if self._event is None:
+            self._event = asyncio.Event()
+            if self._flag.is_set():
+                self._event.set()
+        return self._event
+
+    @property
+    def cancelled(self) -> bool:
+        return self._flag.is_set()
+
+    def cancel(self):
+        """Cancela e contabiliza como desperdício a CPU já gasta pelos jobs do token."""
+        with self.lock:
+            if self._flag.is_set():
+                return
+            self._flag.set()
+            CANCEL_STATS["wasted_cpu_seconds"] += self.cpu_seconds
+        self.event.set()
+        CANCEL_STATS["cancelled_jobs"] += 1
+
+    def check(self):
+        """Ponto de cancelamento, chamado pela thread de compressão entre blocos."""
+        if self._flag.is_set():
+            raise CompressionCancelled()
+
+    def track(self, future: asyncio.Future):
+        self.running.add(future)
+        future.add_done_callback(self._untrack)
+
+    def _untrack(self, future: asyncio.Future):
+        self.running.discard(future)
+        if not future.cancelled():
+            future.exception()  # Ninguém mais espera o resultado de uma thread abandonada
+
+    async def settle(self):
+        """Espera as threads do token pararem, antes de remover os arquivos que elas usam."""
+        if self.running:
+            await asyncio.wait(set(self.running))
+
+    def add_cpu(self, seconds: float):
+        with self.lock:
+            self.cpu_seconds += seconds
+            # Jobs que terminam depois do cancelamento também são desperdício
+            if self._flag.is_set():
+                CANCEL_STATS["wasted_cpu_seconds"] += seconds
+
+
+async def watch_disconnect(request, token: CancelToken):
+    """Cancela o token quando chega http.disconnect; só para corpos já lidos por inteiro.
+
+    Espera a mensagem em vez de consultar request.is_disconnected(), que
+    nunca a vê por trás de BaseHTTPMiddleware.
+    """
+    while not token.cancelled:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            CANCEL_STATS["disconnects"] += 1
+            logger.info(f"Cliente desconectou, cancelando o processamento: {request.url.path}")
+            token.cancel()
+            return
+
+
+def stats() -> Dict[str, float]:
+    return {**CANCEL_STATS, "wasted_cpu_seconds": round(CANCEL_STATS["wasted_cpu_seconds"], 3)}
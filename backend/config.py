@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import Dict, List
 import os
 from pathlib import Path
 import secrets
@@ -28,24 +28,129 @@ class Settings(BaseSettings):
     
     # Limites e restrições
     MAX_FILE_SIZE: int = 1024 * 1024 * 1024 * 2  # 2GB
+    MULTIPART_OVERHEAD: int = 1024 * 64  # folga para cabeçalhos multipart no Content-Length
     ALLOWED_EXTENSIONS: List[str] = [
         ".txt", ".pdf", ".doc", ".docx", ".xls", ".xlsx",
         ".jpg", ".jpeg", ".png", ".gif", ".zip", ".rar"
     ]
-    MAX_UPLOAD_CONCURRENCY: int = 5
+    # Concorrência por estágio: a recepção pela rede só espera o cliente, então
+    # o limite é alto; a compressão é limitada pelos núcleos de CPU
+    MAX_UPLOAD_CONCURRENCY: int = 100
     MAX_COMPRESSION_CONCURRENCY: int = 3
+    STAGING_MAX_BYTES: int = 1024 * 1024 * 1024 * 8  # 8GB de uploads aguardando compressão
+    
+    # Escalonamento das vagas de compressão: "sjf" (menor job primeiro) ou "fifo"
+    SCHEDULER_POLICY: str = "sjf"
+    SCHEDULER_AGING_BYTES_PER_SECOND: int = 1024 * 1024 * 10  # cada segundo na fila vale 10MB a menos
+    EXPRESS_SLOTS: int = 1  # vagas reservadas para jobs pequenos (faixa expressa)
+    EXPRESS_MAX_BYTES: int = 1024 * 1024 * 16
+    # Fatia máxima de um job em blocos antes de ceder a vaga a um job mais urgente (0 = sem preempção)
+    SCHEDULER_MAX_SLICE_SECONDS: float = 2.0
+    # Classe de prioridade por API Key (0 = mais alta); chaves fora do mapa usam a padrão
+    API_KEY_PRIORITIES: Dict[str, int] = {}
+    DEFAULT_PRIORITY: int = 1
+    # Divisão justa da CPU entre API Keys, proporcional ao peso de cada chave
+    SCHEDULER_FAIR_SHARE: bool = True
+    API_KEY_WEIGHTS: Dict[str, float] = {}
+    DEFAULT_WEIGHT: float = 1.0
+    
+    # Admissão: recusa uploads com 503 se a espera estimada pela compressão passar do limite
+    ADMISSION_MAX_WAIT_SECONDS: float = 60.0
+    ADMISSION_INITIAL_MB_PER_SECOND: float = 5.0  # vazão por vaga até haver medições
+    
+    # Cota de upload por API Key em uma janela deslizante (0 = sem cota)
+    UPLOAD_QUOTA_BYTES: int = 1024 * 1024 * 1024 * 20  # 20GB
+    UPLOAD_QUOTA_WINDOW_SECONDS: int = 60 * 60
+    
+    # Orçamento de disco dos artefatos e uploads em andamento (0 = sem limite); acima da
+    # marca alta, artefatos são removidos por GDSF até a marca baixa
+    DISK_BUDGET_BYTES: int = 1024 * 1024 * 1024 * 20  # 20GB
+    DISK_HIGH_WATERMARK: float = 0.9
+    DISK_LOW_WATERMARK: float = 0.8
+    # Cota de disco por API Key (0 = sem cota); chaves fora do mapa usam a padrão
+    API_KEY_DISK_QUOTAS: Dict[str, int] = {}
+    DEFAULT_DISK_QUOTA_BYTES: int = 1024 * 1024 * 1024 * 5  # 5GB
+    
+    # Tamanho de cada bloco independente do .xz seekable
+    SEEKABLE_BLOCK_SIZE: int = 1024 * 1024 * 4  # 4MB
+    
+    # Uploads até este tamanho são compactados em memória, sem arquivo temporário
+    SMALL_UPLOAD_THRESHOLD: int = 1024 * 1024 * 4  # 4MB
+    
+    # Modo preguiçoso: compacta pendentes quando a carga por CPU estiver abaixo do limite
+    LAZY_IDLE_INTERVAL_SECONDS: int = 30
+    LAZY_IDLE_MAX_LOAD: float = 0.5
+    
+    # Tamanho padrão dos chunks de upload retomável (múltiplo do bloco seekable)
+    RESUMABLE_CHUNK_SIZE: int = 1024 * 1024 * 8  # 8MB
+    
+    # Processos de compressão do upload cru, alimentados por ring buffer em
+    # memória compartilhada (0 = compacta em threads no próprio processo)
+    COMPRESSION_WORKER_PROCESSES: int = 0
+    SHM_RING_SLOTS: int = 4  # slots do tamanho de um bloco seekable por processo
+    SHM_RING_TIMEOUT_SECONDS: int = 60  # prazo de um bloco; depois disso o processo é substituído
+    
+    # Fila persistente (SQLite) dos jobs de compressão, retomados após reinícios
+    JOB_QUEUE_BATCH_SIZE: int = 32  # jobs reservados por vez ao retomar a fila
+    JOB_MAX_ATTEMPTS: int = 3  # tentativas antes de descartar um job que sempre falha
+    JOB_POLL_INTERVAL_SECONDS: float = 0.2  # consultas à fila por resultados e por jobs novos
+    JOB_RECOVER_INTERVAL_SECONDS: int = 30  # frequência com que os workers recuperam jobs de workers mortos
+    # Compressão dos uploads em processos worker.py separados; o servidor só recebe e serve
+    EXTERNAL_WORKERS: bool = False
+    WORKER_THREADS: int = 3  # jobs compactados em paralelo por processo worker
+    
+    # Pool de threads dedicado ao I/O de disco
+    IO_THREADS: int = 8
+    IO_MAX_INFLIGHT_WRITES: int = 8  # chunks aguardando escrita por arquivo
+    IO_BATCH_BYTES: int = 1024 * 1024 * 4  # agrupa escritas em lotes de até 4MB
+    
+    # Pool de buffers reutilizáveis dos loops de upload e compressão
+    BUFFER_SIZE: int = 1024 * 1024  # 1MB
+    BUFFER_POOL_MAX_BYTES: int = 1024 * 1024 * 64  # buffers livres mantidos por tamanho
+    
+    # Download de vários artefatos em um único ZIP
+    MAX_BUNDLE_FILES: int = 100
+    BUNDLE_PREFETCH_CHUNKS: int = 4  # chunks de 1MB lidos à frente do envio
     
     # Diretórios
     BASE_DIR: Path = Path(__file__).resolve().parent
     UPLOAD_DIR: Path = BASE_DIR / "uploads"
     COMPRESSED_DIR: Path = BASE_DIR / "compressed"
     LOG_DIR: Path = BASE_DIR / "logs"
+    VARIANT_DIR: Path = BASE_DIR / "variants"
+    PENDING_DIR: Path = BASE_DIR / "pending"
+    RESUMABLE_DIR: Path = BASE_DIR / "resumable"
+    STATE_DIR: Path = BASE_DIR / "state"  # bancos SQLite locais
+    JOB_QUEUE_DB: Path = STATE_DIR / "jobs.db"  # em disco local, compartilhado pelo servidor e pelos workers da máquina
+    EXPIRY_DB: Path = STATE_DIR / "expiry.db"
+    ARTIFACTS_DB: Path = STATE_DIR / "artifacts.db"
+    STORAGE_SHARD_LEVELS: int = 2  # níveis de 256 subdiretórios em COMPRESSED_DIR e UPLOAD_DIR; 0 = plano
+    PACK_DIR: Path = BASE_DIR / "packs"  # segmentos com os artefatos pequenos
+    PACK_DB: Path = STATE_DIR / "packs.db"
+    
+    # Artefatos pequenos anexados a segmentos em vez de arquivos próprios
+    PACK_MAX_ARTIFACT_BYTES: int = 1024 * 256  # 256KB compactados; acima disso, arquivo próprio
+    PACK_SEGMENT_BYTES: int = 1024 * 1024 * 64  # 64MB
+    PACK_COMPACT_THRESHOLD: float = 0.5  # fração de bytes mortos que dispara a reescrita do segmento
+    PACK_COMPACT_INTERVAL_SECONDS: int = 60 * 10
+    
+    # Metadados de artefatos mantidos em memória (LRU) para o download
+    ARTIFACT_CACHE_ENTRIES: int = 10000
+    
+    # Cache em memória dos artefatos pequenos mais baixados, com admissão por frequência (TinyLFU)
+    HOT_CACHE_MAX_BYTES: int = 1024 * 1024 * 64  # 64MB (0 = desligado)
+    HOT_CACHE_MAX_ARTIFACT_BYTES: int = 1024 * 1024  # acima disso, o download lê do disco
+    
+    # Cache de variantes transcodificadas no download (format=)
+    VARIANT_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024 * 1  # 1GB
     
     # Configurações de Rate Limiting
     RATE_LIMIT_PER_MINUTE: int = 60
     
     # Tempo de expiração para arquivos (em horas)
     FILE_EXPIRATION_HOURS: int = 24
+    EXPIRY_BATCH_SIZE: int = 500  # arquivos vencidos removidos por lote
+    EXPIRY_MAX_SLEEP_SECONDS: int = 60 * 60  # limpeza acorda ao menos de hora em hora
     
     # Chave mestra para administração (gerada automaticamente)
     MASTER_KEY: str = secrets.token_urlsafe(32)
@@ -0,0 +1,69 @@
+import asyncio
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlitedb import SQLiteStore
+
+# Índice de expiração: cada arquivo criado pelo servidor é registrado com o
+# seu prazo, e a tabela indexada por prazo faz o papel de um heap persistido.
+# A limpeza dorme até o próximo prazo e remove só o que venceu, em lotes,
+# em vez de listar e fazer stat de todos os arquivos de hora em hora.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS expiry (
+    path TEXT PRIMARY KEY,
+    deadline REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS expiry_deadline ON expiry (deadline);
+"""
+
+
+class ExpiryIndex(SQLiteStore):
+    def __init__(self, path: Path, ttl: float):
+        super().__init__(path, SCHEMA)
+        self.ttl = ttl
+        self.expired = 0
+
+    def schedule(self, path: Path, deadline: Optional[float] = None) -> asyncio.Future:
+        """Registra o arquivo para remoção no prazo (padrão: agora + ttl), sem precisar ser aguardado."""
+        return self._submit_nowait(
+            "INSERT OR REPLACE INTO expiry (path, deadline) VALUES (?, ?)",
+            (str(path), deadline if deadline is not None else time.time() + self.ttl)
+        )
+
+    # Operações síncronas, para o pool de I/O
+
+    def schedule_missing(self, entries: Iterable[Tuple[Path, float]]) -> int:
+        """Registra arquivos ainda fora do índice, mantendo o prazo dos que já estão."""
+        with self.lock:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO expiry (path, deadline) VALUES (?, ?)",
+                ((str(path), deadline) for path, deadline in entries)
+            )
+            return self.conn.total_changes - before
+
+    def next_deadline(self) -> Optional[float]:
+        with self.lock:
+            return self.conn.execute("SELECT MIN(deadline) FROM expiry").fetchone()[0]
+
+    def due(self, now: float, limit: int) -> List[Path]:
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path FROM expiry WHERE deadline <= ? ORDER BY deadline LIMIT ?", (now, limit)
+            ).fetchall()
+        return [Path(row[0]) for row in rows]
+
+    def discard(self, paths: List[Path]):
+        self._transaction([("DELETE FROM expiry WHERE path = ?", (str(path),)) for path in paths])
+        self.expired += len(paths)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            tracked, next_deadline = self.conn.execute("SELECT COUNT(*), MIN(deadline) FROM expiry").fetchone()
+        return {
+            "tracked": tracked,
+            "expired": self.expired,
+            "next_expiry_in_seconds": round(next_deadline - time.time(), 3) if next_deadline else None,
+            **self.batch_stats(),
+        }
@@ -0,0 +1,242 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import AsyncIterator, BinaryIO, Dict, List, Optional
+from config import settings
+from bufferpool import BufferPool
+
+# Camada de I/O de disco assíncrona: todas as operações de arquivo bloqueantes
+# rodam em um pool de threads dedicado, separado do pool padrão usado pela
+# compressão, para que disco lento não trave o event loop nem a CPU.
+
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=settings.IO_THREADS, thread_name_prefix="io")
+
+IO_STATS = {
+    "operations": 0,
+    "write_batches": 0,
+    "bytes_written": 0,
+    "bytes_read": 0,
+}
+
+
+async def run_io(func, *args, **kwargs):
+    IO_STATS["operations"] += 1
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(IO_EXECUTOR, partial(func, *args, **kwargs))
+
+
+def _write_all(fd: int, buffers: List[bytes]):
+    if not hasattr(os, "writev"):
+        data = b"".join(buffers)
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+        return
+
+    views = [memoryview(buffer) for buffer in buffers]
+    while views:
+        written = os.writev(fd, views)
+        while views and written >= len(views[0]):
+            written -= len(views[0])
+            views.pop(0)
+        if written:
+            views[0] = views[0][written:]
+
+
+def _release_batch(batch: List, pooled: List):
+    batch.clear()
+    for pool, buffer in pooled:
+        pool.release(buffer)
+
+
+def _release_written(batch: List, pooled: List, write: asyncio.Future):
+    if not write.cancelled():
+        write.exception()  # O erro de uma escrita abandonada não interessa mais
+    _release_batch(batch, pooled)
+
+
+class AsyncFileWriter:
+    """Grava um arquivo sem bloquear o event loop.
+
+    As escritas entram em uma fila limitada (IO_MAX_INFLIGHT_WRITES), que gera
+    backpressure no produtor, e são agrupadas em um único writev por lote.
+    O conteúdo vai para um arquivo temporário que só é renomeado para o
+    destino final em commit(), de forma atômica.
+    """
+
+    def __init__(self, path: Path, expected_size: Optional[int] = None):
+        self.path = path
+        self.tmp_path = path.with_name(f"{path.name}.part")
+        self.expected_size = expected_size
+        self.size = 0
+        self.fd: Optional[int] = None
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.IO_MAX_INFLIGHT_WRITES)
+        self.task: Optional[asyncio.Task] = None
+        # Escrita do lote atual no pool de I/O; cancelar o dreno não a interrompe
+        self.inflight: Optional[asyncio.Future] = None
+        self.error: Optional[BaseException] = None
+
+    def _open(self) -> int:
+        fd = os.open(self.tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        if self.expected_size and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fd, 0, self.expected_size)
+            except OSError:
+                pass  # Nem todo sistema de arquivos suporta pré-alocação
+        return fd
+
+    async def open(self):
+        self.fd = await run_io(self._open)
+        self.task = asyncio.ensure_future(self._drain())
+        return self
+
+    async def _drain(self):
+        finished = False
+        while not finished:
+            batch = []
+            pooled = []
+            batch_bytes = 0
+            item = await self.queue.get()
+            while True:
+                if item is None:
+                    finished = True
+                    break
+                data, pool, buffer = item
+                batch.append(data)
+                if pool:
+                    pooled.append((pool, buffer))
+                batch_bytes += len(data)
+                if batch_bytes >= settings.IO_BATCH_BYTES or self.queue.empty():
+                    break
+                item = self.queue.get_nowait()
+            try:
+                if batch and self.error is None:
+                    self.inflight = asyncio.ensure_future(run_io(_write_all, self.fd, batch))
+                    await asyncio.shield(self.inflight)
+                    IO_STATS["write_batches"] += 1
+                    IO_STATS["bytes_written"] += batch_bytes
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Continua consumindo a fila para o produtor não ficar preso em put()
+                self.error = e
+            finally:
+                if self.inflight is None or self.inflight.done():
+                    _release_batch(batch, pooled)
+                else:
+                    # Cancelado no meio da escrita: a thread ainda lê os buffers do lote
+                    self.inflight.add_done_callback(partial(_release_written, batch, pooled))
+
+    async def write(self, data: bytes):
+        if self.error:
+            # Propaga erros de escrita para o produtor
+            raise self.error
+        await self.queue.put((data, None, None))
+        self.size += len(data)
+
+    async def write_pooled(self, pool: BufferPool, buffer: bytearray, length: int):
+        """Enfileira os primeiros length bytes de um buffer do pool, devolvendo-o após a escrita."""
+        if self.error:
+            pool.release(buffer)
+            raise self.error
+        await self.queue.put((memoryview(buffer)[:length], pool, buffer))
+        self.size += length
+
+    def _finish(self):
+        try:
+            # Descarta a parte pré-alocada que não foi usada
+            os.ftruncate(self.fd, self.size)
+        finally:
+            os.close(self.fd)
+            self.fd = None
+        os.replace(self.tmp_path, self.path)
+
+    async def commit(self) -> Path:
+        await self.queue.put(None)
+        await self.task
+        if self.error:
+            raise self.error
+        await run_io(self._finish)
+        return self.path
+
+    def _discard(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self.tmp_path.unlink(missing_ok=True)
+
+    def _release_queued(self):
+        # Itens que o dreno cancelado não chegou a pegar; os do lote em andamento ele mesmo devolve
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if item is not None and item[1]:
+                item[1].release(item[2])
+
+    async def abort(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except BaseException:
+                pass
+            if self.inflight and not self.inflight.done():
+                # Só fecha o fd depois que a escrita em andamento no pool de I/O termina
+                await asyncio.wait({self.inflight})
+            self._release_queued()
+        await run_io(self._discard)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.abort()
+
+
+async def iter_file(file: BinaryIO, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    """Lê um arquivo já aberto em chunks, fechando-o ao final."""
+    try:
+        while chunk := await run_io(file.read, chunk_size):
+            IO_STATS["bytes_read"] += len(chunk)
+            yield chunk
+    finally:
+        await run_io(file.close)
+
+
+def _write_atomic(path: Path, data: bytes):
+    tmp_path = path.with_name(f"{path.name}.part")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        _write_all(fd, [data])
+    except BaseException:
+        os.close(fd)
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, path)
+    IO_STATS["bytes_written"] += len(data)
+
+
+async def write_atomic(path: Path, data: bytes):
+    """Grava um conteúdo já em memória com uma única escrita e rename atômico."""
+    await run_io(_write_atomic, path, data)
+
+
+def _remove_if_exists(path: Path) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+async def remove(path: Path) -> bool:
+    return await run_io(_remove_if_exists, path)
+
+
+def stats() -> Dict[str, int]:
+    return {**IO_STATS, "threads": settings.IO_THREADS}
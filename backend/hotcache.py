@@ -0,0 +1,139 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Cache em memória dos artefatos pequenos mais baixados (links compartilhados
+# costumam ser baixados centenas de vezes logo após o upload): um acerto é
+# respondido com os bytes já em memória, sem ler o disco nem o segmento.
+#
+# O espaço é limitado em bytes, com remoção LRU, e a admissão segue o
+# TinyLFU: cada download conta num count-min sketch de contadores de 4 bits,
+# e um artefato só entra se for mais frequente que todos os que teria de tirar.
+# Assim um único download de algo novo não expulsa o que é baixado sempre.
+# Os contadores são divididos por dois de tempos em tempos, para que a
+# frequência antiga não domine.
+
+SKETCH_ROWS = 4
+SKETCH_WIDTH = 1 << 16  # 16 bits do hash por linha
+COUNTER_MAX = 15
+RESET_AFTER = SKETCH_WIDTH * 8  # incrementos até o envelhecimento dos contadores
+HALVE = bytes(value >> 1 for value in range(256))
+
+
+class FrequencySketch:
+    def __init__(self):
+        self.rows = [bytearray(SKETCH_WIDTH) for _ in range(SKETCH_ROWS)]
+        self.increments = 0
+
+    @staticmethod
+    def _indexes(key: str) -> List[int]:
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        return [(digest >> (16 * row)) & (SKETCH_WIDTH - 1) for row in range(SKETCH_ROWS)]
+
+    def increment(self, key: str):
+        for row, index in zip(self.rows, self._indexes(key)):
+            if row[index] < COUNTER_MAX:
+                row[index] += 1
+        self.increments += 1
+        if self.increments >= RESET_AFTER:
+            self._age()
+
+    def estimate(self, key: str) -> int:
+        return min(row[index] for row, index in zip(self.rows, self._indexes(key)))
+
+    def _age(self):
+        for row in self.rows:
+            row[:] = row.translate(HALVE)
+        self.increments //= 2
+
+
+class HotCache:
+    def __init__(self, max_bytes: int, max_entry_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self.total_bytes = 0
+        self.sketch = FrequencySketch()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_served = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def eligible(self, size: Optional[int]) -> bool:
+        # Artefatos grandes passam direto para o disco, sem contar no sketch
+        return bool(self.max_bytes) and size is not None and size <= self.max_entry_bytes
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            self.sketch.increment(name)
+            data = self.entries.get(name)
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(name)
+            self.hits += 1
+            self.bytes_served += len(data)
+            return data
+
+    def _victims(self, name: str, size: int) -> Optional[List[str]]:
+        # Menos usados primeiro, até liberar o espaço; None se o candidato perde para algum deles
+        frequency = self.sketch.estimate(name)
+        victims = []
+        free = self.max_bytes - self.total_bytes
+        for victim, data in self.entries.items():
+            if free >= size:
+                break
+            if self.sketch.estimate(victim) >= frequency:
+                return None
+            victims.append(victim)
+            free += len(data)
+        return victims if free >= size else None
+
+    def admits(self, name: str, size: int) -> bool:
+        """Se o artefato entraria agora; o download só lê o arquivo inteiro para o cache quando entra."""
+        with self.lock:
+            if name in self.entries:
+                return False
+            if size > self.max_bytes or self._victims(name, size) is None:
+                self.rejected += 1
+                return False
+            return True
+
+    def put(self, name: str, data: bytes) -> bool:
+        with self.lock:
+            if name in self.entries or len(data) > self.max_bytes:
+                return False
+            victims = self._victims(name, len(data))
+            if victims is None:
+                self.rejected += 1
+                return False
+            for victim in victims:
+                self.total_bytes -= len(self.entries.pop(victim))
+            self.entries[name] = data
+            self.total_bytes += len(data)
+            self.admitted += 1
+            return True
+
+    def discard(self, name: str):
+        with self.lock:
+            data = self.entries.pop(name, None)
+            if data is not None:
+                self.total_bytes -= len(data)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "bytes_served": self.bytes_served,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
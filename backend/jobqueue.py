@@ -0,0 +1,352 @@
+import asyncio
+import os
+import re
+import secrets
+import socket
+import sqlite3
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from fileio import run_io
+from seekable import SeekableXZJob, compress_zip_fallback
+from sqlitedb import SQLiteStore
+from storage import COMPRESSED
+
+# Fila persistente dos jobs de compressão, em SQLite no modo WAL. Cada upload
+# já em staging é registrado antes de ser compactado e removido da fila ao
+# terminar; se o processo morrer no meio (um deploy, por exemplo), o próximo
+# processo encontra o job e retoma a compactação do arquivo em staging.
+#
+# A mesma fila alimenta os workers externos (worker.py): o servidor registra
+# o job sem dono, um worker o reserva, compacta e grava o resultado na linha,
+# e o servidor, que consulta a fila periodicamente, responde ao cliente.
+#
+# O banco precisa estar em um disco local: o modo WAL do SQLite não funciona
+# em sistemas de arquivos de rede. Servidor e workers rodam, portanto, na
+# mesma máquina que o banco.
+
+# Identifica esta execução do processo: a máquina, e o pid com um sufixo
+# aleatório, já que um pid sozinho se repete após reinícios
+HOST = re.sub(r"[^A-Za-z0-9.-]", "-", socket.gethostname()) or "local"
+OWNER = f"{HOST}@{os.getpid()}-{secrets.token_hex(4)}"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    staged_path TEXT NOT NULL,
+    artifact TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    level INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    owner TEXT,
+    submitter TEXT,
+    tenant TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    compressed_size INTEGER,
+    content_hash TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+"""
+
+
+@dataclass
+class QueuedJob:
+    staged_path: Path
+    artifact: str  # nome do artefato sem a extensão, que depende do codec escolhido
+    filename: str  # nome do original dentro do artefato
+    codec: str
+    level: int
+    size: int
+    id: Optional[int] = None
+    attempts: int = 0
+    tenant: Optional[str] = None  # dono do artefato, para registrá-lo mesmo se o job for retomado
+
+    @classmethod
+    def from_row(cls, row: Tuple) -> "QueuedJob":
+        job_id, staged_path, artifact, filename, codec, level, size, attempts, tenant = row
+        return cls(Path(staged_path), artifact, filename, codec, level, size, job_id, attempts, tenant)
+
+
+def compress_queued_job(job: QueuedJob, checkpoint: Optional[Callable[[], None]] = None) -> Tuple[Path, int, str]:
+    """Compactação de um job pelos workers externos, com a mesma escolha de
+    compress_staged no servidor: xz seekable e, se não reduzir o tamanho, ZIP.
+
+    Retorna o artefato, o tamanho compactado e o sha256 do original.
+    """
+    xz_path = COMPRESSED.prepare(f"{job.artifact}.xz")
+    zip_path = COMPRESSED.prepare(f"{job.artifact}.zip")
+    try:
+        xz_job = SeekableXZJob(job.staged_path, xz_path, job.level)
+        try:
+            while True:
+                if checkpoint:
+                    checkpoint()
+                if not xz_job.step():
+                    break
+        finally:
+            xz_job.close()
+        content_hash = xz_job.hash.hexdigest()
+        if xz_job.bytes_out < job.size:
+            return xz_path, xz_job.bytes_out, content_hash
+        final_path = compress_zip_fallback(job.staged_path, xz_path, zip_path, job.filename, job.level, checkpoint)
+        return final_path, final_path.stat().st_size, content_hash
+    except BaseException:
+        xz_path.unlink(missing_ok=True)
+        zip_path.unlink(missing_ok=True)
+        raise
+
+
+def owner_alive(owner: Optional[str]) -> bool:
+    if not owner:
+        return False
+    if owner == OWNER:
+        return True
+    host, _, process = owner.rpartition("@")
+    if host and host != HOST:
+        # Não dá para consultar um processo de outra máquina: nunca é tido como morto
+        return True
+    pid = int(process.split("-", 1)[0])
+    if pid == os.getpid() or os.name == "nt":
+        # Execução anterior deste processo; no Windows os.kill encerraria o processo
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class JobQueue(SQLiteStore):
+    def __init__(self, path: Path, poll_interval: float = 0.2):
+        super().__init__(path, SCHEMA)
+        self.poll_interval = poll_interval
+        self.waiters: Dict[int, asyncio.Future] = {}
+        self.poller: Optional[asyncio.Task] = None
+        self.resumed = 0
+
+    def _migrate(self, conn: sqlite3.Connection):
+        # Bancos criados antes da coluna tenant; o servidor e os workers podem migrar ao mesmo tempo
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "tenant" not in columns:
+            try:
+                conn.execute("ALTER TABLE jobs ADD COLUMN tenant TEXT")
+            except sqlite3.OperationalError as e:
+                if "duplicate column" not in str(e):
+                    raise
+
+    # Operações síncronas, para o pool de I/O e para processos fora do event loop
+
+    def enqueue_many(self, jobs: List[QueuedJob], owner: Optional[str] = None) -> List[int]:
+        """Registra os jobs numa única transação; com owner, já saem reservados para ele."""
+        now = time.time()
+        state = "running" if owner else "queued"
+        ids = self._transaction([self._insert(job, state, owner, now) for job in jobs])
+        for job, job_id in zip(jobs, ids):
+            job.id = job_id
+        return ids
+
+    def claim(self, limit: int, owner: str = OWNER) -> List[QueuedJob]:
+        """Reserva até limit jobs da fila, os mais antigos primeiro."""
+        with self.lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, staged_path, artifact, filename, codec, level, size, attempts, tenant "
+                    "FROM jobs WHERE state = 'queued' ORDER BY id LIMIT ?", (limit,)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE jobs SET state = 'running', owner = ?, attempts = attempts + 1, updated = ? WHERE id = ?",
+                    [(owner, time.time(), row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        jobs = [QueuedJob.from_row(row) for row in rows]
+        for job in jobs:
+            job.attempts += 1
+        return jobs
+
+    def finish_many(self, ids: List[int]):
+        self._transaction([("DELETE FROM jobs WHERE id = ?", (job_id,)) for job_id in ids])
+
+    def recover(self, max_attempts: int) -> int:
+        """Devolve à fila os jobs em andamento de processos que não existem mais.
+
+        Um job que já derrubou max_attempts processos é marcado como falho em
+        vez de voltar para a fila, e falhas que ninguém mais espera são
+        descartadas. Jobs concluídos ficam para adopt(), que registra o
+        artefato no lugar do servidor que caiu.
+        """
+        with self.lock:
+            owners = [row[0] for row in self.conn.execute("SELECT DISTINCT owner FROM jobs WHERE state = 'running'")]
+            submitters = [row[0] for row in self.conn.execute(
+                "SELECT DISTINCT submitter FROM jobs WHERE state = 'failed'"
+            )]
+        now = time.time()
+        operations = []
+        for owner in owners:
+            if not owner_alive(owner):
+                operations += [
+                    ("UPDATE jobs SET state = 'failed', error = 'processo interrompido', updated = ? "
+                     "WHERE state = 'running' AND owner IS ? AND attempts >= ?", (now, owner, max_attempts)),
+                    ("UPDATE jobs SET state = 'queued', owner = NULL, updated = ? "
+                     "WHERE state = 'running' AND owner IS ?", (now, owner)),
+                ]
+        orphaned = [submitter for submitter in submitters if not owner_alive(submitter)]
+        with self.lock:
+            staged_paths = [row[0] for submitter in orphaned for row in self.conn.execute(
+                "SELECT staged_path FROM jobs WHERE state = 'failed' AND submitter IS ?", (submitter,)
+            )]
+        operations += [
+            ("DELETE FROM jobs WHERE state = 'failed' AND submitter IS ?", (submitter,))
+            for submitter in orphaned
+        ]
+        self._transaction(operations)
+        # O staging é do servidor que registrou o job; se ele caiu, ninguém mais o remove
+        for staged_path in staged_paths:
+            Path(staged_path).unlink(missing_ok=True)
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM jobs WHERE state = 'queued'").fetchone()[0]
+
+    def adopt(self, limit: int, owner: str = OWNER) -> List[Tuple[QueuedJob, str, int, Optional[str]]]:
+        """Assume até limit jobs concluídos por workers depois de o servidor que os registrou cair.
+
+        Retorna cada job com o resultado, o tamanho compactado e o hash do
+        original, para o novo servidor registrar o artefato e remover o job.
+        """
+        with self.lock:
+            submitters = [row[0] for row in self.conn.execute("SELECT DISTINCT submitter FROM jobs WHERE state = 'done'")]
+        orphaned = [submitter for submitter in submitters if not owner_alive(submitter)]
+        if not orphaned:
+            return []
+        with self.lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    f"SELECT id, staged_path, artifact, filename, codec, level, size, attempts, tenant, "
+                    f"result, compressed_size, content_hash FROM jobs "
+                    f"WHERE state = 'done' AND submitter IN ({','.join('?' * len(orphaned))}) ORDER BY id LIMIT ?",
+                    (*orphaned, limit)
+                ).fetchall()
+                conn.executemany(
+                    "UPDATE jobs SET submitter = ?, updated = ? WHERE id = ?",
+                    [(owner, time.time(), row[0]) for row in rows]
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return [(QueuedJob.from_row(row[:9]), *row[9:]) for row in rows]
+
+    def depth(self) -> Tuple[int, int, int]:
+        """Jobs à espera de um worker, bytes ainda por compactar (na fila e em andamento) e jobs em andamento."""
+        with self.lock:
+            rows = dict((state, (count, size)) for state, count, size in self.conn.execute(
+                "SELECT state, COUNT(*), COALESCE(SUM(size), 0) FROM jobs "
+                "WHERE state IN ('queued', 'running') GROUP BY state"
+            ))
+        queued, queued_bytes = rows.get("queued", (0, 0))
+        running, running_bytes = rows.get("running", (0, 0))
+        return queued, queued_bytes + running_bytes, running
+
+    def state(self, job_id: int) -> Optional[str]:
+        """Estado do job; None se foi removido, o que para o worker significa cancelado."""
+        with self.lock:
+            row = self.conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+    def complete(self, job_id: int, result: str, compressed_size: int, content_hash: Optional[str] = None) -> bool:
+        """Grava o resultado do worker; False se o job foi cancelado enquanto rodava."""
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE jobs SET state = 'done', result = ?, compressed_size = ?, content_hash = ?, updated = ? "
+                "WHERE id = ? AND state = 'running'", (result, compressed_size, content_hash, time.time(), job_id)
+            ).rowcount > 0
+
+    def fail(self, job_id: int, error: str) -> bool:
+        with self.lock:
+            return self.conn.execute(
+                "UPDATE jobs SET state = 'failed', error = ?, updated = ? WHERE id = ? AND state = 'running'",
+                (error, time.time(), job_id)
+            ).rowcount > 0
+
+    def outcomes(self, ids: List[int]) -> Dict[int, Tuple[str, Optional[str], Optional[int], Optional[str], Optional[str]]]:
+        """Jobs já concluídos ou falhos entre ids, com resultado, tamanho, hash do original e erro."""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, state, result, compressed_size, content_hash, error FROM jobs "
+                f"WHERE id IN ({','.join('?' * len(ids))}) AND state IN ('done', 'failed')", ids
+            ).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    @staticmethod
+    def _insert(job: QueuedJob, state: str, owner: Optional[str], now: float) -> Tuple[str, Tuple]:
+        return (
+            "INSERT INTO jobs (staged_path, artifact, filename, codec, level, size, state, owner, submitter, tenant, created, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (str(job.staged_path), job.artifact, job.filename, job.codec, job.level, job.size, state, owner, OWNER,
+             job.tenant, now, now)
+        )
+
+    # Operações do event loop, agrupadas em transações
+
+    async def enqueue(self, job: QueuedJob, external: bool = False) -> int:
+        """Registra um job já reservado para este processo, ou na fila para os workers externos."""
+        if external:
+            job.id = await self._submit(*self._insert(job, "queued", None, time.time()))
+        else:
+            job.id = await self._submit(*self._insert(job, "running", OWNER, time.time()))
+        return job.id
+
+    def wait(self, job_id: int) -> asyncio.Future:
+        """Resolve com (estado, resultado, tamanho, hash, erro) quando um worker terminar o job."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[job_id] = future
+        future.add_done_callback(lambda _: self.waiters.pop(job_id, None))
+        if self.poller is None:
+            self.poller = asyncio.create_task(self._poll())
+        return future
+
+    async def _poll(self):
+        # Uma única consulta por intervalo cobre todos os jobs aguardados por este processo
+        try:
+            while self.waiters:
+                await asyncio.sleep(self.poll_interval)
+                try:
+                    outcomes = await run_io(self.outcomes, list(self.waiters))
+                except Exception:
+                    continue
+                for job_id, outcome in outcomes.items():
+                    future = self.waiters.get(job_id)
+                    if future and not future.done():
+                        future.set_result(outcome)
+        finally:
+            self.poller = None
+
+    def finish(self, job_id: int) -> asyncio.Future:
+        """Remove o job da fila; não precisa ser aguardado, um job repetido após queda é descartado."""
+        return self._submit_nowait("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def stats(self) -> Dict:
+        return {
+            **self.counts(),
+            **self.batch_stats(),
+            "awaiting_workers": len(self.waiters),
+            "resumed": self.resumed,
+        }
@@ -0,0 +1,121 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+from config import settings
+from bufferpool import get_pool
+from seekable import compress_block
+
+# Modo preguiçoso: o upload guarda o arquivo original em PENDING_DIR como
+# {artefato}.{nível}.pending e a compactação só acontece no primeiro download
+# (ou quando a CPU estiver ociosa). O artefato final tem o mesmo nome que
+# teria no modo normal, em COMPRESSED_DIR.
+
+PENDING_SUFFIX = ".pending"
+SAMPLE_SIZE = 256 * 1024
+
+
+def pending_path(artifact_name: str, level: int) -> Path:
+    return settings.PENDING_DIR / f"{artifact_name}.{level}{PENDING_SUFFIX}"
+
+
+def parse_pending_name(path: Path) -> Tuple[str, int]:
+    artifact_name, level = path.name[:-len(PENDING_SUFFIX)].rsplit(".", 1)
+    return artifact_name, int(level)
+
+
+def predict_size(path: Path, level: int) -> int:
+    """Estima o tamanho compactado a partir de amostras do início, meio e fim do arquivo."""
+    size = path.stat().st_size
+    if size <= SAMPLE_SIZE * 3:
+        with open(path, "rb") as f:
+            return len(compress_block(f.read(), level))
+
+    sampled = 0
+    compressed = 0
+    with open(path, "rb") as f:
+        for offset in (0, size // 2, size - SAMPLE_SIZE):
+            f.seek(offset)
+            sample = f.read(SAMPLE_SIZE)
+            sampled += len(sample)
+            compressed += len(compress_block(sample, level))
+
+    blocks = -(-size // settings.SEEKABLE_BLOCK_SIZE)
+    # Cada bloco seekable é um stream xz completo, com ~60 bytes de cabeçalho e índice
+    return int(size * compressed / sampled) + blocks * 64
+
+
+class PendingCompressor:
+    """Compacta um arquivo pendente bloco a bloco, gravando o artefato enquanto os blocos são consumidos."""
+
+    def __init__(self, source: Path, artifact_path: Path, level: int, write_artifact: bool = True):
+        self.source = source
+        self.artifact_path = artifact_path
+        self.level = level
+        self.part_path = artifact_path.with_name(f"{artifact_path.name}.part") if write_artifact else None
+        self.src = open(source, "rb")
+        self.dst = open(self.part_path, "wb") if self.part_path else None
+        self.blocks = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.hash = hashlib.sha256()
+        self.pool = get_pool(settings.SEEKABLE_BLOCK_SIZE)
+        self.buffer = None
+        self.committed = False
+
+    def next_block(self) -> Optional[bytes]:
+        if self.buffer is None:
+            self.buffer = self.pool.acquire()
+        length = self.src.readinto(self.buffer)
+        if not length and self.blocks:
+            return None
+        self.blocks += 1
+        self.bytes_in += length
+        with memoryview(self.buffer) as view:
+            self.hash.update(view[:length])
+            block = compress_block(view[:length], self.level)
+        if self.dst:
+            self.dst.write(block)
+        self.bytes_out += len(block)
+        return block
+
+    def step(self) -> bool:
+        """Compacta um bloco, para a compressão fatiada pelo escalonador."""
+        return self.next_block() is not None
+
+    def _release(self):
+        self.src.close()
+        if self.buffer is not None:
+            self.pool.release(self.buffer)
+            self.buffer = None
+
+    def commit(self) -> Optional[Path]:
+        """Publica o artefato, preservando o mtime do upload para a expiração."""
+        self._release()
+        if not self.dst:
+            return None
+        self.dst.close()
+        stat = self.source.stat()
+        os.utime(self.part_path, (stat.st_atime, stat.st_mtime))
+        os.replace(self.part_path, self.artifact_path)
+        self.committed = True
+        os.remove(self.source)
+        return self.artifact_path
+
+    def abort(self):
+        self._release()
+        if self.dst:
+            self.dst.close()
+            self.part_path.unlink(missing_ok=True)
+
+
+def oldest_pending() -> Optional[Path]:
+    oldest = None
+    with os.scandir(settings.PENDING_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(PENDING_SUFFIX):
+                continue
+            mtime = entry.stat().st_mtime
+            if oldest is None or mtime < oldest[0]:
+                oldest = (mtime, Path(entry.path))
+    return oldest[1] if oldest else None
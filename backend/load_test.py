@@ -1,6 +1,7 @@
 import aiohttp
 import asyncio
 import os
+import sys
 from pathlib import Path
 import time
 from datetime import datetime
@@ -10,6 +11,14 @@ NUM_CONCURRENT_USERS = 50  # Número de usuários simultâneos
 TEST_DURATION = 300  # Duração do teste em segundos
 BASE_URL = "http://localhost:8000"
 TEST_FILE_SIZE_MB = 10  # Tamanho do arquivo de teste em MB
+API_KEY = os.getenv("API_KEY", "dev_key")
+
+# Cenário misto: uploads grandes ocupando a compressão enquanto chegam arquivos pequenos
+MIXED_LARGE_UPLOADS = 4
+MIXED_LARGE_FILE_MB = 200
+MIXED_SMALL_UPLOADS = 200
+MIXED_SMALL_FILE_KB = 10
+MIXED_SMALL_INTERVAL = 0.1  # segundos entre uploads pequenos
 
 async def generate_test_file(size_mb):
     """Gera um arquivo de teste com o tamanho especificado"""
@@ -100,5 +109,61 @@ async def main():
     # Limpar arquivo de teste
     os.remove(file_path)
 
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(len(ordered) * pct / 100), len(ordered) - 1)
+    return ordered[index]
+
+async def timed_upload(session, payload, filename):
+    """Envia um upload e retorna a latência em segundos, ou None em caso de erro"""
+    start_time = time.time()
+    data = aiohttp.FormData()
+    data.add_field('file', payload, filename=filename)
+    try:
+        async with session.post(f"{BASE_URL}/upload/", data=data) as response:
+            await response.read()
+            if response.status != 200:
+                print(f"Erro em {filename}: HTTP {response.status}")
+                return None
+    except Exception as e:
+        print(f"Erro em {filename}: {str(e)}")
+        return None
+    return time.time() - start_time
+
+async def mixed_workload():
+    """Latência de arquivos pequenos com arquivos grandes disputando a compressão"""
+    print(f"Cenário misto: {MIXED_LARGE_UPLOADS} uploads de {MIXED_LARGE_FILE_MB}MB e "
+          f"{MIXED_SMALL_UPLOADS} uploads de {MIXED_SMALL_FILE_KB}KB")
+    large_payload = os.urandom(MIXED_LARGE_FILE_MB * 1024 * 1024)
+    small_payload = (b"linha de texto de exemplo para compactar\n" * 1024)[:MIXED_SMALL_FILE_KB * 1024]
+    
+    async with aiohttp.ClientSession(headers={"X-API-Key": API_KEY}) as session:
+        large_tasks = [
+            asyncio.create_task(timed_upload(session, large_payload, f"grande_{i}.txt"))
+            for i in range(MIXED_LARGE_UPLOADS)
+        ]
+        # Dá tempo para os arquivos grandes chegarem à compressão
+        await asyncio.sleep(2)
+        
+        small_tasks = []
+        for i in range(MIXED_SMALL_UPLOADS):
+            small_tasks.append(asyncio.create_task(timed_upload(session, small_payload, f"pequeno_{i}.txt")))
+            await asyncio.sleep(MIXED_SMALL_INTERVAL)
+        
+        small_latencies = [latency for latency in await asyncio.gather(*small_tasks) if latency is not None]
+        large_latencies = [latency for latency in await asyncio.gather(*large_tasks) if latency is not None]
+    
+    print("\nResultados do cenário misto:")
+    if small_latencies:
+        print(f"Pequenos: {len(small_latencies)} ok, p50 {percentile(small_latencies, 50) * 1000:.0f}ms, "
+              f"p99 {percentile(small_latencies, 99) * 1000:.0f}ms")
+    if large_latencies:
+        print(f"Grandes: {len(large_latencies)} ok, p50 {percentile(large_latencies, 50):.1f}s, "
+              f"máx {max(large_latencies):.1f}s")
+
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    # python load_test.py misto -> cenário de latência com carga mista
+    if len(sys.argv) > 1 and sys.argv[1] == "misto":
+        asyncio.run(mixed_workload())
+    else:
+        asyncio.run(main()) 
\ No newline at end of file
@@ -1,19 +1,46 @@
 from fastapi import FastAPI, UploadFile, HTTPException, Query, BackgroundTasks, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import Response, StreamingResponse, JSONResponse
 from fastapi.security import APIKeyHeader
+import hashlib
+import io
+from itertools import chain
 import os
 import zipfile
-import lzma
-import shutil
-from datetime import datetime, timedelta
+from datetime import datetime
 from loguru import logger
 import asyncio
 from pathlib import Path
+import time
 import traceback
-from typing import Optional
+from typing import Callable, Dict, List, Optional, Tuple
+from pydantic import BaseModel
+from starlette.requests import ClientDisconnect
 from config import settings
-from middleware import RateLimitMiddleware, SecurityHeadersMiddleware, FileValidationMiddleware
+from middleware import RateLimitMiddleware, SecurityHeadersMiddleware, FileValidationMiddleware, AdmissionMiddleware, UploadValidationMiddleware, DiskBudgetMiddleware
+from seekable import SeekableXZJob, SeekableXZWriter, compress_block, compress_zip_fallback, iter_file_range, iter_xz_range, iter_zip_range, xz_original_size, zip_original_size, parse_range
+from lazy import PendingCompressor, oldest_pending, parse_pending_name, pending_path, predict_size
+from bundle import ZipBundle
+from bufferpool import get_pool, readinto
+import bufferpool
+from fileio import AsyncFileWriter, iter_file, remove, run_io, write_atomic
+import fileio
+from metrics import LOOP_LAG, STARTED_AT
+from resumable import UploadSessionStore
+from shm_ring import RingWorkerPool
+from stages import Stage, StagingQuota
+from scheduler import CompressionScheduler, make_policy, tenant_for
+from admission import AdmissionController, QueueAdmission, UploadQuota
+from cancellation import CANCEL_STATS, CancelToken, CompressionCancelled, watch_disconnect
+from jobqueue import JobQueue, QueuedJob
+from expiry import ExpiryIndex
+from artifacts import Artifact, ArtifactStore
+from storage import COMPRESSED, UPLOADS
+from packstore import PackStore
+from budget import DiskBudget
+from hotcache import HotCache
+import cancellation
+from transcode import MEDIA_TYPES, VariantCache, available_formats, negotiate_format, stored_format, transcode
 import secrets
 
 # Lista global de API Keys (em produção, use um banco de dados)
@@ -27,6 +54,53 @@ app = FastAPI(
     root_path=os.getenv("ROOT_PATH", "")
 )
 
+# Estágios de concorrência: recepção pela rede, compressão e staging em disco
+NETWORK_STAGE = Stage("network", settings.MAX_UPLOAD_CONCURRENCY)
+CPU_STAGE = CompressionScheduler(
+    settings.MAX_COMPRESSION_CONCURRENCY,
+    make_policy(
+        settings.SCHEDULER_POLICY,
+        settings.SCHEDULER_AGING_BYTES_PER_SECOND,
+        fair_share=settings.SCHEDULER_FAIR_SHARE,
+        weights=settings.API_KEY_WEIGHTS,
+        default_weight=settings.DEFAULT_WEIGHT
+    ),
+    express_slots=settings.EXPRESS_SLOTS,
+    express_max_bytes=settings.EXPRESS_MAX_BYTES,
+    priorities=settings.API_KEY_PRIORITIES,
+    default_priority=settings.DEFAULT_PRIORITY,
+    max_slice=settings.SCHEDULER_MAX_SLICE_SECONDS
+)
+STAGING_QUOTA = StagingQuota(settings.STAGING_MAX_BYTES)
+
+# Admissão pela espera estimada na fila de compressão, antes de ler o corpo
+ADMISSION = AdmissionController(CPU_STAGE, settings.ADMISSION_MAX_WAIT_SECONDS, settings.ADMISSION_INITIAL_MB_PER_SECOND)
+# Fila persistente dos jobs de compressão, retomados após um reinício
+JOB_QUEUE = JobQueue(settings.JOB_QUEUE_DB, settings.JOB_POLL_INTERVAL_SECONDS)
+# Com workers externos, os uploads esperam pela fila persistente, não pelo estágio de CPU local
+UPLOAD_ADMISSION = (
+    QueueAdmission(ADMISSION, JOB_QUEUE.depth, settings.JOB_POLL_INTERVAL_SECONDS)
+    if settings.EXTERNAL_WORKERS else ADMISSION
+)
+# Adicionados antes dos demais para rodarem por dentro do CORS; a validação
+# pelos headers (413/400/401/429) roda antes da admissão (503)
+UPLOAD_QUOTA = UploadQuota(settings.UPLOAD_QUOTA_BYTES, settings.UPLOAD_QUOTA_WINDOW_SECONDS)
+# Orçamento de disco: a reserva (507) só é feita para uploads já admitidos
+DISK_BUDGET = DiskBudget(
+    settings.DISK_BUDGET_BYTES,
+    settings.DISK_HIGH_WATERMARK,
+    settings.DISK_LOW_WATERMARK,
+    settings.API_KEY_DISK_QUOTAS,
+    settings.DEFAULT_DISK_QUOTA_BYTES
+)
+app.add_middleware(DiskBudgetMiddleware, budget=DISK_BUDGET)
+app.add_middleware(AdmissionMiddleware, controller=UPLOAD_ADMISSION)
+app.add_middleware(
+    UploadValidationMiddleware,
+    is_valid_key=lambda key: key in API_KEYS or key == settings.MASTER_KEY,
+    quota=UPLOAD_QUOTA
+)
+
 # Configuração CORS
 app.add_middleware(
     CORSMiddleware,
@@ -44,6 +118,20 @@ app.add_middleware(SecurityHeadersMiddleware)
 settings.UPLOAD_DIR.mkdir(exist_ok=True)
 settings.COMPRESSED_DIR.mkdir(exist_ok=True)
 settings.LOG_DIR.mkdir(exist_ok=True)
+settings.VARIANT_DIR.mkdir(exist_ok=True)
+settings.PENDING_DIR.mkdir(exist_ok=True)
+settings.RESUMABLE_DIR.mkdir(exist_ok=True)
+settings.STATE_DIR.mkdir(exist_ok=True)
+settings.PACK_DIR.mkdir(exist_ok=True)
+
+# Prazos de remoção dos arquivos criados, consultados pela limpeza automática
+EXPIRY_INDEX = ExpiryIndex(settings.EXPIRY_DB, settings.FILE_EXPIRATION_HOURS * 3600)
+# Metadados dos artefatos, consultados no download, na listagem e na limpeza
+ARTIFACTS = ArtifactStore(settings.ARTIFACTS_DB, settings.ARTIFACT_CACHE_ENTRIES)
+# Artefatos pequenos, anexados a segmentos em vez de gravados como arquivos próprios
+PACKS = PackStore(settings.PACK_DB, settings.PACK_DIR, settings.PACK_SEGMENT_BYTES)
+# Artefatos pequenos e muito baixados, respondidos da memória
+HOT_CACHE = HotCache(settings.HOT_CACHE_MAX_BYTES, settings.HOT_CACHE_MAX_ARTIFACT_BYTES)
 
 # Rota raiz que aceita GET e HEAD
 @app.get("/")
@@ -56,7 +144,12 @@ async def root():
         "endpoints": {
             "docs": "/docs",
             "upload": "/upload/",
-            "download": "/download/{filename}"
+            "upload_raw": "/upload/raw",
+            "download": "/download/{filename}",
+            "artifacts": "/artifacts",
+            "original": "/artifacts/{filename}/original?range=inicio-fim",
+            "metrics": "/metrics",
+            "capacity": "/capacity"
         },
         "status": "online"
     }
@@ -77,9 +170,21 @@ logger.add(
     format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level} | {message}"
 )
 
-# Semáforos para controle de concorrência
-UPLOAD_SEMAPHORE = asyncio.Semaphore(settings.MAX_UPLOAD_CONCURRENCY)
-COMPRESSION_SEMAPHORE = asyncio.Semaphore(settings.MAX_COMPRESSION_CONCURRENCY)
+# Cache de variantes transcodificadas e transcodificações em andamento
+VARIANT_CACHE = VariantCache(settings.VARIANT_DIR, settings.VARIANT_CACHE_MAX_BYTES)
+TRANSCODE_TASKS: Dict[str, asyncio.Task] = {}
+
+# Artefatos pendentes (modo preguiçoso) sendo compactados neste momento
+LAZY_IN_PROGRESS = set()
+
+# Sessões de upload retomável
+UPLOAD_SESSIONS = UploadSessionStore(DISK_BUDGET.reserve_owner, DISK_BUDGET.release_owner)
+
+# Processos de compressão alimentados por ring buffer em memória compartilhada (opcional)
+RING_POOL = RingWorkerPool(
+    settings.COMPRESSION_WORKER_PROCESSES, settings.SHM_RING_SLOTS, settings.SEEKABLE_BLOCK_SIZE,
+    settings.SHM_RING_TIMEOUT_SECONDS
+) if settings.COMPRESSION_WORKER_PROCESSES else None
 
 # Sistema de API Keys
 API_KEY_HEADER = APIKeyHeader(name="X-API-Key", auto_error=False)
@@ -108,12 +213,125 @@ async def generate_api_key():
         logger.error(f"Erro ao gerar API Key: {str(e)}")
         raise HTTPException(status_code=500, detail="Erro ao gerar API Key")
 
+def compress_in_memory(data: bytes, safe_filename: str, compression_level: int, checkpoint: Optional[Callable[[], None]] = None) -> Tuple[str, bytes, str]:
+    # Mesma escolha de compress_staged, com chamadas one-shot e sem tocar o disco
+    content_hash = hashlib.sha256(data).hexdigest()
+    block_size = settings.SEEKABLE_BLOCK_SIZE
+    with memoryview(data) as view:
+        xz_data = b"".join(
+            compress_block(view[offset:offset + block_size], compression_level)
+            for offset in range(0, max(len(data), 1), block_size)
+        )
+    if len(xz_data) < len(data):
+        return ".xz", xz_data, content_hash
+    
+    if checkpoint:
+        checkpoint()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compression_level) as zipf:
+        zipf.writestr(safe_filename, data)
+    zip_data = buffer.getvalue()
+    if len(zip_data) < len(xz_data):
+        return ".zip", zip_data, content_hash
+    return ".xz", xz_data, content_hash
+
+async def register_artifact(path: Path, api_key: Optional[str], original_size: Optional[int], compressed_size: Optional[int],
+                            level: int, content_hash: Optional[str] = None, owner: Optional[str] = None) -> Artifact:
+    # Grava os metadados e agenda a expiração; o artefato só é anunciado ao cliente depois do commit.
+    # owner substitui a API Key quando só se conhece o dono, como num job retomado da fila
+    now = time.time()
+    artifact = Artifact(
+        path.name, owner or tenant_for(api_key), original_size, compressed_size, stored_format(path.name), level,
+        content_hash, now, now + EXPIRY_INDEX.ttl
+    )
+    EXPIRY_INDEX.schedule(path, artifact.expires)
+    await ARTIFACTS.put(artifact)
+    DISK_BUDGET.add(artifact.name, artifact.owner, compressed_size if compressed_size is not None else original_size or 0)
+    return artifact
+
+def upload_response(artifact: Artifact) -> Dict:
+    return {
+        "filename": artifact.name,
+        "original_size": artifact.original_size,
+        "compressed_size": artifact.compressed_size
+    }
+
+async def upload_small_file(file: UploadFile, safe_filename: str, compression_level: int, token: CancelToken, api_key: str) -> Dict:
+    # Caminho rápido: corpo em memória, compactado em uma thread e gravado uma única vez
+    data = await file.read()
+    try:
+        extension, compressed, content_hash = await ADMISSION.run(
+            len(data), compress_in_memory, data, safe_filename, compression_level, token.check, token=token, api_key=api_key
+        )
+    except CompressionCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Erro na compressão: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Erro na compressão do arquivo")
+    
+    artifact_name = f"{safe_filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}"
+    if len(compressed) <= settings.PACK_MAX_ARTIFACT_BYTES:
+        # Sem arquivo próprio: anexado ao segmento aberto
+        await PACKS.put(artifact_name, compressed)
+        compressed_path = COMPRESSED.path(artifact_name)
+    else:
+        compressed_path = COMPRESSED.prepare(artifact_name)
+        await write_atomic(compressed_path, compressed)
+    artifact = await register_artifact(compressed_path, api_key, len(data), len(compressed), compression_level, content_hash)
+    return upload_response(artifact)
+
+async def compress_staged(job: QueuedJob, token: Optional[CancelToken] = None, api_key: Optional[str] = None) -> Tuple[Path, int, str]:
+    # Retorna o artefato, o tamanho compactado e o sha256 do original.
+    # Tenta LZMA primeiro, em blocos independentes para permitir leitura por intervalo;
+    # a compressão roda fora do event loop e pode ceder a vaga entre blocos
+    xz_path = COMPRESSED.prepare(f"{job.artifact}.xz")
+    zip_path = COMPRESSED.prepare(f"{job.artifact}.zip")
+    try:
+        xz_job = await run_io(SeekableXZJob, job.staged_path, xz_path, job.level)
+        try:
+            await ADMISSION.run_blocks(job.size, xz_job, token=token, api_key=api_key)
+        finally:
+            if token:
+                await token.settle()
+            await run_io(xz_job.close)
+        
+        if xz_job.bytes_out < job.size:
+            return xz_path, xz_job.bytes_out, xz_job.hash.hexdigest()
+        final_path = await ADMISSION.run(
+            job.size, compress_zip_fallback, job.staged_path, xz_path, zip_path, job.filename, job.level,
+            token.check if token else None, token=token, api_key=api_key
+        )
+        return final_path, await run_io(os.path.getsize, final_path), xz_job.hash.hexdigest()
+    except BaseException:
+        # Com o cliente desconectado, a thread ainda pode estar escrevendo até o próximo ponto de cancelamento
+        if token:
+            await token.settle()
+        await cleanup_files(xz_path, zip_path)
+        raise
+
+async def compress_in_worker(job: QueuedJob, token: CancelToken) -> Tuple[Path, int, str]:
+    # A compressão roda em um processo worker.py; o cancelamento é a remoção do job da fila
+    outcome = JOB_QUEUE.wait(job.id)
+    cancelled = asyncio.ensure_future(token.event.wait())
+    try:
+        await asyncio.wait({outcome, cancelled}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        cancelled.cancel()
+    if not outcome.done():
+        outcome.cancel()
+        raise CompressionCancelled()
+    state, result, compressed_size, content_hash, error = outcome.result()
+    if state == "failed":
+        raise RuntimeError(f"Falha no worker: {error}")
+    return COMPRESSED.path(result), compressed_size, content_hash
+
 @app.post("/upload/")
 async def upload_file(
     request: Request,
     file: UploadFile,
     background_tasks: BackgroundTasks,
     compression_level: int = Query(default=9, ge=1, le=9),
+    lazy: bool = Query(default=False, description="Adia a compactação até o primeiro download"),
     api_key: str = Depends(get_api_key)
 ):
     # Validação do arquivo
@@ -124,122 +342,770 @@ async def upload_file(
         )
     
     file_path = None
-    xz_path = None
-    zip_path = None
+    raw_path = None
+    staged_bytes = 0
+    job = None
+    
+    # O corpo multipart já foi lido por inteiro, então dá para vigiar a desconexão
+    token = CancelToken()
+    watcher = asyncio.create_task(watch_disconnect(request, token))
     
     try:
-        async with UPLOAD_SEMAPHORE:
-            logger.info(f"Iniciando upload do arquivo: {file.filename}")
-            
-            # Gera um nome seguro para o arquivo
-            safe_filename = FileValidationMiddleware.generate_safe_filename(file.filename)
-            file_path = settings.UPLOAD_DIR / safe_filename
-            
-            # Validação e salvamento do arquivo
+        logger.info(f"Iniciando upload do arquivo: {file.filename}")
+        
+        # Gera um nome seguro para o arquivo
+        safe_filename = FileValidationMiddleware.generate_safe_filename(file.filename)
+        
+        # Arquivos pequenos não passam pelo diretório de uploads
+        if not lazy and file.size is not None and file.size <= settings.SMALL_UPLOAD_THRESHOLD:
+            return await upload_small_file(file, safe_filename, compression_level, token, api_key)
+        
+        file_path = UPLOADS.prepare(safe_filename)
+        content_length = request.headers.get("content-length")
+        expected_size = min(int(content_length), settings.MAX_FILE_SIZE) if content_length and content_length.isdigit() else None
+        
+        # O FastAPI só chama o endpoint com o multipart inteiro já no spool temporário, então
+        # a cota de staging e o estágio de rede limitam a cópia para UPLOAD_DIR, não a
+        # recepção; para limitar a recepção em si, o cliente usa o PUT /upload/raw
+        staged_bytes = await STAGING_QUOTA.reserve(expected_size or 0)
+        
+        # Vaga de rede só durante a cópia, nunca durante a compressão
+        async with NETWORK_STAGE:
+            # Validação e salvamento do arquivo, sem bloquear o event loop
             file_size = 0
             try:
-                with open(file_path, "wb") as buffer:
-                    while chunk := await file.read(1024 * 1024):
-                        file_size += len(chunk)
+                async with AsyncFileWriter(file_path, expected_size) as buffer:
+                    # Lê com readinto em buffers do pool, devolvidos pelo writer após a escrita
+                    pool = get_pool(settings.BUFFER_SIZE)
+                    while True:
+                        token.check()
+                        chunk = pool.acquire()
+                        length = await run_io(readinto, file.file, chunk)
+                        if not length:
+                            pool.release(chunk)
+                            break
+                        file_size += length
                         if file_size > settings.MAX_FILE_SIZE:
+                            pool.release(chunk)
                             raise HTTPException(
                                 status_code=413,
                                 detail="Arquivo muito grande"
                             )
-                        buffer.write(chunk)
+                        if file_size > staged_bytes:
+                            STAGING_QUOTA.add(file_size - staged_bytes)
+                            staged_bytes = file_size
+                        await buffer.write_pooled(pool, chunk, length)
+            except (HTTPException, CompressionCancelled):
+                raise
             except Exception as e:
                 logger.error(f"Erro ao salvar arquivo: {str(e)}\n{traceback.format_exc()}")
                 raise HTTPException(status_code=500, detail="Erro ao salvar arquivo")
-            
-            # Compressão do arquivo
-            async with COMPRESSION_SEMAPHORE:
-                try:
-                    compressed_filename = f"{safe_filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-                    xz_path = settings.COMPRESSED_DIR / f"{compressed_filename}.xz"
-                    zip_path = settings.COMPRESSED_DIR / f"{compressed_filename}.zip"
-                    
-                    # Tenta LZMA primeiro
-                    with lzma.open(xz_path, "wb", preset=compression_level) as xz:
-                        with open(file_path, "rb") as f:
-                            shutil.copyfileobj(f, xz)
-                    
-                    if xz_path.stat().st_size < file_size:
-                        final_path = xz_path
-                        if zip_path.exists():
-                            os.remove(zip_path)
-                    else:
-                        # Se LZMA não for eficiente, tenta ZIP
-                        with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compression_level) as zipf:
-                            zipf.write(file_path, safe_filename)
-                        
-                        if zip_path.stat().st_size < xz_path.stat().st_size:
-                            os.remove(xz_path)
-                            final_path = zip_path
-                        else:
-                            os.remove(zip_path)
-                            final_path = xz_path
-                    
-                except Exception as e:
-                    logger.error(f"Erro na compressão: {str(e)}\n{traceback.format_exc()}")
-                    raise HTTPException(status_code=500, detail="Erro na compressão do arquivo")
-            
-            # Limpa o arquivo original em background
-            background_tasks.add_task(cleanup_file, file_path)
+        
+        if lazy:
+            # Guarda o original e só estima o tamanho; a compactação fica para o primeiro download
+            artifact_name = f"{safe_filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xz"
+            raw_path = pending_path(artifact_name, compression_level)
+            os.replace(file_path, raw_path)
+            STAGING_QUOTA.release(staged_bytes)
+            staged_bytes = 0
+            artifact = await register_artifact(
+                COMPRESSED.path(artifact_name), api_key, file_size, None, compression_level
+            )
+            EXPIRY_INDEX.schedule(raw_path, artifact.expires)
+            predicted_size = await run_io(predict_size, raw_path, compression_level)
             
             return {
-                "filename": final_path.name,
+                "filename": artifact_name,
                 "original_size": file_size,
-                "compressed_size": final_path.stat().st_size
+                "compressed_size": None,
+                "predicted_size": predicted_size,
+                "status": "pending"
             }
+        
+        # Estágio de CPU: compressão do arquivo já em staging, registrada antes na fila
+        # persistente para ser retomada se o processo cair no meio
+        try:
+            job = QueuedJob(
+                file_path, f"{safe_filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                safe_filename, "xz", compression_level, file_size, tenant=tenant_for(api_key)
+            )
+            if settings.EXTERNAL_WORKERS:
+                await JOB_QUEUE.enqueue(job, external=True)
+                final_path, compressed_size, content_hash = await compress_in_worker(job, token)
+            else:
+                await JOB_QUEUE.enqueue(job)
+                final_path, compressed_size, content_hash = await compress_staged(job, token, api_key)
+        except CompressionCancelled:
+            raise
+        except Exception as e:
+            logger.error(f"Erro na compressão: {str(e)}\n{traceback.format_exc()}")
+            raise HTTPException(status_code=500, detail="Erro na compressão do arquivo")
+        
+        artifact = await register_artifact(final_path, api_key, file_size, compressed_size, compression_level, content_hash)
+        
+        # Limpa o arquivo original em background, devolvendo a cota de staging depois
+        background_tasks.add_task(cleanup_staged_file, file_path, staged_bytes)
+        staged_bytes = 0
+        
+        return upload_response(artifact)
     
+    except CompressionCancelled:
+        # Ninguém vai baixar o resultado: remove o staging e as saídas parciais
+        logger.info(f"Upload cancelado pelo cliente: {file.filename}")
+        await cleanup_files(file_path, raw_path)
+        raise HTTPException(status_code=499, detail="Cliente desconectado")
     except Exception as e:
         logger.error(f"Erro ao processar arquivo: {str(e)}\n{traceback.format_exc()}")
-        await cleanup_files(file_path, xz_path, zip_path)
+        await cleanup_files(file_path, raw_path)
         if isinstance(e, HTTPException):
             raise
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        watcher.cancel()
+        if job and job.id is not None:
+            JOB_QUEUE.finish(job.id)
+        if staged_bytes:
+            STAGING_QUOTA.release(staged_bytes)
 
-@app.get("/download/{filename}")
-async def download_file(
-    filename: str,
+@app.get("/metrics")
+async def get_metrics(api_key: str = Depends(get_api_key)):
+    return {
+        "uptime_seconds": round(time.time() - STARTED_AT, 1),
+        "event_loop": LOOP_LAG.stats(),
+        "io": fileio.stats(),
+        "buffer_pools": bufferpool.stats(),
+        "compression_processes": RING_POOL.stats() if RING_POOL else None,
+        "stages": {
+            "network": NETWORK_STAGE.stats(),
+            "cpu": CPU_STAGE.stats(),
+            "staging": STAGING_QUOTA.stats()
+        },
+        "admission": UPLOAD_ADMISSION.stats(),
+        "upload_quota": UPLOAD_QUOTA.stats(),
+        "cancellation": cancellation.stats(),
+        "job_queue": await run_io(JOB_QUEUE.stats),
+        "expiry": await run_io(EXPIRY_INDEX.stats),
+        "artifacts": await run_io(ARTIFACTS.stats),
+        "packs": await run_io(PACKS.stats),
+        "disk_budget": DISK_BUDGET.stats(),
+        "hot_cache": HOT_CACHE.stats()
+    }
+
+@app.get("/capacity")
+async def get_capacity(size: int = Query(default=0, ge=0, description="Tamanho do upload pretendido, em bytes")):
+    # Leve e sem API Key, para balanceadores e clientes consultarem antes de enviar
+    capacity = UPLOAD_ADMISSION.stats(size)
+    headers = {"Retry-After": str(capacity["retry_after"])} if not capacity["accepting"] else None
+    return JSONResponse(
+        status_code=200 if capacity["accepting"] else 503,
+        content={key: capacity[key] for key in ("accepting", "estimated_wait_seconds", "retry_after", "queued_jobs", "throughput_mb_per_second")},
+        headers=headers
+    )
+
+async def receive_raw_in_thread(request: Request, part_path: Path, compression_level: int, token: CancelToken, api_key: str):
+    file_size = 0
+    with open(part_path, "wb") as dst:
+        writer = SeekableXZWriter(dst, compression_level)
+        async for data in request.stream():
+            file_size += len(data)
+            if file_size > settings.MAX_FILE_SIZE:
+                raise HTTPException(status_code=413, detail="Arquivo muito grande")
+            if len(writer.pending) + len(data) < writer.block_size:
+                writer.write(data)
+                continue
+            # Bloco completo: compacta fora do event loop, ocupando a vaga só durante o bloco
+            await ADMISSION.run(len(writer.pending) + len(data), writer.write, data, token=token, api_key=api_key)
+        await ADMISSION.run(len(writer.pending), writer.close, token=token, api_key=api_key)
+    return file_size, writer.bytes_out, writer.hash.hexdigest()
+
+def compress_block_in_process(part_path: Path, compression_level: int, block: bytes, content_hash) -> int:
+    content_hash.update(block)
+    return RING_POOL.compress(part_path, compression_level, block)
+
+async def receive_raw_in_process(request: Request, part_path: Path, compression_level: int, token: CancelToken, api_key: str):
+    # Cada bloco vai para um processo de compressão pelo ring em memória compartilhada só depois
+    # de recebido por inteiro, com a vaga de CPU do escalonador: um cliente lento não prende processo
+    file_size = 0
+    compressed_size = 0
+    content_hash = hashlib.sha256()
+    pending = bytearray()
+    block_size = settings.SEEKABLE_BLOCK_SIZE
+    # Os processos anexam os blocos ao arquivo
+    await run_io(part_path.write_bytes, b"")
+    async for data in request.stream():
+        file_size += len(data)
+        if file_size > settings.MAX_FILE_SIZE:
+            raise HTTPException(status_code=413, detail="Arquivo muito grande")
+        pending += data
+        while len(pending) >= block_size:
+            block = bytes(pending[:block_size])
+            del pending[:block_size]
+            compressed_size += await ADMISSION.run(
+                block_size, compress_block_in_process, part_path, compression_level, block, content_hash,
+                token=token, api_key=api_key
+            )
+    if pending or not file_size:
+        compressed_size += await ADMISSION.run(
+            len(pending), compress_block_in_process, part_path, compression_level, bytes(pending), content_hash,
+            token=token, api_key=api_key
+        )
+    return file_size, compressed_size, content_hash.hexdigest()
+
+@app.put("/upload/raw")
+async def upload_raw(
+    request: Request,
     api_key: str = Depends(get_api_key)
 ):
-    file_path = settings.COMPRESSED_DIR / filename
+    # Corpo cru (sem multipart): os bytes vão direto para o compressor, sem arquivo de staging
+    filename = request.headers.get("x-filename")
+    if not filename or not FileValidationMiddleware.is_valid_file(filename):
+        raise HTTPException(status_code=400, detail="Tipo de arquivo não permitido")
+    try:
+        compression_level = int(request.headers.get("x-compression-level", "9"))
+    except ValueError:
+        compression_level = 0
+    if not 1 <= compression_level <= 9:
+        raise HTTPException(status_code=400, detail="Nível de compressão inválido")
     
-    if not file_path.exists():
-        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="Arquivo muito grande")
+    
+    safe_filename = FileValidationMiddleware.generate_safe_filename(filename)
+    xz_path = COMPRESSED.prepare(f"{safe_filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xz")
+    part_path = xz_path.with_name(f"{xz_path.name}.part")
+    token = CancelToken()
+    
+    try:
+        async with NETWORK_STAGE:
+            logger.info(f"Iniciando upload cru do arquivo: {filename}")
+            if RING_POOL:
+                file_size, compressed_size, content_hash = await receive_raw_in_process(
+                    request, part_path, compression_level, token, api_key
+                )
+            else:
+                file_size, compressed_size, content_hash = await receive_raw_in_thread(
+                    request, part_path, compression_level, token, api_key
+                )
+            os.replace(part_path, xz_path)
+        artifact = await register_artifact(xz_path, api_key, file_size, compressed_size, compression_level, content_hash)
+    except ClientDisconnect:
+        # Os blocos já compactados viram desperdício; a saída parcial é removida
+        CANCEL_STATS["disconnects"] += 1
+        token.cancel()
+        logger.info(f"Upload cru cancelado pelo cliente: {filename}")
+        await cleanup_files(part_path)
+        raise HTTPException(status_code=499, detail="Cliente desconectado")
+    except Exception as e:
+        logger.error(f"Erro ao processar upload cru: {str(e)}\n{traceback.format_exc()}")
+        await cleanup_files(part_path)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail="Erro ao processar arquivo")
+    
+    return upload_response(artifact)
+
+@app.post("/uploads/")
+async def create_upload_session(
+    filename: str = Query(...),
+    size: int = Query(..., ge=0, description="Tamanho total do arquivo em bytes"),
+    chunk_size: int = Query(default=settings.RESUMABLE_CHUNK_SIZE, ge=256 * 1024, le=64 * 1024 * 1024),
+    compression_level: int = Query(default=9, ge=1, le=9),
+    api_key: str = Depends(get_api_key)
+):
+    if not FileValidationMiddleware.is_valid_file(filename):
+        raise HTTPException(status_code=400, detail="Tipo de arquivo não permitido")
+    if size > settings.MAX_FILE_SIZE:
+        raise HTTPException(status_code=413, detail="Arquivo muito grande")
+    # A sessão fica com a reserva do arquivo inteiro até ser finalizada, cancelada ou expirar
+    reason = DISK_BUDGET.try_reserve(api_key, size)
+    if reason:
+        raise HTTPException(status_code=507, detail=reason)
+    
+    try:
+        session = await run_io(UPLOAD_SESSIONS.create, filename, size, chunk_size, compression_level, tenant_for(api_key))
+    except OSError as e:
+        DISK_BUDGET.release(size, api_key)
+        logger.error(f"Erro ao criar sessão de upload: {str(e)}")
+        raise HTTPException(status_code=507, detail="Espaço insuficiente para o upload")
+    for path in (session.data_path, session.part_path, session.state_path):
+        EXPIRY_INDEX.schedule(path)
+    
+    logger.info(f"Sessão de upload criada: {session.upload_id} ({filename}, {size} bytes)")
+    return session.status()
+
+async def get_upload_session(upload_id: str, api_key: str):
+    session = await run_io(UPLOAD_SESSIONS.get, upload_id)
+    # Sessões de outra API Key se comportam como inexistentes
+    if session is None or session.owner != tenant_for(api_key):
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+    return session
+
+async def compress_session(session):
+    # Compacta bloco a bloco o prefixo contíguo já recebido
+    async with session.lock:
+        # Só ocupa a vaga (e só entra na vazão medida) quando há bloco pronto, com o tamanho dele
+        while (length := session.next_block_length()) is not None:
+            await ADMISSION.run(length, session.compress_next_block)
+
+async def compress_session_in_background(session):
+    try:
+        await compress_session(session)
+    except Exception as e:
+        logger.error(f"Erro na compressão parcial da sessão {session.upload_id}: {str(e)}")
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    api_key: str = Depends(get_api_key)
+):
+    session = await get_upload_session(upload_id, api_key)
+    try:
+        offset, length = session.chunk_bounds(index)
+    except IndexError:
+        raise HTTPException(status_code=400, detail="Índice de chunk inválido")
     
-    # Verifica se o arquivo expirou
-    file_age = datetime.now() - datetime.fromtimestamp(file_path.stat().st_mtime)
-    if file_age > timedelta(hours=settings.FILE_EXPIRATION_HOURS):
+    # Reenvios de chunks já recebidos são ignorados
+    if not session.has_chunk(index):
+        try:
+            # Um descritor próprio: finalizar ou cancelar a sessão no meio não o fecha
+            fd = await run_io(session.writer_fd)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+        try:
+            written = 0
+            async with NETWORK_STAGE:
+                async for data in request.stream():
+                    if written + len(data) > length:
+                        raise HTTPException(status_code=400, detail="Chunk maior que o esperado")
+                    await run_io(os.pwrite, fd, data, offset + written)
+                    written += len(data)
+        finally:
+            await run_io(os.close, fd)
+        if written != length:
+            raise HTTPException(status_code=400, detail="Chunk incompleto")
+        
         try:
-            os.remove(file_path)
+            await run_io(session.mark_received, index)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+        if session.compress_task is None or session.compress_task.done():
+            session.compress_task = asyncio.create_task(compress_session_in_background(session))
+    
+    return {
+        "index": index,
+        "contiguous_offset": session.contiguous_offset(),
+        "complete": session.is_complete()
+    }
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_status(
+    upload_id: str,
+    api_key: str = Depends(get_api_key)
+):
+    return (await get_upload_session(upload_id, api_key)).status()
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(
+    upload_id: str,
+    api_key: str = Depends(get_api_key)
+):
+    session = await get_upload_session(upload_id, api_key)
+    if not session.is_complete():
+        raise HTTPException(
+            status_code=409,
+            detail={"message": "Upload incompleto", "missing_chunks": session.missing_chunks()}
+        )
+    
+    try:
+        await compress_session(session)
+        safe_filename = FileValidationMiddleware.generate_safe_filename(session.filename)
+        artifact_path = COMPRESSED.prepare(f"{safe_filename}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xz")
+        async with session.lock:
+            compressed_size = await run_io(session.finalize, artifact_path)
+        artifact = await register_artifact(artifact_path, api_key, session.size, compressed_size, session.level)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Sessão de upload não encontrada")
+    except Exception as e:
+        logger.error(f"Erro ao finalizar upload {upload_id}: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Erro na compressão do arquivo")
+    finally:
+        UPLOAD_SESSIONS.discard(upload_id)
+    
+    logger.info(f"Upload retomável finalizado: {artifact_path.name}")
+    return upload_response(artifact)
+
+@app.delete("/uploads/{upload_id}")
+async def cancel_upload(
+    upload_id: str,
+    api_key: str = Depends(get_api_key)
+):
+    session = await get_upload_session(upload_id, api_key)
+    async with session.lock:
+        UPLOAD_SESSIONS.discard(upload_id)
+        await run_io(session.remove)
+    return {"upload_id": upload_id, "status": "cancelled"}
+
+def expire_artifact(artifact: Artifact):
+    for file_path in (COMPRESSED.path(artifact.name), pending_path(artifact.name, artifact.level)):
+        file_path.unlink(missing_ok=True)
+    VARIANT_CACHE.discard_artifact(artifact.name)
+    PACKS.discard([artifact.name])
+    HOT_CACHE.discard(artifact.name)
+    ARTIFACTS.discard([artifact.name])
+    DISK_BUDGET.remove(artifact.name)
+
+async def get_artifact(filename: str) -> Artifact:
+    # Consulta o índice de metadados em vez do disco; o prazo vale mesmo antes da limpeza passar
+    artifact = await ARTIFACTS.lookup(filename)
+    if artifact is None:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    if artifact.expired():
+        try:
+            await run_io(expire_artifact, artifact)
         except Exception as e:
             logger.error(f"Erro ao remover arquivo expirado: {str(e)}")
         raise HTTPException(status_code=404, detail="Arquivo expirado")
+    return artifact
+
+def may_be_packed(artifact: Artifact) -> bool:
+    # Evita consultar o índice dos segmentos para artefatos grandes
+    return artifact.compressed_size is not None and artifact.compressed_size <= settings.PACK_MAX_ARTIFACT_BYTES
+
+async def unpack_artifact(artifact: Artifact):
+    # Transcodificação, pacote e leitura por intervalo trabalham sobre arquivos: o artefato sai do segmento
+    if not may_be_packed(artifact):
+        return
+    data = await PACKS.read(artifact.name)
+    if data is None:
+        return
+    try:
+        await write_atomic(COMPRESSED.prepare(artifact.name), data)
+    except FileNotFoundError:
+        pass  # Outra requisição extraiu o mesmo artefato ao mesmo tempo
+    await run_io(PACKS.discard, [artifact.name])
+
+async def read_small_artifact(artifact: Artifact) -> Optional[bytes]:
+    # Artefatos pequenos vão inteiros na resposta: da memória, do segmento (um pread) ou do
+    # arquivo, este só quando vai entrar no cache; None para seguir em streaming do disco
+    hot = HOT_CACHE.eligible(artifact.compressed_size)
+    if hot and (data := HOT_CACHE.get(artifact.name)) is not None:
+        return data
+    admit = hot and HOT_CACHE.admits(artifact.name, artifact.compressed_size)
+    data = await PACKS.read(artifact.name) if may_be_packed(artifact) else None
+    if data is None and admit:
+        try:
+            data = await run_io(COMPRESSED.path(artifact.name).read_bytes)
+        except FileNotFoundError:
+            return None
+    if data is not None and admit:
+        HOT_CACHE.put(artifact.name, data)
+    return data
+
+def get_pending(artifact: Artifact) -> Optional[Tuple[Path, int]]:
+    # Artefatos do modo preguiçoso ainda não compactados
+    if not artifact.pending:
+        return None
+    return pending_path(artifact.name, artifact.level), artifact.level
+
+def stream_pending(filename: str, raw_path: Path, level: int, api_key: Optional[str] = None) -> StreamingResponse:
+    # Só o primeiro download grava o artefato; downloads simultâneos apenas compactam para o cliente
+    size = raw_path.stat().st_size
+    
+    async def iterblocks():
+        # Registro e arquivos abertos só dentro do gerador: se o cliente desconectar antes do
+        # primeiro bloco, o Starlette cancela a resposta sem iniciá-lo e não sobra nada
+        write_artifact = filename not in LAZY_IN_PROGRESS
+        if write_artifact:
+            LAZY_IN_PROGRESS.add(filename)
+        compressor = None
+        in_flight = None
+        
+        def finish():
+            if compressor and not compressor.committed:
+                compressor.abort()
+            if write_artifact:
+                LAZY_IN_PROGRESS.discard(filename)
+        
+        try:
+            try:
+                compressor = await run_io(PendingCompressor, raw_path, COMPRESSED.prepare(filename), level, write_artifact)
+            except FileNotFoundError:
+                # Compactado por outra requisição depois da consulta: envia o artefato pronto
+                async for chunk in iter_file(await run_io(open, COMPRESSED.path(filename), "rb")):
+                    yield chunk
+                return
+            while compressor.bytes_in < size or not compressor.blocks:
+                # A vaga de CPU vale só para o bloco, nunca durante o envio ao cliente; o bloco
+                # segue até o fim mesmo com a resposta cancelada, e a limpeza espera por ele
+                in_flight = asyncio.ensure_future(ADMISSION.run(
+                    min(size - compressor.bytes_in, settings.SEEKABLE_BLOCK_SIZE), compressor.next_block, api_key=api_key
+                ))
+                block = await asyncio.shield(in_flight)
+                if block is None:
+                    break
+                yield block
+            in_flight = asyncio.ensure_future(run_io(compressor.commit))
+            await asyncio.shield(in_flight)
+            if write_artifact:
+                ARTIFACTS.set_compressed(filename, compressor.bytes_out, compressor.hash.hexdigest())
+                DISK_BUDGET.resize(filename, compressor.bytes_out)
+                logger.info(f"Artefato pendente compactado no download: {filename}")
+        finally:
+            if in_flight and not in_flight.done():
+                in_flight.add_done_callback(lambda _: finish())
+            else:
+                finish()
+    
+    return StreamingResponse(iterblocks(), media_type=MEDIA_TYPES["xz"], headers=download_headers(filename))
+
+async def materialize_pending(filename: str, raw_path: Path, level: int):
+    while filename in LAZY_IN_PROGRESS:
+        await asyncio.sleep(0.5)
+    if COMPRESSED.path(filename).exists():
+        cleanup_file(raw_path)
+        return
+    
+    LAZY_IN_PROGRESS.add(filename)
+    try:
+        size = raw_path.stat().st_size
+        compressor = await run_io(PendingCompressor, raw_path, COMPRESSED.prepare(filename), level)
+        try:
+            await ADMISSION.run_blocks(size, compressor)
+        except BaseException:
+            await run_io(compressor.abort)
+            raise
+        await run_io(compressor.commit)
+        ARTIFACTS.set_compressed(filename, compressor.bytes_out, compressor.hash.hexdigest())
+        DISK_BUDGET.resize(filename, compressor.bytes_out)
+        logger.info(f"Artefato pendente compactado: {filename}")
+    finally:
+        LAZY_IN_PROGRESS.discard(filename)
+
+def download_headers(download_name: str) -> Dict[str, str]:
+    return {
+        "Content-Disposition": f"attachment; filename={download_name}",
+        "X-Content-Type-Options": "nosniff",
+        "Vary": "Accept"
+    }
+
+def stream_file(file_path: Path, media_type: str, download_name: str) -> StreamingResponse:
+    # Abre antes de responder para que uma remoção concorrente não interrompa o download
+    try:
+        f = open(file_path, "rb")
+    except FileNotFoundError:
+        # Indexado, mas removido por outro processo depois da consulta
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    
+    return StreamingResponse(iter_file(f), media_type=media_type, headers=download_headers(download_name))
+
+async def original_size_of(artifact: Artifact, file_path: Path) -> int:
+    # Artefatos indexados a partir do disco não trazem o tamanho original nos metadados
+    if artifact.original_size is not None:
+        return artifact.original_size
+    return await run_io(xz_original_size if artifact.codec == "xz" else zip_original_size, file_path)
+
+async def build_variant(file_path: Path, key: str, fmt: str, level: int, original_size: int) -> Path:
+    variant_path = VARIANT_CACHE.path_for(key)
+    part_path = variant_path.with_name(f"{variant_path.name}.part")
+    
+    try:
+        logger.info(f"Transcodificando {file_path.name} para {fmt} (nível {level})")
+        # A vazão da admissão é medida em bytes do original, que é o que o transcode recompacta
+        await ADMISSION.run(original_size, transcode, file_path, part_path, fmt, level)
+        os.replace(part_path, variant_path)
+    except Exception:
+        part_path.unlink(missing_ok=True)
+        raise
+    
+    VARIANT_CACHE.put(key, variant_path.stat().st_size)
+    return variant_path
+
+async def get_variant(file_path: Path, fmt: str, level: int, original_size: int) -> Path:
+    key = VARIANT_CACHE.key(file_path.name, fmt, level)
+    cached_path = VARIANT_CACHE.get(key)
+    if cached_path:
+        return cached_path
     
-    def iterfile():
-        with open(file_path, "rb") as f:
-            while chunk := f.read(1024 * 1024):
-                yield chunk
+    # Requisições simultâneas pela mesma variante aguardam a mesma transcodificação
+    task = TRANSCODE_TASKS.get(key)
+    if task is None:
+        task = asyncio.ensure_future(build_variant(file_path, key, fmt, level, original_size))
+        TRANSCODE_TASKS[key] = task
+        task.add_done_callback(lambda _: TRANSCODE_TASKS.pop(key, None))
+    return await asyncio.shield(task)
+
+@app.get("/download/{filename}")
+async def download_file(
+    filename: str,
+    request: Request,
+    format: Optional[str] = Query(default=None, description="Formato desejado: xz, zip ou zst"),
+    level: int = Query(default=6, ge=1, le=9),
+    api_key: str = Depends(get_api_key)
+):
+    artifact = await get_artifact(filename)
+    DISK_BUDGET.touch(filename)
+    source_format = artifact.codec
+    target_format = format.lower().lstrip(".") if format else negotiate_format(request.headers.get("accept"), source_format)
+    if target_format not in available_formats():
+        raise HTTPException(status_code=400, detail="Formato não suportado")
     
-    content_type = "application/x-xz" if filename.endswith(".xz") else "application/zip"
+    pending = get_pending(artifact)
+    if pending:
+        raw_path, pending_level = pending
+        if target_format == source_format:
+            try:
+                return stream_pending(filename, raw_path, pending_level, api_key)
+            except FileNotFoundError:
+                pass  # Compactado por outra requisição nesse meio tempo
+        else:
+            await materialize_pending(filename, raw_path, pending_level)
     
+    file_path = COMPRESSED.path(filename)
+    
+    if target_format == source_format:
+        media_type = MEDIA_TYPES.get(source_format, "application/octet-stream")
+        data = await read_small_artifact(artifact)
+        if data is not None:
+            return Response(content=data, media_type=media_type, headers=download_headers(filename))
+        return stream_file(file_path, media_type, filename)
+    
+    await unpack_artifact(artifact)
+    try:
+        variant_path = await get_variant(file_path, target_format, level, await original_size_of(artifact, file_path))
+    except Exception as e:
+        logger.error(f"Erro na transcodificação: {str(e)}\n{traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail="Erro ao converter o arquivo")
+    
+    return stream_file(variant_path, MEDIA_TYPES[target_format], f"{file_path.stem}.{target_format}")
+
+class BundleRequest(BaseModel):
+    filenames: List[str]
+
+@app.post("/download/bundle")
+async def download_bundle(
+    bundle: BundleRequest,
+    api_key: str = Depends(get_api_key)
+):
+    filenames = list(dict.fromkeys(bundle.filenames))
+    if not filenames:
+        raise HTTPException(status_code=400, detail="Nenhum arquivo informado")
+    if len(filenames) > settings.MAX_BUNDLE_FILES:
+        raise HTTPException(status_code=400, detail="Arquivos demais no pacote")
+    
+    paths = []
+    for filename in filenames:
+        if Path(filename).name != filename:
+            raise HTTPException(status_code=400, detail="Nome de arquivo inválido")
+        artifact = await get_artifact(filename)
+        DISK_BUDGET.touch(filename)
+        pending = get_pending(artifact)
+        if pending:
+            await materialize_pending(filename, *pending)
+        await unpack_artifact(artifact)
+        paths.append(COMPRESSED.path(filename))
+    
+    try:
+        zip_bundle = ZipBundle(paths)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+    
+    logger.info(f"Enviando pacote com {len(paths)} arquivos")
     return StreamingResponse(
-        iterfile(),
-        media_type=content_type,
+        zip_bundle.stream(),
+        media_type="application/zip",
         headers={
-            "Content-Disposition": f"attachment; filename={filename}",
+            "Content-Disposition": f"attachment; filename=compactador_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
+            "Content-Length": str(zip_bundle.content_length()),
             "X-Content-Type-Options": "nosniff"
         }
     )
 
+@app.get("/artifacts")
+async def list_artifacts(
+    limit: int = Query(default=100, ge=1, le=1000),
+    api_key: str = Depends(get_api_key)
+):
+    # Artefatos enviados com a API Key da requisição, mais recentes primeiro
+    artifacts = await run_io(ARTIFACTS.list_owner, tenant_for(api_key), limit)
+    now = time.time()
+    return {"artifacts": [artifact.summary() for artifact in artifacts if not artifact.expired(now)]}
+
+@app.get("/artifacts/{filename}")
+async def get_artifact_metadata(
+    filename: str,
+    api_key: str = Depends(get_api_key)
+):
+    return (await get_artifact(filename)).summary()
+
+@app.get("/artifacts/{filename}/original")
+async def download_original_range(
+    filename: str,
+    request: Request,
+    range: Optional[str] = Query(default=None, description="Intervalo do original: inicio-fim, inicio- ou -sufixo"),
+    api_key: str = Depends(get_api_key)
+):
+    artifact = await get_artifact(filename)
+    DISK_BUDGET.touch(filename)
+    pending = get_pending(artifact)
+    if pending and not await run_io(pending[0].exists):
+        pending = None  # Compactado por outro processo
+    if not pending:
+        await unpack_artifact(artifact)
+    file_path = pending[0] if pending else COMPRESSED.path(filename)
+    
+    try:
+        if pending:
+            # O original ainda não foi compactado: lê o intervalo direto dele
+            total_size = artifact.original_size if artifact.original_size is not None else file_path.stat().st_size
+            iter_range = iter_file_range
+        elif artifact.codec == "xz":
+            total_size = artifact.original_size if artifact.original_size is not None else xz_original_size(file_path)
+            iter_range = iter_xz_range
+        else:
+            total_size = artifact.original_size if artifact.original_size is not None else zip_original_size(file_path)
+            iter_range = iter_zip_range
+    except Exception as e:
+        logger.error(f"Erro ao ler índice do arquivo {filename}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Erro ao ler arquivo compactado")
+    
+    spec = range or request.headers.get("range")
+    if spec is None:
+        start, end, status_code = 0, total_size - 1, 200
+    else:
+        try:
+            start, end = parse_range(spec, total_size)
+        except ValueError:
+            raise HTTPException(
+                status_code=416,
+                detail="Intervalo inválido",
+                headers={"Content-Range": f"bytes */{total_size}"}
+            )
+        status_code = 206
+    
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(max(end - start + 1, 0)),
+        "X-Content-Type-Options": "nosniff"
+    }
+    if status_code == 206:
+        headers["Content-Range"] = f"bytes {start}-{end}/{total_size}"
+    
+    return StreamingResponse(
+        iter_range(file_path, start, end) if total_size else iter(()),
+        status_code=status_code,
+        media_type="application/octet-stream",
+        headers=headers
+    )
+
 async def cleanup_files(*files: Optional[Path]):
     for file in files:
-        if file and file.exists():
+        if file:
             try:
-                os.remove(file)
-                logger.info(f"Arquivo removido: {file}")
+                if await remove(file):
+                    logger.info(f"Arquivo removido: {file}")
             except Exception as e:
                 logger.error(f"Erro ao remover arquivo {file}: {str(e)}")
 
@@ -251,28 +1117,227 @@ def cleanup_file(file: Path):
     except Exception as e:
         logger.error(f"Erro ao remover arquivo original {file}: {str(e)}")
 
+async def cleanup_staged_file(file: Path, staged_bytes: int):
+    try:
+        await run_io(cleanup_file, file)
+    finally:
+        STAGING_QUOTA.release(staged_bytes)
+
 @app.on_event("startup")
 async def startup_event():
     logger.info("Iniciando servidor e configurando limpeza automática")
+    VARIANT_CACHE.load()
+    # Sessões de upload retomável de antes do reinício voltam a reservar o espaço delas
+    sessions = await run_io(UPLOAD_SESSIONS.load)
+    if sessions:
+        logger.info(f"{sessions} sessões de upload retomável recarregadas")
+    # Artefatos do layout plano vão para os shards antes de o download procurá-los lá
+    moved = await run_io(COMPRESSED.migrate)
+    if moved:
+        logger.info(f"{moved} artefatos movidos para os shards de {settings.COMPRESSED_DIR}")
+    asyncio.create_task(LOOP_LAG.run())
     asyncio.create_task(cleanup_old_files())
+    asyncio.create_task(compress_pending_when_idle())
+    asyncio.create_task(resume_queued_jobs())
+    if settings.EXTERNAL_WORKERS:
+        asyncio.create_task(UPLOAD_ADMISSION.run())
+    asyncio.create_task(compact_packs())
+    asyncio.create_task(enforce_disk_budget())
+    if RING_POOL:
+        RING_POOL.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if RING_POOL:
+        RING_POOL.stop()
+
+async def compress_resumed_job(job: QueuedJob):
+    staged_bytes = await STAGING_QUOTA.reserve(job.size)
+    try:
+        final_path, compressed_size, content_hash = await compress_staged(job)
+        # O dono vem da fila; jobs registrados antes da coluna tenant ficam como internos
+        await register_artifact(final_path, None, job.size, compressed_size, job.level, content_hash, owner=job.tenant)
+        logger.info(f"Job retomado após reinício: {final_path.name}")
+        await run_io(cleanup_file, job.staged_path)
+    finally:
+        STAGING_QUOTA.release(staged_bytes)
+
+async def resume_queued_job(job: QueuedJob):
+    try:
+        # Sem o staging, já foi compactado e limpo antes de a remoção do job chegar ao disco
+        if await run_io(job.staged_path.exists):
+            await compress_resumed_job(job)
+    except Exception as e:
+        logger.error(f"Erro ao retomar job {job.id}: {str(e)}\n{traceback.format_exc()}")
+        await cleanup_files(job.staged_path)
+    JOB_QUEUE.finish(job.id)
+
+async def adopt_finished_jobs():
+    # Jobs que os workers externos terminaram depois de o servidor que os registrou cair
+    while adopted := await run_io(JOB_QUEUE.adopt, settings.JOB_QUEUE_BATCH_SIZE):
+        for job, result, compressed_size, content_hash in adopted:
+            try:
+                final_path = COMPRESSED.path(result)
+                if await run_io(final_path.exists):
+                    await register_artifact(final_path, None, job.size, compressed_size, job.level, content_hash, owner=job.tenant)
+                    logger.info(f"Job concluído por worker após reinício: {final_path.name}")
+                await run_io(cleanup_file, job.staged_path)
+            except Exception as e:
+                logger.error(f"Erro ao registrar job {job.id}: {str(e)}\n{traceback.format_exc()}")
+            JOB_QUEUE.finish(job.id)
+
+async def adopt_finished_jobs_periodically():
+    # Os workers continuam compactando os jobs do servidor que caiu; os resultados chegam aos poucos
+    while True:
+        try:
+            await adopt_finished_jobs()
+        except Exception as e:
+            logger.error(f"Erro ao registrar jobs concluídos: {str(e)}")
+        await asyncio.sleep(settings.JOB_RECOVER_INTERVAL_SECONDS)
+
+async def resume_queued_jobs():
+    # Jobs de processos que caíram voltam para a fila e são compactados aos poucos, pelo escalonador
+    try:
+        queued = await run_io(JOB_QUEUE.recover, settings.JOB_MAX_ATTEMPTS)
+        if settings.EXTERNAL_WORKERS:
+            # A fila é dos processos worker.py; aqui só entram os resultados de servidores que caíram
+            asyncio.create_task(adopt_finished_jobs_periodically())
+            return
+        await adopt_finished_jobs()
+        if queued:
+            logger.info(f"Retomando {queued} jobs de compressão da fila persistente")
+        while jobs := await run_io(JOB_QUEUE.claim, settings.JOB_QUEUE_BATCH_SIZE):
+            JOB_QUEUE.resumed += len(jobs)
+            await asyncio.gather(*(resume_queued_job(job) for job in jobs))
+    except Exception as e:
+        logger.error(f"Erro ao retomar a fila de jobs: {str(e)}")
+
+def cpu_is_idle() -> bool:
+    if CPU_STAGE.locked():
+        return False
+    try:
+        load = os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        # getloadavg não existe no Windows; considera ocioso se há vaga de compressão
+        return True
+    return load < settings.LAZY_IDLE_MAX_LOAD
+
+async def compress_pending_when_idle():
+    while True:
+        await asyncio.sleep(settings.LAZY_IDLE_INTERVAL_SECONDS)
+        try:
+            while cpu_is_idle() and (raw_path := await run_io(oldest_pending)):
+                filename, level = parse_pending_name(raw_path)
+                await materialize_pending(filename, raw_path, level)
+        except Exception as e:
+            logger.error(f"Erro na compactação de arquivos pendentes: {str(e)}")
+
+def untracked_artifact(file_path: Path, stat: os.stat_result) -> Optional[Artifact]:
+    expires = stat.st_mtime + EXPIRY_INDEX.ttl
+    if COMPRESSED.contains(file_path) and not file_path.name.endswith(".part"):
+        return Artifact(file_path.name, None, None, stat.st_size, stored_format(file_path.name), 0, None, stat.st_mtime, expires)
+    if file_path.parent == settings.PENDING_DIR:
+        name, level = parse_pending_name(file_path)
+        return Artifact(name, None, stat.st_size, None, stored_format(name), level, None, stat.st_mtime, expires)
+    return None
+
+def index_untracked_files():
+    # Arquivos de antes dos índices ou deixados por um processo que caiu entram com o prazo pelo mtime
+    entries = []
+    artifacts = []
+    for entry in chain(
+        UPLOADS.iter_files(), COMPRESSED.iter_files(), os.scandir(settings.PENDING_DIR), os.scandir(settings.RESUMABLE_DIR)
+    ):
+        if not entry.name.startswith(".") and entry.is_file():
+            file_path = Path(entry.path)
+            stat = entry.stat()
+            entries.append((file_path, stat.st_mtime + EXPIRY_INDEX.ttl))
+            artifact = untracked_artifact(file_path, stat)
+            if artifact:
+                artifacts.append(artifact)
+    added = EXPIRY_INDEX.schedule_missing(entries)
+    if added:
+        logger.info(f"{added} arquivos sem prazo adicionados ao índice de expiração")
+    added = ARTIFACTS.put_missing(artifacts)
+    if added:
+        logger.info(f"{added} artefatos sem metadados adicionados ao índice")
+
+def remove_expired_files() -> int:
+    expired = EXPIRY_INDEX.due(time.time(), settings.EXPIRY_BATCH_SIZE)
+    artifacts = []
+    for file_path in expired:
+        try:
+            if file_path.exists():
+                os.remove(file_path)
+                logger.info(f"Arquivo antigo removido: {file_path}")
+            if file_path.parent == settings.RESUMABLE_DIR:
+                # Sessão expirada: devolve a reserva de disco dela
+                UPLOAD_SESSIONS.discard(file_path.name.split(".", 1)[0])
+            if COMPRESSED.contains(file_path):
+                VARIANT_CACHE.discard_artifact(file_path.name)
+                artifacts.append(file_path.name)
+        except Exception as e:
+            logger.error(f"Erro na limpeza do arquivo: {str(e)}")
+    PACKS.discard(artifacts)
+    ARTIFACTS.discard(artifacts)
+    for name in artifacts:
+        HOT_CACHE.discard(name)
+        DISK_BUDGET.remove(name)
+    EXPIRY_INDEX.discard(expired)
+    return len(expired)
 
 async def cleanup_old_files():
+    try:
+        await run_io(index_untracked_files)
+        # Artefatos de antes da partida entram no orçamento de disco depois de indexados
+        await run_io(DISK_BUDGET.load, await run_io(ARTIFACTS.sizes))
+        DISK_BUDGET.signal_pressure()
+    except Exception as e:
+        logger.error(f"Erro ao indexar arquivos para expiração: {str(e)}")
     while True:
         try:
-            current_time = datetime.now()
-            for dir_path in [settings.UPLOAD_DIR, settings.COMPRESSED_DIR]:
-                for file_path in dir_path.glob("*"):
-                    file_age = current_time - datetime.fromtimestamp(file_path.stat().st_mtime)
-                    if file_age > timedelta(hours=settings.FILE_EXPIRATION_HOURS):
-                        try:
-                            os.remove(file_path)
-                            logger.info(f"Arquivo antigo removido: {file_path}")
-                        except Exception as e:
-                            logger.error(f"Erro na limpeza do arquivo: {str(e)}")
+            # Remove em lotes no pool de I/O só o que já venceu
+            while await run_io(remove_expired_files) == settings.EXPIRY_BATCH_SIZE:
+                pass
+            deadline = await run_io(EXPIRY_INDEX.next_deadline)
+            delay = deadline - time.time() if deadline else settings.EXPIRY_MAX_SLEEP_SECONDS
         except Exception as e:
             logger.error(f"Erro na limpeza automática: {str(e)}")
+            delay = 60
         
-        await asyncio.sleep(3600)  # Verifica a cada hora
+        # Todo prazo novo é agora + ttl, então nenhum vence antes do mais próximo já indexado
+        await asyncio.sleep(min(max(delay, 0.1), settings.EXPIRY_MAX_SLEEP_SECONDS))
+
+def evict_artifacts(names: List[str]):
+    for name in names:
+        artifact = ARTIFACTS.get(name)
+        if artifact is None:
+            continue
+        try:
+            expire_artifact(artifact)
+            logger.info(f"Artefato removido pelo orçamento de disco: {name}")
+        except Exception as e:
+            logger.error(f"Erro ao remover artefato {name}: {str(e)}")
+
+async def enforce_disk_budget():
+    while True:
+        await DISK_BUDGET.wait_pressure()
+        victims = DISK_BUDGET.victims()
+        if victims:
+            try:
+                await run_io(evict_artifacts, victims)
+            except Exception as e:
+                logger.error(f"Erro na remoção pelo orçamento de disco: {str(e)}")
+
+async def compact_packs():
+    while True:
+        await asyncio.sleep(settings.PACK_COMPACT_INTERVAL_SECONDS)
+        try:
+            reclaimed = await run_io(PACKS.compact, settings.PACK_COMPACT_THRESHOLD)
+            if reclaimed:
+                logger.info(f"Compactação dos segmentos liberou {reclaimed} bytes")
+        except Exception as e:
+            logger.error(f"Erro na compactação dos segmentos: {str(e)}")
 
 if __name__ == "__main__":
     import uvicorn
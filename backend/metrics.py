@@ -0,0 +1,38 @@
+import asyncio
+import time
+from typing import Dict
+
+
+class LoopLagMonitor:
+    """Mede o atraso do event loop: quanto um sleep curto demora além do pedido."""
+
+    def __init__(self, interval: float = 0.1):
+        self.interval = interval
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.average_lag = 0.0
+        self.samples = 0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - start - self.interval, 0.0)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            # Média móvel exponencial para suavizar picos isolados
+            self.average_lag = lag if not self.samples else 0.9 * self.average_lag + 0.1 * lag
+            self.samples += 1
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "average_lag_ms": round(self.average_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "samples": self.samples,
+        }
+
+
+LOOP_LAG = LoopLagMonitor()
+STARTED_AT = time.time()
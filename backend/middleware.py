@@ -1,4 +1,6 @@
 from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, QueryParams
 from starlette.middleware.base import BaseHTTPMiddleware
 from typing import Callable
 import time
@@ -6,6 +8,7 @@ from datetime import datetime, timedelta
 import hashlib
 from config import settings
 import os
+import re
 
 class RateLimitMiddleware(BaseHTTPMiddleware):
     def __init__(self, app):
@@ -70,6 +73,221 @@ class SecurityHeadersMiddleware(BaseHTTPMiddleware):
         
         return response
 
+UPLOAD_METHODS = {"POST", "PUT"}
+SESSION_CHUNK_PATH = re.compile(r"/uploads/[^/]+/chunks/[^/]+")
+
+def request_path(scope) -> str:
+    path = scope["path"]
+    root_path = scope.get("root_path", "")
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    return path
+
+def is_upload_request(scope) -> bool:
+    return scope["method"] in UPLOAD_METHODS and request_path(scope).startswith("/upload")
+
+def is_session_chunk(scope) -> bool:
+    # Chunks de upload retomável: o espaço já foi reservado pela sessão inteira
+    return bool(SESSION_CHUNK_PATH.fullmatch(request_path(scope)))
+
+async def send_error(scope, receive, send, status_code: int, detail: str, headers: dict = None, **extra):
+    response = JSONResponse(status_code=status_code, content={"detail": detail, **extra}, headers=headers)
+    await response(scope, receive, send)
+
+class AdmissionMiddleware:
+    """ASGI puro: decide antes de qualquer leitura do corpo, sem passar por call_next."""
+    
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and is_upload_request(scope):
+            headers = Headers(scope=scope)
+            content_length = headers.get("content-length")
+            nbytes = int(content_length) if content_length and content_length.isdigit() else 0
+            wait = self.controller.check(nbytes, headers.get("x-api-key"))
+            if wait > self.controller.max_wait:
+                await send_error(
+                    scope, receive, send, 503,
+                    "Servidor sobrecarregado. Tente novamente mais tarde.",
+                    headers={"Retry-After": str(self.controller.retry_after(wait))},
+                    estimated_wait_seconds=round(wait, 3)
+                )
+                return
+        await self.app(scope, receive, send)
+
+class DiskBudgetMiddleware:
+    """ASGI puro: reserva no orçamento de disco o tamanho declarado do upload,
+    recusando com 507 antes de ler o corpo; a reserva vale até o fim da requisição.
+    Corpos sem Content-Length (chunked) são reservados à medida que chegam e a
+    requisição é interrompida com 507 quando o próximo pedaço não cabe.
+    Chunks de uploads retomáveis passam direto: a sessão já reservou o arquivo."""
+    
+    def __init__(self, app, budget):
+        self.app = app
+        self.budget = budget
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_upload_request(scope) or is_session_chunk(scope):
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        content_length = headers.get("content-length")
+        api_key = headers.get("x-api-key")
+        if content_length and content_length.isdigit():
+            nbytes = int(content_length)
+            reason = self.budget.try_reserve(api_key, nbytes)
+            if reason:
+                await send_error(scope, receive, send, 507, reason)
+                return
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                self.budget.release(nbytes, api_key)
+            return
+        
+        # Corpo sem tamanho declarado: reserva cada pedaço lido e corta quando não couber
+        reserved = 0
+        response_started = False
+        rejected = False
+        
+        async def reserving_receive():
+            nonlocal reserved, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                size = len(message.get("body", b""))
+                reason = self.budget.try_reserve(api_key, size) if size else None
+                if reason:
+                    rejected = True
+                    if not response_started:
+                        await send_error(scope, receive, send, 507, reason)
+                    return {"type": "http.disconnect"}
+                reserved += size
+            return message
+        
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            response_started = True
+            await send(message)
+        
+        try:
+            await self.app(scope, reserving_receive, guarded_send)
+        except Exception:
+            # O endpoint vê a desconexão simulada; a resposta de erro já foi enviada
+            if not rejected:
+                raise
+        finally:
+            self.budget.release(reserved, api_key)
+
+# Recusas da admissão e do orçamento de disco: o upload não foi processado e sai da cota
+REFUNDED_STATUS = {503, 507}
+
+class UploadValidationMiddleware:
+    """ASGI puro: valida uploads só pelos headers, antes de o corpo ser consumido.
+    
+    Recusa com 413 pelo Content-Length, 400 pela extensão (header X-Filename
+    ou parâmetro filename), 401 pela API Key e 429 pela cota da chave. Corpos
+    sem Content-Length (chunked) têm os bytes contados enquanto são lidos, na
+    cota e no limite de tamanho, e a requisição é interrompida com 429 ou 413
+    ao passar de um deles. Uploads recusados depois (503/507) voltam para a cota.
+    """
+    
+    def __init__(self, app, is_valid_key: Callable[[str], bool], quota):
+        self.app = app
+        self.is_valid_key = is_valid_key
+        self.quota = quota
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_upload_request(scope):
+            await self.app(scope, receive, send)
+            return
+        
+        headers = Headers(scope=scope)
+        max_body_size = settings.MAX_FILE_SIZE + settings.MULTIPART_OVERHEAD
+        content_length = headers.get("content-length")
+        declared_size = int(content_length) if content_length and content_length.isdigit() else None
+        if declared_size is not None and declared_size > max_body_size:
+            await send_error(scope, receive, send, 413, "Arquivo muito grande")
+            return
+        
+        filename = headers.get("x-filename") or QueryParams(scope.get("query_string", b"")).get("filename")
+        if filename and not FileValidationMiddleware.is_valid_file(filename):
+            await send_error(scope, receive, send, 400, "Tipo de arquivo não permitido")
+            return
+        
+        api_key = headers.get("x-api-key")
+        if not api_key:
+            await send_error(scope, receive, send, 401, "API Key não fornecida")
+            return
+        if not self.is_valid_key(api_key):
+            await send_error(scope, receive, send, 401, "API Key inválida")
+            return
+        
+        retry_after = self.quota.try_consume(api_key, declared_size or 0)
+        if retry_after:
+            await send_error(
+                scope, receive, send, 429,
+                "Cota de upload da API Key excedida",
+                headers={"Retry-After": str(retry_after)}
+            )
+            return
+        charged = declared_size or 0
+        
+        async def refunding_send(message):
+            nonlocal charged
+            if message["type"] == "http.response.start" and message["status"] in REFUNDED_STATUS and charged:
+                self.quota.refund(api_key, charged)
+                charged = 0
+            await send(message)
+        
+        if declared_size is not None:
+            await self.app(scope, receive, refunding_send)
+            return
+        
+        # Corpo sem tamanho declarado: conta os bytes na cota e corta ao passar de um limite
+        received = 0
+        response_started = False
+        rejected = False
+        
+        async def capped_receive():
+            nonlocal received, rejected, charged
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                size = len(message.get("body", b""))
+                received += size
+                within_quota = self.quota.charge(api_key, size)
+                charged += size
+                if received > max_body_size or not within_quota:
+                    rejected = True
+                    if not response_started:
+                        if received > max_body_size:
+                            await send_error(scope, receive, send, 413, "Arquivo muito grande")
+                        else:
+                            await send_error(scope, receive, send, 429, "Cota de upload da API Key excedida")
+                    return {"type": "http.disconnect"}
+            return message
+        
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            response_started = True
+            await refunding_send(message)
+        
+        try:
+            await self.app(scope, capped_receive, guarded_send)
+        except Exception:
+            # O endpoint vê a desconexão simulada; a resposta de erro já foi enviada
+            if not rejected:
+                raise
+
 class FileValidationMiddleware:
     @staticmethod
     def is_valid_file(filename: str) -> bool:
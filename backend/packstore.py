@@ -0,0 +1,183 @@
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from loguru import logger
+from fileio import IO_STATS, _write_all, run_io
+from jobqueue import OWNER, owner_alive
+from sqlitedb import SQLiteStore
+
+# Artefatos pequenos não viram arquivos próprios: são anexados a segmentos
+# grandes (PACK_DIR/{processo}-{sequência}.pack) e o índice em SQLite guarda
+# segmento, offset e tamanho de cada um. Um upload pequeno custa uma escrita
+# no fim do segmento aberto e uma linha no commit em grupo, em vez de um
+# inode, uma entrada de diretório e um rename.
+#
+# Os segmentos só crescem; remover um artefato apenas apaga a linha do
+# índice. O compactador reescreve os segmentos fechados em que os bytes mortos
+# passam do limite, copiando os vivos para o segmento aberto, e apaga o antigo
+# quando nenhuma linha aponta mais para ele.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packed (
+    name TEXT PRIMARY KEY,
+    segment TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS packed_segment ON packed (segment);
+"""
+
+SEGMENT_SUFFIX = ".pack"
+
+
+def segment_owner(segment: str) -> Tuple[str, int]:
+    owner, sequence = segment[:-len(SEGMENT_SUFFIX)].rsplit("-", 1)
+    return owner, int(sequence)
+
+
+class PackStore(SQLiteStore):
+    def __init__(self, path: Path, directory: Path, segment_bytes: int):
+        super().__init__(path, SCHEMA)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.write_lock = threading.Lock()
+        self.active: Optional[str] = None
+        self.active_fd: Optional[int] = None
+        self.active_size = 0
+        self.sequence = 0
+        self.compactions = 0
+        self.reclaimed_bytes = 0
+
+    def _rotate(self):
+        # Cada processo anexa só aos próprios segmentos, sem disputar o fim do arquivo
+        if self.active_fd is not None:
+            os.close(self.active_fd)
+        self.sequence += 1
+        self.active = f"{OWNER}-{self.sequence:06d}{SEGMENT_SUFFIX}"
+        self.active_fd = os.open(self.directory / self.active, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.active_size = 0
+
+    def _append(self, data: bytes) -> Tuple[str, int]:
+        with self.write_lock:
+            if self.active_fd is None or (self.active_size and self.active_size + len(data) > self.segment_bytes):
+                self._rotate()
+            offset = self.active_size
+            _write_all(self.active_fd, [data])
+            self.active_size += len(data)
+            IO_STATS["bytes_written"] += len(data)
+            return self.active, offset
+
+    async def put(self, name: str, data: bytes):
+        """Anexa o artefato ao segmento aberto; fica visível depois do commit do índice."""
+        segment, offset = await run_io(self._append, data)
+        await self._submit(
+            "INSERT OR REPLACE INTO packed (name, segment, offset, length) VALUES (?, ?, ?, ?)",
+            (name, segment, offset, len(data))
+        )
+
+    async def read(self, name: str) -> Optional[bytes]:
+        return await run_io(self.get, name)
+
+    # Operações síncronas, para o pool de I/O
+
+    def locate(self, name: str) -> Optional[Tuple[str, int, int]]:
+        with self.lock:
+            return self.conn.execute("SELECT segment, offset, length FROM packed WHERE name = ?", (name,)).fetchone()
+
+    def get(self, name: str) -> Optional[bytes]:
+        """Conteúdo do artefato, ou None se não está nos segmentos."""
+        for _ in range(3):
+            location = self.locate(name)
+            if location is None:
+                return None
+            segment, offset, length = location
+            try:
+                fd = os.open(self.directory / segment, os.O_RDONLY)
+            except FileNotFoundError:
+                continue  # O compactador moveu o artefato depois da consulta
+            try:
+                data = os.pread(fd, length, offset)
+            finally:
+                os.close(fd)
+            IO_STATS["bytes_read"] += len(data)
+            return data
+        return None
+
+    def discard(self, names: List[str]):
+        self._transaction([("DELETE FROM packed WHERE name = ?", (name,)) for name in names])
+
+    def _sealed_segments(self) -> Dict[str, int]:
+        # Segmentos que ninguém mais anexa: o aberto deste processo e o último de cada processo vivo ficam de fora
+        segments = {}
+        latest: Dict[str, int] = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(SEGMENT_SUFFIX):
+                    owner, sequence = segment_owner(entry.name)
+                    latest[owner] = max(latest.get(owner, 0), sequence)
+                    segments[entry.name] = entry.stat().st_size
+        sealed = {}
+        for segment, size in segments.items():
+            owner, sequence = segment_owner(segment)
+            if sequence < latest[owner] or not owner_alive(owner):
+                sealed[segment] = size
+        return sealed
+
+    def compact(self, threshold: float) -> int:
+        """Reescreve os segmentos fechados com mais de threshold em bytes mortos; retorna os bytes liberados."""
+        with self.lock:
+            live = dict(self.conn.execute("SELECT segment, SUM(length) FROM packed GROUP BY segment").fetchall())
+        reclaimed = 0
+        for segment, size in self._sealed_segments().items():
+            live_bytes = live.get(segment, 0)
+            if size and (size - live_bytes) / size < threshold:
+                continue
+            self._rewrite(segment)
+            with self.lock:
+                remaining = self.conn.execute("SELECT COUNT(*) FROM packed WHERE segment = ?", (segment,)).fetchone()[0]
+            if remaining:
+                continue  # Um artefato mudou durante a cópia; fica para a próxima rodada
+            # Leitores que já abriram o segmento continuam lendo; os demais consultam o índice de novo
+            (self.directory / segment).unlink(missing_ok=True)
+            reclaimed += size - live_bytes
+            self.compactions += 1
+        self.reclaimed_bytes += reclaimed
+        return reclaimed
+
+    def _rewrite(self, segment: str):
+        with self.lock:
+            rows = self.conn.execute("SELECT name, offset, length FROM packed WHERE segment = ?", (segment,)).fetchall()
+        if not rows:
+            return
+        moves = []
+        with open(self.directory / segment, "rb") as f:
+            for name, offset, length in rows:
+                new_segment, new_offset = self._append(os.pread(f.fileno(), length, offset))
+                moves.append((new_segment, new_offset, name, segment, offset))
+        # Só move o que não foi removido nem reescrito por outro processo durante a cópia
+        self._transaction([
+            ("UPDATE packed SET segment = ?, offset = ? WHERE name = ? AND segment = ? AND offset = ?", move)
+            for move in moves
+        ])
+        logger.info(f"Segmento {segment} compactado: {len(moves)} artefatos copiados")
+
+    def stats(self) -> Dict:
+        with self.lock:
+            packed, live_bytes = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM packed").fetchone()
+        segments = 0
+        total_bytes = 0
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(SEGMENT_SUFFIX):
+                    segments += 1
+                    total_bytes += entry.stat().st_size
+        return {
+            "packed": packed,
+            "segments": segments,
+            "bytes": total_bytes,
+            "live_bytes": live_bytes,
+            "compactions": self.compactions,
+            "reclaimed_bytes": self.reclaimed_bytes,
+            **self.batch_stats(),
+        }
@@ -0,0 +1,292 @@
+import asyncio
+import json
+import os
+import re
+import secrets
+import threading
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from config import settings
+from bufferpool import get_pool
+from seekable import compress_block
+
+# Uploads retomáveis: o cliente cria uma sessão, envia chunks numerados (em
+# qualquer ordem, inclusive em paralelo) e finaliza. Os chunks são gravados com
+# pwrite em um arquivo pré-alocado e o prefixo contíguo já recebido vai sendo
+# compactado em blocos seekable, de modo que a finalização só compacta o resto.
+
+UPLOAD_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{16,64}")
+
+
+class UploadSession:
+    def __init__(self, upload_id: str, filename: str, size: int, chunk_size: int, level: int,
+                 block_size: Optional[int] = None, received: Optional[List[int]] = None,
+                 compressed_upto: int = 0, compressed_bytes: int = 0, owner: Optional[str] = None,
+                 contiguous_chunks: int = 0):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.size = size
+        self.chunk_size = chunk_size
+        self.level = level
+        self.block_size = block_size or settings.SEEKABLE_BLOCK_SIZE
+        # O estado guarda só o prefixo contíguo e os chunks recebidos fora de ordem depois
+        # dele, para gravar a cada chunk um JSON pequeno em vez da lista inteira
+        self.contiguous_chunks = contiguous_chunks
+        self.received_ahead: Set[int] = set()
+        for index in received or []:
+            self._add_chunk(index)
+        self.compressed_upto = compressed_upto
+        self.compressed_bytes = compressed_bytes
+        self.owner = owner
+        # Bytes reservados no orçamento de disco por esta sessão, devolvidos ao descartá-la
+        self.reserved = 0
+        self.fd: Optional[int] = None
+        # Estado gravado tanto pelo pool de I/O (chunks) quanto pela thread de compressão
+        self.state_lock = threading.Lock()
+        self._lock: Optional[asyncio.Lock] = None
+        self.compress_task: Optional[asyncio.Task] = None
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        # Criado sob demanda no event loop: a sessão pode ser construída no pool de I/O
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def data_path(self) -> Path:
+        return settings.RESUMABLE_DIR / f"{self.upload_id}.data"
+
+    @property
+    def part_path(self) -> Path:
+        return settings.RESUMABLE_DIR / f"{self.upload_id}.xz.part"
+
+    @property
+    def state_path(self) -> Path:
+        return settings.RESUMABLE_DIR / f"{self.upload_id}.json"
+
+    @property
+    def chunk_count(self) -> int:
+        return max(-(-self.size // self.chunk_size), 1)
+
+    def chunk_bounds(self, index: int) -> Tuple[int, int]:
+        if not 0 <= index < self.chunk_count:
+            raise IndexError(index)
+        offset = index * self.chunk_size
+        return offset, min(self.chunk_size, self.size - offset)
+
+    def _add_chunk(self, index: int):
+        if index < self.contiguous_chunks:
+            return
+        self.received_ahead.add(index)
+        while self.contiguous_chunks in self.received_ahead:
+            self.received_ahead.remove(self.contiguous_chunks)
+            self.contiguous_chunks += 1
+
+    def has_chunk(self, index: int) -> bool:
+        return index < self.contiguous_chunks or index in self.received_ahead
+
+    def contiguous_offset(self) -> int:
+        return min(self.contiguous_chunks * self.chunk_size, self.size)
+
+    def is_complete(self) -> bool:
+        return self.contiguous_chunks == self.chunk_count
+
+    def missing_chunks(self) -> List[int]:
+        return [index for index in range(self.contiguous_chunks, self.chunk_count) if index not in self.received_ahead]
+
+    def create(self):
+        fd = os.open(self.data_path, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            if self.size:
+                if hasattr(os, "posix_fallocate"):
+                    os.posix_fallocate(fd, 0, self.size)
+                else:
+                    os.ftruncate(fd, self.size)
+        except OSError:
+            os.close(fd)
+            self.data_path.unlink(missing_ok=True)
+            raise
+        self.fd = fd
+        self.part_path.write_bytes(b"")
+        self.save()
+
+    def open(self):
+        with self.state_lock:
+            if self.fd is None:
+                self.fd = os.open(self.data_path, os.O_RDWR)
+                # Descarta blocos gravados pela metade antes de uma queda
+                os.truncate(self.part_path, self.compressed_bytes)
+
+    def close(self):
+        with self.state_lock:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+
+    def writer_fd(self) -> int:
+        """Cópia do descritor para gravar um chunk, válida mesmo se a sessão for fechada no meio.
+
+        FileNotFoundError se a sessão já foi finalizada ou cancelada.
+        """
+        with self.state_lock:
+            if self.fd is None:
+                raise FileNotFoundError(self.data_path)
+            return os.dup(self.fd)
+
+    def mark_received(self, index: int):
+        # Sob o mesmo lock do close(): um chunk atrasado não regrava o estado de uma sessão removida
+        with self.state_lock:
+            if self.fd is None:
+                raise FileNotFoundError(self.data_path)
+            self._add_chunk(index)
+            self._save()
+
+    def next_block_length(self) -> Optional[int]:
+        """Tamanho do próximo bloco pronto do prefixo contíguo, ou None se ainda não há bloco pronto."""
+        if self.fd is None:
+            return None
+        available = self.contiguous_offset()
+        remaining = available - self.compressed_upto
+        if remaining < self.block_size and available < self.size:
+            return None
+        if remaining <= 0 and (self.compressed_bytes or self.size):
+            return None
+        return min(self.block_size, remaining)
+
+    def compress_next_block(self) -> bool:
+        """Compacta o próximo bloco do prefixo contíguo; retorna False se não houver bloco pronto."""
+        length = self.next_block_length()
+        if length is None:
+            return False
+        with get_pool(self.block_size).lease() as buffer:
+            data = memoryview(buffer)[:length]
+            if hasattr(os, "preadv"):
+                os.preadv(self.fd, [data], self.compressed_upto)
+            else:
+                data[:] = os.pread(self.fd, length, self.compressed_upto)
+            block = compress_block(data, self.level)
+            data.release()
+        with open(self.part_path, "ab") as part:
+            part.write(block)
+        self.compressed_upto += length
+        self.compressed_bytes += len(block)
+        self.save()
+        return True
+
+    def finalize(self, artifact_path: Path) -> int:
+        os.replace(self.part_path, artifact_path)
+        self.remove()
+        return self.compressed_bytes
+
+    def remove(self):
+        self.close()
+        for path in (self.data_path, self.part_path, self.state_path):
+            path.unlink(missing_ok=True)
+
+    def save(self):
+        with self.state_lock:
+            self._save()
+
+    def _save(self):
+        state = {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "level": self.level,
+            "block_size": self.block_size,
+            "contiguous_chunks": self.contiguous_chunks,
+            "received": sorted(self.received_ahead),
+            "compressed_upto": self.compressed_upto,
+            "compressed_bytes": self.compressed_bytes,
+            "owner": self.owner,
+        }
+        tmp_path = self.state_path.with_name(f"{self.state_path.name}.tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self.state_path)
+
+    def status(self) -> Dict:
+        with self.state_lock:
+            received = list(range(self.contiguous_chunks)) + sorted(self.received_ahead)
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "chunk_count": self.chunk_count,
+            "received_chunks": received,
+            "missing_chunks": self.missing_chunks(),
+            "contiguous_offset": self.contiguous_offset(),
+            "compressed_offset": self.compressed_upto,
+            "complete": self.is_complete(),
+        }
+
+
+class UploadSessionStore:
+    """Sessões em memória, recarregadas do estado em disco após um reinício.
+
+    Cada sessão mantém reservado o tamanho do arquivo no orçamento de disco
+    até ser descartada (finalizada, cancelada ou expirada). create, get e
+    load leem e gravam o disco: rodam no pool de I/O.
+    """
+
+    def __init__(self, reserve: Callable[[Optional[str], int], None], release: Callable[[Optional[str], int], None]):
+        self.sessions: Dict[str, UploadSession] = {}
+        self.reserve = reserve
+        self.release = release
+
+    def create(self, filename: str, size: int, chunk_size: int, level: int, owner: Optional[str] = None) -> UploadSession:
+        """Cria a sessão com o espaço que quem chama já reservou; se falhar, a reserva continua com ele."""
+        session = UploadSession(secrets.token_urlsafe(16), filename, size, chunk_size, level, owner=owner)
+        session.create()
+        session.reserved = size
+        self.sessions[session.upload_id] = session
+        return session
+
+    def _load(self, upload_id: str) -> Optional[UploadSession]:
+        session = self.sessions.get(upload_id)
+        if session is not None:
+            return session
+        state_path = settings.RESUMABLE_DIR / f"{upload_id}.json"
+        try:
+            loaded = UploadSession(**json.loads(state_path.read_text()))
+        except (FileNotFoundError, ValueError, TypeError):
+            return None
+        # Outra thread do pool pode ter carregado a mesma sessão nesse meio tempo
+        session = self.sessions.setdefault(upload_id, loaded)
+        if session is loaded:
+            # O espaço já está ocupado em disco: reserva sem conferir os limites
+            self.reserve(session.owner, session.size)
+            session.reserved = session.size
+        return session
+
+    def load(self) -> int:
+        """Recarrega as sessões em disco na partida, para a reserva delas voltar a contar."""
+        loaded = 0
+        for state_path in settings.RESUMABLE_DIR.glob("*.json"):
+            if UPLOAD_ID_PATTERN.fullmatch(state_path.stem) and self._load(state_path.stem):
+                loaded += 1
+        return loaded
+
+    def get(self, upload_id: str) -> Optional[UploadSession]:
+        if not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+            return None
+        session = self._load(upload_id)
+        if session is None:
+            return None
+        try:
+            session.open()
+        except FileNotFoundError:
+            # Arquivos removidos pela limpeza de expirados
+            self.discard(upload_id)
+            return None
+        return session
+
+    def discard(self, upload_id: str):
+        session = self.sessions.pop(upload_id, None)
+        if session:
+            session.close()
+            if session.reserved:
+                self.release(session.owner, session.reserved)
+                session.reserved = 0
@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import itertools
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from stages import WaitStats
+
+# Escalonador das vagas de compressão. Em vez de uma fila FIFO, cada job
+# informa o tamanho e a API Key, e a próxima vaga vai para o job de menor
+# pontuação segundo a política configurada. Parte das vagas fica reservada
+# para jobs pequenos (faixa expressa), para que um arquivo de 10KB nunca
+# espere atrás de vários arquivos de 2GB.
+#
+# Jobs compactados em blocos podem ainda ser preemptados: entre um bloco e
+# outro, se a fatia de tempo do job passou de max_slice e há na fila um job
+# com pontuação melhor, o job devolve a vaga e volta para a fila com a mesma
+# antiguidade, retomando do ponto em que parou quando for escolhido de novo.
+#
+# Com divisão justa, a pontuação começa pelo tempo virtual da API Key, e a
+# CPU é repartida entre as chaves na proporção dos pesos configurados.
+
+SLOWDOWN_SAMPLES = 200
+INTERNAL_TENANT = "interno"  # jobs sem API Key: compactação ociosa, variantes, sessões
+
+
+def tenant_for(api_key: Optional[str]) -> str:
+    # As métricas mostram só um resumo da chave, nunca a chave em si
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12] if api_key else INTERNAL_TENANT
+
+
+@dataclass
+class Job:
+    size: int
+    priority: int
+    enqueued: float
+    seq: int
+    future: Optional[asyncio.Future] = field(default=None, repr=False)
+    express: bool = False
+    tenant: str = INTERNAL_TENANT
+    # Estatísticas de justiça, acumuladas entre preempções
+    queued_at: float = 0.0
+    slice_started: float = 0.0
+    slices: int = 0
+    preemptions: int = 0
+    waited: float = 0.0
+    ran: float = 0.0
+
+    def stats(self, now: float) -> Dict:
+        return {
+            "tenant": self.tenant,
+            "remaining_bytes": self.size,
+            "priority": self.priority,
+            "slices": self.slices,
+            "preemptions": self.preemptions,
+            "waited_seconds": round(self.waited, 3),
+            "ran_seconds": round(self.ran + now - self.slice_started, 3),
+        }
+
+
+class Policy:
+    """Base das políticas: score() ordena a fila; os ganchos permitem políticas com estado."""
+
+    name = ""
+
+    def score(self, job: Job, now: float) -> Tuple:
+        raise NotImplementedError
+
+    def on_enqueue(self, job: Job, backlogged: List[Job]):
+        pass
+
+    def charge(self, job: Job, seconds: float):
+        pass
+
+
+class FifoPolicy(Policy):
+    name = "fifo"
+
+    def score(self, job: Job, now: float) -> Tuple:
+        return (job.priority, job.seq)
+
+
+class ShortestJobFirstPolicy(Policy):
+    """Menor job primeiro, com envelhecimento: cada segundo de espera desconta bytes do tamanho."""
+
+    name = "sjf"
+
+    def __init__(self, aging_bytes_per_second: int):
+        self.aging = aging_bytes_per_second
+
+    def score(self, job: Job, now: float) -> Tuple:
+        return (job.priority, job.size - self.aging * (now - job.enqueued), job.seq)
+
+
+class FairSharePolicy(Policy):
+    """Fila justa ponderada entre API Keys, sobre outra política usada dentro de cada chave.
+
+    Cada chave acumula um tempo virtual: segundos de compressão divididos
+    pelo seu peso. A vaga vai para a chave de menor tempo virtual, de modo
+    que, sob disputa, a fatia de CPU de cada chave converge para o seu peso.
+    Uma chave que volta a ter jobs depois de ociosa começa no menor tempo
+    virtual entre as chaves ativas, sem crédito acumulado.
+    """
+
+    def __init__(self, inner: Policy, weights: Dict[str, float], default_weight: float = 1.0):
+        self.inner = inner
+        self.name = f"fair+{inner.name}"
+        self.weights = {tenant_for(key): weight for key, weight in weights.items()}
+        self.default_weight = default_weight
+        self.virtual_time: Dict[str, float] = {}
+
+    def weight(self, tenant: str) -> float:
+        return self.weights.get(tenant, self.default_weight)
+
+    def score(self, job: Job, now: float) -> Tuple:
+        return (job.priority, self.virtual_time.get(job.tenant, 0.0)) + self.inner.score(job, now)[1:]
+
+    def on_enqueue(self, job: Job, backlogged: List[Job]):
+        active = {other.tenant for other in backlogged if other is not job}
+        if job.tenant in active:
+            return
+        floor = min((self.virtual_time.get(tenant, 0.0) for tenant in active), default=None)
+        if floor is not None:
+            self.virtual_time[job.tenant] = max(self.virtual_time.get(job.tenant, 0.0), floor)
+
+    def charge(self, job: Job, seconds: float):
+        self.virtual_time[job.tenant] = self.virtual_time.get(job.tenant, 0.0) + seconds / self.weight(job.tenant)
+
+
+class TenantStats(WaitStats):
+    def __init__(self):
+        super().__init__()
+        self.cpu_seconds = 0.0
+
+
+def make_policy(name: str, aging_bytes_per_second: int, fair_share: bool = False,
+                weights: Optional[Dict[str, float]] = None, default_weight: float = 1.0) -> Policy:
+    if name == "fifo":
+        policy = FifoPolicy()
+    elif name == "sjf":
+        policy = ShortestJobFirstPolicy(aging_bytes_per_second)
+    else:
+        raise ValueError(f"Política de escalonamento desconhecida: {name}")
+    if fair_share:
+        policy = FairSharePolicy(policy, weights or {}, default_weight)
+    return policy
+
+
+class CompressionScheduler:
+    def __init__(self, limit: int, policy: Policy, express_slots: int = 0, express_max_bytes: int = 0,
+                 priorities: Optional[Dict[str, int]] = None, default_priority: int = 1,
+                 max_slice: float = 0.0):
+        self.limit = limit
+        self.max_slice = max_slice
+        self.policy = policy
+        self.express_max_bytes = express_max_bytes
+        # Jobs grandes nunca ocupam as vagas reservadas, mas sempre têm ao menos uma
+        self.large_limit = max(limit - express_slots, 1) if express_max_bytes else limit
+        self.priorities = priorities or {}
+        self.default_priority = default_priority
+        self.active = 0
+        self.active_large = 0
+        self.waiters: List[Job] = []
+        self.running: List[Job] = []
+        self.seq = itertools.count()
+        self.small = WaitStats()
+        self.large = WaitStats()
+        self.preemptions = 0
+        self.tenants: Dict[str, TenantStats] = {}
+        # Slowdown (tempo total / tempo de CPU) dos últimos jobs concluídos
+        self.slowdowns = {True: deque(maxlen=SLOWDOWN_SAMPLES), False: deque(maxlen=SLOWDOWN_SAMPLES)}
+
+    def locked(self) -> bool:
+        return self.active >= self.limit
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    def priority_for(self, api_key: Optional[str]) -> int:
+        return self.priorities.get(api_key, self.default_priority)
+
+    def _can_start(self, job: Job) -> bool:
+        if self.active >= self.limit:
+            return False
+        return job.express or self.active_large < self.large_limit
+
+    def _start(self, job: Job):
+        job.slice_started = time.monotonic()
+        self.active += 1
+        self.running.append(job)
+        if not job.express:
+            self.active_large += 1
+
+    def _dispatch(self):
+        now = time.monotonic()
+        while self.waiters and self.active < self.limit:
+            eligible = [job for job in self.waiters if self._can_start(job)]
+            if not eligible:
+                return
+            job = min(eligible, key=lambda job: self.policy.score(job, now))
+            self.waiters.remove(job)
+            if job.future.done():
+                continue
+            self._start(job)
+            job.future.set_result(None)
+
+    def _new_job(self, size: int, api_key: Optional[str]) -> Job:
+        job = Job(size, self.priority_for(api_key), time.monotonic(), next(self.seq), tenant=tenant_for(api_key))
+        job.express = bool(self.express_max_bytes) and size <= self.express_max_bytes
+        return job
+
+    def backlog(self, size: int, api_key: Optional[str] = None) -> Tuple[int, int]:
+        """Bytes que um novo job deste tamanho teria à frente e quantas vagas os atenderiam."""
+        probe = self._new_job(size, api_key)
+        if self._can_start(probe):
+            return 0, self.limit
+        now = time.monotonic()
+        score = self.policy.score(probe, now)
+        if probe.express:
+            # Um job pequeno só espera por outros pequenos: os grandes não passam do seu limite
+            ahead = sum(job.size for job in self.waiters if job.express and self.policy.score(job, now) < score)
+            ahead += sum(job.size for job in self.running if job.express)
+            return ahead, max(self.limit - self.active_large, 1)
+        ahead = sum(job.size for job in self.waiters if self.policy.score(job, now) < score)
+        ahead += sum(job.size for job in self.running)
+        return ahead, self.large_limit
+
+    async def acquire(self, size: int = 0, api_key: Optional[str] = None, resume: Optional[Job] = None) -> Job:
+        """Espera uma vaga; resume devolve à fila um job preemptado, com a antiguidade original."""
+        job = resume or self._new_job(size, api_key)
+        job.queued_at = time.monotonic()
+        stats = self.small if job.express else self.large
+        tenant = self.tenants.setdefault(job.tenant, TenantStats())
+        # Todo job passa pela fila, para que a política decida mesmo sem espera
+        job.future = asyncio.get_running_loop().create_future()
+        self.policy.on_enqueue(job, self.waiters + self.running)
+        self.waiters.append(job)
+        self._dispatch()
+        if not job.future.done():
+            stats.peak_queued = max(stats.peak_queued, sum(1 for waiter in self.waiters if waiter.express == job.express))
+            tenant.peak_queued = max(tenant.peak_queued, sum(1 for waiter in self.waiters if waiter.tenant == job.tenant))
+        try:
+            await job.future
+        except asyncio.CancelledError:
+            if job.future.done() and not job.future.cancelled():
+                # A vaga já tinha sido concedida: devolve para o próximo
+                self.release(job, finished=False)
+            elif job in self.waiters:
+                self.waiters.remove(job)
+            raise
+        stats.record(job.queued_at)
+        tenant.record(job.queued_at)
+        job.waited += job.slice_started - job.queued_at
+        return job
+
+    def release(self, job: Job, finished: bool = True):
+        now = time.monotonic()
+        elapsed = now - job.slice_started
+        job.ran += elapsed
+        job.slices += 1
+        # Cada vaga é uma thread de compressão: o tempo na vaga aproxima os segundos de CPU
+        self.policy.charge(job, elapsed)
+        self.tenants.setdefault(job.tenant, TenantStats()).cpu_seconds += elapsed
+        self.active -= 1
+        self.running.remove(job)
+        if not job.express:
+            self.active_large -= 1
+        if finished:
+            self.slowdowns[job.express].append((now - job.enqueued) / max(job.ran, 0.001))
+        self._dispatch()
+
+    def should_yield(self, job: Job, remaining: Optional[int] = None) -> bool:
+        """Chamado entre blocos: a fatia acabou e há na fila alguém que a política põe à frente?"""
+        if remaining is not None:
+            # Para a política, o tamanho de um job em andamento é o que falta compactar
+            job.size = remaining
+        now = time.monotonic()
+        if not self.max_slice or not self.waiters or now - job.slice_started < self.max_slice:
+            return False
+        score = self.policy.score(job, now)
+        return any(self.policy.score(waiter, now) < score for waiter in self.waiters)
+
+    def preempt(self, job: Job):
+        self.preemptions += 1
+        job.preemptions += 1
+        self.release(job, finished=False)
+
+    def fairness(self) -> Dict:
+        samples = list(self.slowdowns[True]) + list(self.slowdowns[False])
+        # Índice de Jain sobre os slowdowns: 1 quando todos os jobs esperam na mesma proporção
+        jain = sum(samples) ** 2 / (len(samples) * sum(x * x for x in samples)) if samples else 1.0
+        return {
+            "jain_index": round(jain, 3),
+            "average_slowdown_small": round(sum(self.slowdowns[True]) / len(self.slowdowns[True]), 3) if self.slowdowns[True] else None,
+            "average_slowdown_large": round(sum(self.slowdowns[False]) / len(self.slowdowns[False]), 3) if self.slowdowns[False] else None,
+        }
+
+    def tenant_stats(self) -> Dict[str, Dict]:
+        total_cpu = sum(tenant.cpu_seconds for tenant in self.tenants.values()) or 1.0
+        weight = getattr(self.policy, "weight", lambda tenant: 1.0)
+        result = {}
+        for name, tenant in self.tenants.items():
+            result[name] = {
+                "weight": weight(name),
+                "queued": sum(1 for job in self.waiters if job.tenant == name),
+                "running": sum(1 for job in self.running if job.tenant == name),
+                "cpu_seconds": round(tenant.cpu_seconds, 3),
+                "cpu_share": round(tenant.cpu_seconds / total_cpu, 3),
+                "virtual_time": round(getattr(self.policy, "virtual_time", {}).get(name, 0.0), 3),
+                **tenant.stats(),
+            }
+        return result
+
+    def stats(self) -> Dict:
+        by_priority: Dict[int, int] = {}
+        for job in self.waiters:
+            by_priority[job.priority] = by_priority.get(job.priority, 0) + 1
+        return {
+            "policy": self.policy.name,
+            "limit": self.limit,
+            "large_limit": self.large_limit,
+            "express_max_bytes": self.express_max_bytes,
+            "active": self.active,
+            "active_large": self.active_large,
+            "queued": self.queued,
+            "queued_by_priority": by_priority,
+            "small": self.small.stats(),
+            "large": self.large.stats(),
+            "max_slice_seconds": self.max_slice,
+            "preemptions": self.preemptions,
+            "fairness": self.fairness(),
+            "running": [job.stats(time.monotonic()) for job in self.running],
+            "tenants": self.tenant_stats(),
+        }
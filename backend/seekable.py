@@ -0,0 +1,306 @@
+import bisect
+import hashlib
+import lzma
+import os
+import zipfile
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+from config import settings
+from bufferpool import get_pool
+
+# Formato .xz seekable: o arquivo é uma concatenação de streams xz independentes,
+# um por bloco de SEEKABLE_BLOCK_SIZE bytes do original. Qualquer descompactador
+# xz lê o resultado normalmente, e o índice de cada stream (gravado no próprio
+# formato xz) permite localizar e descompactar só os blocos de um intervalo.
+
+XZ_HEADER_MAGIC = b"\xfd7zXZ\x00"
+XZ_FOOTER_MAGIC = b"YZ"
+XZ_HEADER_SIZE = 12
+XZ_FOOTER_SIZE = 12
+
+
+@dataclass(frozen=True)
+class XZBlock:
+    uncompressed_offset: int
+    uncompressed_size: int
+    compressed_offset: int
+    compressed_size: int
+
+
+# Dicionário de cada preset do xz (0 a 9), em MiB
+PRESET_DICT_MIB = (0.25, 1, 2, 4, 4, 8, 8, 16, 32, 64)
+LZMA_MIN_DICT = 4096
+
+
+def compress_block(data, preset: int) -> bytes:
+    # Cada bloco é um stream independente: um dicionário maior que o bloco só
+    # custa memória e a inicialização dele (64 MiB no preset 9) a cada bloco
+    dict_size = max(min(len(data), int(PRESET_DICT_MIB[preset] * 1024 * 1024)), LZMA_MIN_DICT)
+    filters = [{"id": lzma.FILTER_LZMA2, "preset": preset, "dict_size": dict_size}]
+    return lzma.compress(data, format=lzma.FORMAT_XZ, check=lzma.CHECK_CRC64, filters=filters)
+
+
+class SeekableXZWriter:
+    """Escreve um .xz seekable a partir de escritas de tamanho arbitrário."""
+
+    def __init__(self, fileobj: BinaryIO, preset: int, block_size: Optional[int] = None):
+        self.fileobj = fileobj
+        self.preset = preset
+        self.block_size = block_size or settings.SEEKABLE_BLOCK_SIZE
+        self.pending = bytearray()
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.hash = hashlib.sha256()  # do original, calculado junto com a compressão
+
+    def write(self, data) -> int:
+        self.pending += data
+        self.bytes_in += len(data)
+        while len(self.pending) >= self.block_size:
+            with memoryview(self.pending) as view:
+                self._flush_block(view[:self.block_size])
+            del self.pending[:self.block_size]
+        return len(data)
+
+    def _flush_block(self, data):
+        self.hash.update(data)
+        block = compress_block(data, self.preset)
+        self.fileobj.write(block)
+        self.bytes_out += len(block)
+
+    def close(self):
+        # Um arquivo vazio ainda precisa de um stream válido
+        if self.pending or self.bytes_out == 0:
+            self._flush_block(bytes(self.pending))
+            self.pending.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+
+class SeekableXZJob:
+    """Compacta um arquivo no formato seekable, um bloco por chamada de step().
+
+    O estado (arquivos abertos e posição) fica no objeto, de modo que a
+    compressão pode ser suspensa entre blocos e retomada depois, em qualquer
+    thread.
+    """
+
+    def __init__(self, src_path: Path, dst_path: Path, preset: int):
+        self.preset = preset
+        self.pool = get_pool(settings.SEEKABLE_BLOCK_SIZE)
+        self.src = open(src_path, "rb")
+        try:
+            self.dst = open(dst_path, "wb")
+        except BaseException:
+            self.src.close()
+            raise
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.hash = hashlib.sha256()
+        self.finished = False
+
+    def step(self) -> bool:
+        """Compacta o próximo bloco; retorna False quando não há mais blocos."""
+        if self.finished:
+            return False
+        with self.pool.lease() as buffer:
+            # Cada bloco é lido com readinto no buffer do pool e compactado a partir de uma fatia dele
+            length = self.src.readinto(buffer)
+            if not length:
+                self.finished = True
+                if self.bytes_out:
+                    return False
+                # Um arquivo vazio ainda precisa de um stream válido
+                block = compress_block(b"", self.preset)
+            else:
+                with memoryview(buffer) as view:
+                    self.hash.update(view[:length])
+                    block = compress_block(view[:length], self.preset)
+        self.dst.write(block)
+        self.bytes_in += length
+        self.bytes_out += len(block)
+        return not self.finished
+
+    def close(self):
+        self.src.close()
+        self.dst.close()
+
+
+def compress_zip_fallback(file_path: Path, xz_path: Path, zip_path: Path, safe_filename: str, compression_level: int,
+                          checkpoint: Optional[Callable[[], None]] = None) -> Path:
+    # Se LZMA não for eficiente, tenta ZIP, em chunks com ponto de cancelamento entre eles
+    force_zip64 = os.path.getsize(file_path) >= zipfile.ZIP64_LIMIT
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=compression_level) as zipf, \
+            zipf.open(safe_filename, 'w', force_zip64=force_zip64) as dst, \
+            open(file_path, 'rb') as src, \
+            get_pool(settings.BUFFER_SIZE).lease() as buffer:
+        while length := src.readinto(buffer):
+            if checkpoint:
+                checkpoint()
+            dst.write(memoryview(buffer)[:length])
+
+    if zip_path.stat().st_size < xz_path.stat().st_size:
+        os.remove(xz_path)
+        return zip_path
+    os.remove(zip_path)
+    return xz_path
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    value = 0
+    for i in range(9):
+        byte = buf[pos + i]
+        value |= (byte & 0x7F) << (7 * i)
+        if not byte & 0x80:
+            return value, pos + i + 1
+    raise ValueError("Inteiro inválido no índice xz")
+
+
+def _parse_streams(f: BinaryIO, file_size: int) -> List[Tuple[int, int, int]]:
+    # Percorre os streams de trás para frente usando o footer de cada um
+    streams = []
+    pos = file_size
+    while pos > 0:
+        f.seek(pos - 4)
+        if f.read(4) == b"\x00\x00\x00\x00":
+            # Stream padding entre streams concatenados
+            pos -= 4
+            continue
+
+        f.seek(pos - XZ_FOOTER_SIZE)
+        footer = f.read(XZ_FOOTER_SIZE)
+        if footer[10:12] != XZ_FOOTER_MAGIC:
+            raise ValueError("Footer xz inválido")
+        index_size = (int.from_bytes(footer[4:8], "little") + 1) * 4
+
+        f.seek(pos - XZ_FOOTER_SIZE - index_size)
+        index = f.read(index_size)
+        if index[0] != 0:
+            raise ValueError("Índice xz inválido")
+
+        records, cursor = _read_varint(index, 1)
+        blocks_size = 0
+        uncompressed_size = 0
+        for _ in range(records):
+            unpadded, cursor = _read_varint(index, cursor)
+            uncompressed, cursor = _read_varint(index, cursor)
+            blocks_size += (unpadded + 3) & ~3
+            uncompressed_size += uncompressed
+
+        stream_size = XZ_HEADER_SIZE + blocks_size + index_size + XZ_FOOTER_SIZE
+        start = pos - stream_size
+        f.seek(start)
+        if start < 0 or f.read(len(XZ_HEADER_MAGIC)) != XZ_HEADER_MAGIC:
+            raise ValueError("Header xz inválido")
+
+        streams.append((start, stream_size, uncompressed_size))
+        pos = start
+
+    streams.reverse()
+    return streams
+
+
+@lru_cache(maxsize=256)
+def _cached_index(path: str, mtime_ns: int, size: int) -> Tuple[XZBlock, ...]:
+    with open(path, "rb") as f:
+        streams = _parse_streams(f, size)
+
+    blocks = []
+    offset = 0
+    for start, stream_size, uncompressed_size in streams:
+        blocks.append(XZBlock(offset, uncompressed_size, start, stream_size))
+        offset += uncompressed_size
+    return tuple(blocks)
+
+
+def read_xz_index(path: Path) -> Tuple[XZBlock, ...]:
+    stat = os.stat(path)
+    return _cached_index(str(path), stat.st_mtime_ns, stat.st_size)
+
+
+def xz_original_size(path: Path) -> int:
+    blocks = read_xz_index(path)
+    return blocks[-1].uncompressed_offset + blocks[-1].uncompressed_size if blocks else 0
+
+
+def iter_xz_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    """Gera os bytes [start, end] do original descompactando só os blocos necessários."""
+    blocks = read_xz_index(path)
+    offsets = [block.uncompressed_offset for block in blocks]
+    first = max(bisect.bisect_right(offsets, start) - 1, 0)
+
+    with open(path, "rb") as f:
+        for block in blocks[first:]:
+            if block.uncompressed_offset > end:
+                break
+            f.seek(block.compressed_offset)
+            data = lzma.decompress(f.read(block.compressed_size), format=lzma.FORMAT_XZ)
+            lo = max(start - block.uncompressed_offset, 0)
+            hi = min(end - block.uncompressed_offset + 1, len(data))
+            yield data[lo:hi]
+
+
+def iter_file_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(1024 * 1024, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def zip_original_size(path: Path) -> int:
+    with zipfile.ZipFile(path) as zipf:
+        return zipf.infolist()[0].file_size
+
+
+def iter_zip_range(path: Path, start: int, end: int) -> Iterator[bytes]:
+    # Artefatos .zip não têm blocos independentes; o seek do zipfile
+    # descompacta sequencialmente até o início do intervalo
+    with zipfile.ZipFile(path) as zipf:
+        with zipf.open(zipf.infolist()[0]) as member:
+            member.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = member.read(min(1024 * 1024, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+
+def parse_range(spec: str, total: int) -> Tuple[int, int]:
+    """Converte "inicio-fim", "inicio-" ou "-sufixo" em um intervalo fechado.
+
+    Aceita também o prefixo "bytes=" do header Range. Levanta ValueError
+    quando o intervalo é inválido ou não pode ser satisfeito.
+    """
+    spec = spec.strip()
+    if spec.startswith("bytes="):
+        spec = spec[len("bytes="):]
+    first, sep, last = spec.partition("-")
+    if not sep:
+        raise ValueError("Intervalo inválido")
+
+    if not first:
+        suffix = int(last)
+        if suffix <= 0:
+            raise ValueError("Intervalo inválido")
+        start, end = max(total - suffix, 0), total - 1
+    else:
+        start = int(first)
+        end = int(last) if last else total - 1
+        end = min(end, total - 1)
+
+    if start < 0 or start > end or start >= total:
+        raise ValueError("Intervalo não satisfatório")
+    return start, end
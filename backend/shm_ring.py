@@ -0,0 +1,269 @@
+import multiprocessing
+import queue
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+from loguru import logger
+from seekable import compress_block
+
+# Transporte sem cópia entre as threads de compressão e processos de
+# compressão: cada worker tem um ring buffer em memória compartilhada com N
+# slots do tamanho de um bloco seekable. A thread preenche um slot por vez e o
+# publica; o worker compacta o bloco direto do slot, sem pickle nem pipe para
+# os dados. O controle de fluxo usa dois semáforos: slots livres e slots
+# preenchidos.
+#
+# Cada bloco só vai para um processo depois de recebido por inteiro, dentro da
+# vaga de CPU do escalonador; toda espera pelo processo tem prazo, e um
+# processo que morre ou trava é substituído.
+
+# spawn evita herdar por fork as threads e o event loop do servidor
+CONTEXT = multiprocessing.get_context("spawn")
+
+SLOT_HEADER = struct.Struct("<q")
+END_OF_STREAM = -1
+# Intervalo em que as esperas pelo processo conferem se ele ainda existe
+LIVENESS_INTERVAL = 0.5
+
+
+class WorkerLost(RuntimeError):
+    pass
+
+
+class ShmRing:
+    def __init__(self, slots: int, slot_size: int):
+        self.slots = slots
+        self.slot_size = slot_size
+        self.stride = SLOT_HEADER.size + slot_size
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * self.stride)
+        self.free_slots = CONTEXT.Semaphore(slots)
+        self.filled_slots = CONTEXT.Semaphore(0)
+        # Índices locais de cada lado; como todo slot publicado é consumido,
+        # produtor e consumidor permanecem sincronizados entre streams
+        self.head = 0
+        self.tail = 0
+        self.fill = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+
+    def _payload(self, index: int) -> memoryview:
+        start = index * self.stride + SLOT_HEADER.size
+        return self.shm.buf[start:start + self.slot_size]
+
+    def _set_length(self, index: int, length: int):
+        SLOT_HEADER.pack_into(self.shm.buf, index * self.stride, length)
+
+    # Lado produtor (thread de compressão)
+
+    def try_reserve(self) -> bool:
+        return self.free_slots.acquire(block=False)
+
+    def reserve(self, timeout: Optional[float] = None) -> bool:
+        return self.free_slots.acquire(timeout=timeout)
+
+    def fill_slot(self, data) -> int:
+        """Copia o máximo possível de data para o slot atual e retorna quantos bytes usou."""
+        taken = min(len(data), self.slot_size - self.fill)
+        payload = self._payload(self.head)
+        payload[self.fill:self.fill + taken] = data[:taken]
+        payload.release()
+        self.fill += taken
+        return taken
+
+    def slot_full(self) -> bool:
+        return self.fill == self.slot_size
+
+    def publish(self, length: Optional[int] = None):
+        self._set_length(self.head, self.fill if length is None else length)
+        self.head = (self.head + 1) % self.slots
+        self.fill = 0
+        self.filled_slots.release()
+
+    # Lado consumidor (processo de compressão)
+
+    def consume(self) -> Tuple[int, Optional[memoryview]]:
+        self.filled_slots.acquire()
+        length = SLOT_HEADER.unpack_from(self.shm.buf, self.tail * self.stride)[0]
+        return length, self._payload(self.tail)[:max(length, 0)]
+
+    def release_slot(self):
+        self.tail = (self.tail + 1) % self.slots
+        self.free_slots.release()
+
+    def close(self, unlink: bool = False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+def _worker_main(ring: ShmRing, conn):
+    # Processo de compressão: recebe (destino, preset) pelo pipe e os dados pelo ring;
+    # os blocos são anexados ao destino, e um bloco que falha é desfeito
+    while True:
+        job = conn.recv()
+        if job is None:
+            break
+        dst_path, preset = job
+        bytes_in = 0
+        bytes_out = 0
+        error = None
+        with open(dst_path, "ab") as dst:
+            start = dst.tell()
+            while True:
+                length, payload = ring.consume()
+                try:
+                    if length == END_OF_STREAM:
+                        break
+                    if error is None:
+                        try:
+                            block = compress_block(payload, preset)
+                            dst.write(block)
+                            bytes_in += length
+                            bytes_out += len(block)
+                        except Exception as e:
+                            # Continua consumindo até o fim do stream para liberar o produtor
+                            error = e
+                finally:
+                    payload.release()
+                    ring.release_slot()
+            if error is None and not bytes_in:
+                # Um arquivo vazio ainda precisa de um stream válido
+                block = compress_block(b"", preset)
+                dst.write(block)
+                bytes_out += len(block)
+            if error:
+                dst.truncate(start)
+        conn.send(("error" if error else "ok", bytes_in, bytes_out, str(error or "")))
+    ring.close()
+
+
+class RingWorker:
+    def __init__(self, slots: int, slot_size: int):
+        self.ring = ShmRing(slots, slot_size)
+        self.conn, child_conn = CONTEXT.Pipe()
+        self.process = CONTEXT.Process(target=_worker_main, args=(self.ring, child_conn), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def _wait(self, ready: Callable[[float], bool], deadline: float):
+        while not ready(LIVENESS_INTERVAL):
+            if not self.process.is_alive():
+                raise WorkerLost(f"Processo de compressão {self.process.pid} encerrado")
+            if time.monotonic() >= deadline:
+                raise WorkerLost(f"Processo de compressão {self.process.pid} não respondeu")
+
+    def compress(self, dst_path: Path, preset: int, data, timeout: float) -> int:
+        """Envia os dados pelo ring e espera o processo anexá-los a dst_path; retorna o tamanho compactado."""
+        deadline = time.monotonic() + timeout
+        self.conn.send((str(dst_path), preset))
+        view = memoryview(data)
+        while view:
+            self._wait(self.ring.reserve, deadline)
+            view = view[self.ring.fill_slot(view):]
+            self.ring.publish()
+        self._wait(self.ring.reserve, deadline)
+        self.ring.publish(END_OF_STREAM)
+        self._wait(self.conn.poll, deadline)
+        status, _, bytes_out, error = self.conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Erro no processo de compressão: {error}")
+        return bytes_out
+
+    def stop(self, graceful: bool = True):
+        try:
+            if graceful and self.process.is_alive():
+                self.conn.send(None)
+                self.process.join(timeout=5)
+        except OSError:
+            pass  # O processo fechou o pipe ao morrer
+        finally:
+            if self.process.is_alive():
+                # SIGKILL também encerra um processo parado
+                self.process.kill()
+                self.process.join(timeout=5)
+            self.conn.close()
+            self.ring.close(unlink=True)
+
+
+class RingWorkerPool:
+    """Processos de compressão de longa duração, cada um com o seu ring buffer."""
+
+    def __init__(self, size: int, slots: int, slot_size: int, timeout: float):
+        self.size = size
+        self.slots = slots
+        self.slot_size = slot_size
+        self.timeout = timeout
+        self.workers: List[RingWorker] = []
+        self.idle: "queue.Queue[RingWorker]" = queue.Queue()
+        self.lock = threading.Lock()
+        self.recycled = 0
+
+    def start(self):
+        for _ in range(self.size):
+            worker = RingWorker(self.slots, self.slot_size)
+            self.workers.append(worker)
+            self.idle.put(worker)
+        logger.info(f"{self.size} processos de compressão iniciados (ring de {self.slots} x {self.slot_size} bytes)")
+
+    def _replace(self, worker: RingWorker) -> RingWorker:
+        # O ring do processo perdido pode ter ficado no meio de um bloco: sai junto com ele
+        worker.stop(graceful=False)
+        replacement = RingWorker(self.slots, self.slot_size)
+        with self.lock:
+            self.workers[self.workers.index(worker)] = replacement
+            self.recycled += 1
+        logger.warning(f"Processo de compressão {worker.process.pid} substituído por {replacement.process.pid}")
+        return replacement
+
+    def compress(self, dst_path: Path, preset: int, data) -> int:
+        """Compacta um bloco já recebido em um processo livre, anexando-o a dst_path.
+
+        Bloqueante, para a thread de compressão; se o processo morrer ou não
+        responder dentro do prazo, ele é substituído e o bloco falha.
+        """
+        try:
+            worker = self.idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise WorkerLost("Nenhum processo de compressão livre")
+        try:
+            if not worker.process.is_alive():
+                # Morreu enquanto estava livre: nenhum bloco se perdeu
+                worker = self._replace(worker)
+            return worker.compress(dst_path, preset, data, self.timeout)
+        except (WorkerLost, OSError, EOFError) as e:
+            # Pipe quebrado também é processo perdido
+            worker = self._replace(worker)
+            if isinstance(e, WorkerLost):
+                raise
+            raise WorkerLost(f"Processo de compressão perdido: {str(e)}") from e
+        finally:
+            self.idle.put(worker)
+
+    def stop(self):
+        with self.lock:
+            workers = list(self.workers)
+            self.workers.clear()
+        for worker in workers:
+            worker.stop()
+
+    def stats(self):
+        with self.lock:
+            pids = [worker.process.pid for worker in self.workers]
+        return {
+            "workers": len(pids),
+            "idle": self.idle.qsize(),
+            "slots": self.slots,
+            "slot_size": self.slot_size,
+            "recycled": self.recycled,
+            "pid": pids,
+        }
@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from fileio import run_io
+
+# Base dos bancos SQLite locais (fila de jobs, índice de expiração): uma
+# conexão por processo em modo WAL, compartilhada pelas threads sob um lock.
+#
+# As escritas vindas do event loop são agrupadas: enquanto uma transação
+# grava no pool de I/O, as seguintes se acumulam e vão todas no próximo commit.
+
+
+class SQLiteStore:
+    def __init__(self, path: Path, schema: str):
+        self.path = path
+        self.schema = schema
+        self.lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self.pending: List[Tuple[str, Tuple, asyncio.Future]] = []
+        self.flusher: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.batched_operations = 0
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # Em WAL, NORMAL só perde as últimas transações numa queda de energia, nunca corrompe
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(self.schema)
+            self._migrate(conn)
+            self._conn = conn
+        return self._conn
+
+    def _migrate(self, conn: sqlite3.Connection):
+        # Ajustes de esquema em bancos criados por versões anteriores
+        pass
+
+    def _transaction(self, operations: List[Tuple[str, Tuple]]) -> List[int]:
+        with self.lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                results = [conn.execute(sql, params).lastrowid for sql, params in operations]
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return results
+
+    def _submit(self, sql: str, params: Tuple) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((sql, params, future))
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._flush())
+        return future
+
+    def _submit_nowait(self, sql: str, params: Tuple) -> asyncio.Future:
+        # Para escritas que ninguém aguarda: o erro já fica registrado no future
+        future = self._submit(sql, params)
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return future
+
+    async def _flush(self):
+        try:
+            while self.pending:
+                batch, self.pending = self.pending, []
+                try:
+                    results = await run_io(self._transaction, [(sql, params) for sql, params, _ in batch])
+                except Exception as e:
+                    for _, _, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                self.batches += 1
+                self.batched_operations += len(batch)
+                for (_, _, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self.flusher = None
+
+    def batch_stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "average_batch": round(self.batched_operations / self.batches, 2) if self.batches else 0.0,
+        }
@@ -0,0 +1,154 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Tuple
+
+# Admissão por estágio: a recepção pela rede, a compressão (CPU) e o espaço
+# de staging em disco entre elas têm limites independentes. Cada estágio é
+# uma fila FIFO com estatísticas de profundidade e de tempo de espera, para
+# que cada limite possa ser dimensionado separadamente.
+
+
+class WaitStats:
+    def __init__(self):
+        self.acquired = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.peak_queued = 0
+
+    def record(self, started: float):
+        wait = time.monotonic() - started
+        self.acquired += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "acquired": self.acquired,
+            "peak_queued": self.peak_queued,
+            "average_wait_ms": round(self.total_wait / self.acquired * 1000, 3) if self.acquired else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+        }
+
+
+class Stage(WaitStats):
+    """Limite de concorrência com fila FIFO; a vaga liberada passa direto ao próximo da fila."""
+
+    def __init__(self, name: str, limit: int):
+        super().__init__()
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+    def locked(self) -> bool:
+        return self.active >= self.limit
+
+    @property
+    def queued(self) -> int:
+        return len(self.waiters)
+
+    async def acquire(self):
+        started = time.monotonic()
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append(waiter)
+            self.peak_queued = max(self.peak_queued, len(self.waiters))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # A vaga já tinha sido repassada: devolve para o próximo
+                    self.release()
+                else:
+                    self.waiters.remove(waiter)
+                raise
+        self.record(started)
+
+    def release(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": self.queued,
+            **super().stats(),
+        }
+
+
+class StagingQuota(WaitStats):
+    """Bytes em disco entre a recepção e a compressão; reservas esperam em ordem FIFO."""
+
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.used = 0
+        self.peak_used = 0
+        self.waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+    def _fits(self, nbytes: int) -> bool:
+        # Um arquivo maior que a cota inteira passa sozinho
+        return self.used + nbytes <= self.max_bytes or self.used == 0
+
+    def _grant(self, nbytes: int):
+        self.used += nbytes
+        self.peak_used = max(self.peak_used, self.used)
+
+    async def reserve(self, nbytes: int) -> int:
+        started = time.monotonic()
+        if not self.waiters and self._fits(nbytes):
+            self._grant(nbytes)
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self.waiters.append((nbytes, waiter))
+            self.peak_queued = max(self.peak_queued, len(self.waiters))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self.release(nbytes)
+                else:
+                    self.waiters.remove((nbytes, waiter))
+                    self._wake()
+                raise
+        self.record(started)
+        return nbytes
+
+    def add(self, nbytes: int):
+        """Contabiliza sem esperar bytes além do reservado (corpo sem Content-Length)."""
+        self._grant(nbytes)
+
+    def release(self, nbytes: int):
+        self.used -= nbytes
+        self._wake()
+
+    def _wake(self):
+        while self.waiters and self._fits(self.waiters[0][0]):
+            nbytes, waiter = self.waiters.popleft()
+            if not waiter.done():
+                self._grant(nbytes)
+                waiter.set_result(None)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "max_bytes": self.max_bytes,
+            "used_bytes": self.used,
+            "peak_used_bytes": self.peak_used,
+            "queued": len(self.waiters),
+            **super().stats(),
+        }
@@ -0,0 +1,115 @@
+import argparse
+import hashlib
+import os
+import threading
+from pathlib import Path
+from typing import Iterator, Set
+from loguru import logger
+from config import settings
+
+# Layout em disco de COMPRESSED_DIR e UPLOAD_DIR: cada arquivo fica em
+# subdiretórios escolhidos pelo hash do nome (com 2 níveis, 256 x 256), em vez
+# de todos no mesmo diretório. Com muitos arquivos, criar, abrir e listar um
+# diretório único fica lento no ext4/overlayfs; em shards cada diretório
+# guarda poucas entradas. O caminho sai só do nome, então quem conhece o nome
+# do artefato (download, worker, fila) encontra o arquivo sem consultar nada.
+#
+# Na partida, o servidor move para os shards os arquivos soltos na raiz de
+# COMPRESSED_DIR. Para mudar STORAGE_SHARD_LEVELS ou migrar também o
+# staging, com o servidor e os workers parados:
+#
+#     python storage.py migrate --uploads
+
+
+class ShardedDirectory:
+    def __init__(self, root: Path, levels: int = 2):
+        self.root = root
+        self.levels = levels
+        self.created: Set[Path] = set()
+        self.lock = threading.Lock()
+
+    def shard(self, name: str) -> Path:
+        digest = hashlib.blake2b(name.encode(), digest_size=max(self.levels, 1)).hexdigest()
+        return self.root.joinpath(*(digest[2 * i:2 * i + 2] for i in range(self.levels)))
+
+    def path(self, name: str) -> Path:
+        return self.shard(name) / name
+
+    def prepare(self, name: str) -> Path:
+        """Caminho do arquivo, criando o shard na primeira escrita dele neste processo."""
+        shard = self.shard(name)
+        if shard not in self.created:
+            shard.mkdir(parents=True, exist_ok=True)
+            with self.lock:
+                self.created.add(shard)
+        return shard / name
+
+    def contains(self, file_path: Path) -> bool:
+        # Também reconhece arquivos ainda no layout plano, de antes da migração
+        return file_path.parent == self.root or file_path.parent == self.shard(file_path.name)
+
+    def iter_files(self) -> Iterator[os.DirEntry]:
+        """Todos os arquivos, em qualquer nível, ignorando os ocultos."""
+        stack = [self.root]
+        while stack:
+            with os.scandir(stack.pop()) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(Path(entry.path))
+                    else:
+                        yield entry
+
+    def migrate(self, deep: bool = False) -> int:
+        """Move para o shard certo os arquivos soltos na raiz; com deep, também os de outro nível de shards."""
+        if deep:
+            misplaced = [Path(entry.path) for entry in self.iter_files()]
+        else:
+            with os.scandir(self.root) as entries:
+                misplaced = [Path(entry.path) for entry in entries if entry.is_file() and not entry.name.startswith(".")]
+        moved = 0
+        for file_path in misplaced:
+            target = self.path(file_path.name)
+            if file_path == target:
+                continue
+            # rename no mesmo sistema de arquivos: preserva o mtime, que a expiração usa
+            os.replace(file_path, self.prepare(file_path.name))
+            moved += 1
+        if deep:
+            self.remove_empty_shards()
+        return moved
+
+    def remove_empty_shards(self):
+        for dir_path, _, _ in sorted(os.walk(self.root), key=lambda item: -len(item[0])):
+            if Path(dir_path) != self.root:
+                try:
+                    os.rmdir(dir_path)
+                except OSError:
+                    pass  # Não está vazio
+        with self.lock:
+            self.created.clear()
+
+
+COMPRESSED = ShardedDirectory(settings.COMPRESSED_DIR, settings.STORAGE_SHARD_LEVELS)
+UPLOADS = ShardedDirectory(settings.UPLOAD_DIR, settings.STORAGE_SHARD_LEVELS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migração de diretórios para o layout em shards")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument(
+        "--uploads", action="store_true",
+        help="migra também UPLOAD_DIR; só com servidor e workers parados e a fila de jobs vazia"
+    )
+    args = parser.parse_args()
+
+    directories = [COMPRESSED, UPLOADS] if args.uploads else [COMPRESSED]
+    for directory in directories:
+        directory.root.mkdir(exist_ok=True)
+        moved = directory.migrate(deep=True)
+        logger.info(f"{moved} arquivos movidos para os shards de {directory.root}")
+
+
+if __name__ == "__main__":
+    main()
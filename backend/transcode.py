@@ -0,0 +1,196 @@
+import lzma
+import os
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Dict, Optional, Tuple
+from loguru import logger
+from seekable import SeekableXZWriter
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:  # zstandard é opcional; sem ele o formato .zst fica indisponível
+    zstandard = None
+    ZSTD_AVAILABLE = False
+
+# Formatos suportados: extensão -> content type
+MEDIA_TYPES = {
+    "xz": "application/x-xz",
+    "zip": "application/zip",
+    "zst": "application/zstd",
+}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def available_formats():
+    return [fmt for fmt in MEDIA_TYPES if fmt != "zst" or ZSTD_AVAILABLE]
+
+
+def stored_format(filename: str) -> str:
+    return Path(filename).suffix.lstrip(".").lower()
+
+
+def original_name(filename: str) -> str:
+    # Artefatos seguem o padrão {nome_seguro}_{AAAAMMDD}_{HHMMSS}.{formato}
+    stem = Path(filename).stem
+    parts = stem.rsplit("_", 2)
+    return parts[0] if len(parts) == 3 else stem
+
+
+def negotiate_format(accept: Optional[str], default: str) -> str:
+    """Escolhe o formato pelo header Accept, respeitando os pesos q."""
+    if not accept:
+        return default
+
+    candidates = []
+    for position, item in enumerate(accept.split(",")):
+        media_type, *params = [part.strip() for part in item.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        candidates.append((-quality, position, media_type.lower()))
+
+    by_media_type = {media_type: fmt for fmt, media_type in MEDIA_TYPES.items()}
+    for quality, _, media_type in sorted(candidates):
+        if quality == 0:
+            break
+        if media_type in ("*/*", "application/*"):
+            return default
+        fmt = by_media_type.get(media_type)
+        if fmt in available_formats():
+            return fmt
+    return default
+
+
+def _open_decoder(path: Path) -> Tuple[BinaryIO, list]:
+    fmt = stored_format(path.name)
+    if fmt == "xz":
+        stream = lzma.open(path, "rb")
+        return stream, [stream]
+    if fmt == "zip":
+        archive = zipfile.ZipFile(path)
+        member = archive.open(archive.infolist()[0])
+        return member, [member, archive]
+    if fmt == "zst":
+        raw = open(path, "rb")
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+        return stream, [stream, raw]
+    raise ValueError(f"Formato de origem não suportado: {fmt}")
+
+
+def transcode(src_path: Path, dst_path: Path, fmt: str, level: int):
+    """Descompacta src_path em streaming e recompacta em dst_path no formato pedido."""
+    source, closeables = _open_decoder(src_path)
+    try:
+        with open(dst_path, "wb") as dst:
+            if fmt == "xz":
+                with SeekableXZWriter(dst, level) as writer:
+                    while chunk := source.read(CHUNK_SIZE):
+                        writer.write(chunk)
+            elif fmt == "zip":
+                with zipfile.ZipFile(dst, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=level) as zipf:
+                    with zipf.open(original_name(src_path.name), "w", force_zip64=True) as member:
+                        while chunk := source.read(CHUNK_SIZE):
+                            member.write(chunk)
+            elif fmt == "zst":
+                compressor = zstandard.ZstdCompressor(level=level)
+                with compressor.stream_writer(dst, closefd=False) as writer:
+                    while chunk := source.read(CHUNK_SIZE):
+                        writer.write(chunk)
+            else:
+                raise ValueError(f"Formato de destino não suportado: {fmt}")
+    finally:
+        for closeable in closeables:
+            closeable.close()
+
+
+class VariantCache:
+    """Cache LRU limitado por bytes das variantes transcodificadas.
+
+    Cada variante é um arquivo em VARIANT_DIR identificado por
+    (artefato, formato, nível); a ordem de uso sobrevive a reinícios
+    através do mtime dos arquivos.
+    """
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, int]" = OrderedDict()
+        self.total_bytes = 0
+        self.lock = Lock()
+
+    @staticmethod
+    def key(filename: str, fmt: str, level: int) -> str:
+        return f"{filename}-{level}.{fmt}"
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / key
+
+    def load(self):
+        self.directory.mkdir(exist_ok=True)
+        files = [p for p in self.directory.glob("*") if not p.name.endswith(".part") and not p.name.startswith(".")]
+        files.sort(key=lambda p: p.stat().st_mtime)
+        with self.lock:
+            for path in files:
+                size = path.stat().st_size
+                self.entries[path.name] = size
+                self.total_bytes += size
+        self._evict()
+
+    def get(self, key: str) -> Optional[Path]:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self.discard(key)
+            return None
+        return path
+
+    def put(self, key: str, size: int):
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+        self._evict(keep=key)
+
+    def discard(self, key: str):
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+
+    def discard_artifact(self, filename: str):
+        prefix = f"{filename}-"
+        with self.lock:
+            keys = [key for key in self.entries if key.startswith(prefix)]
+        for key in keys:
+            self.discard(key)
+            self.path_for(key).unlink(missing_ok=True)
+
+    def _evict(self, keep: Optional[str] = None):
+        while True:
+            with self.lock:
+                if self.total_bytes <= self.max_bytes or not self.entries:
+                    return
+                key = next(iter(self.entries))
+                if key == keep and len(self.entries) == 1:
+                    return
+                size = self.entries.pop(key)
+                self.total_bytes -= size
+            try:
+                self.path_for(key).unlink(missing_ok=True)
+                logger.info(f"Variante removida do cache: {key}")
+            except Exception as e:
+                logger.error(f"Erro ao remover variante {key}: {str(e)}")
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.total_bytes, "max_bytes": self.max_bytes}
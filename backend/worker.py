@@ -0,0 +1,103 @@
+import argparse
+import signal
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from loguru import logger
+from config import settings
+from cancellation import CompressionCancelled
+from jobqueue import OWNER, JobQueue, QueuedJob, compress_queued_job
+
+# Worker de compressão separado do servidor HTTP: reserva jobs da fila
+# persistente, compacta os arquivos em staging e grava os artefatos no mesmo
+# COMPRESSED_DIR. Os servidores com EXTERNAL_WORKERS=true só recebem e servem
+# arquivos, e a CPU de compressão escala rodando mais processos deste worker
+# na mesma máquina, com o mesmo JOB_QUEUE_DB em disco local (o modo WAL do
+# SQLite não funciona em sistemas de arquivos de rede) e o mesmo
+# STORAGE_SHARD_LEVELS, que define onde cada artefato fica.
+#
+#     python worker.py --threads 4
+
+
+class Worker:
+    def __init__(self, queue: JobQueue, threads: int):
+        self.queue = queue
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="worker")
+        self.running = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def checkpoint(self, job: QueuedJob) -> Callable[[], None]:
+        # O servidor cancela removendo o job da fila; consulta no máximo uma vez por segundo
+        last_check = [time.monotonic()]
+
+        def check():
+            now = time.monotonic()
+            if now - last_check[0] < 1.0:
+                return
+            last_check[0] = now
+            if self.queue.state(job.id) != "running":
+                raise CompressionCancelled()
+        return check
+
+    def process(self, job: QueuedJob):
+        try:
+            if not job.staged_path.exists():
+                self.queue.fail(job.id, "arquivo em staging não encontrado")
+                return
+            final_path, compressed_size, content_hash = compress_queued_job(job, self.checkpoint(job))
+            if self.queue.complete(job.id, final_path.name, compressed_size, content_hash):
+                logger.info(f"Job {job.id} compactado: {final_path.name}")
+            else:
+                # Cancelado entre o último ponto de verificação e o fim
+                final_path.unlink(missing_ok=True)
+        except CompressionCancelled:
+            logger.info(f"Job {job.id} cancelado pelo servidor")
+        except Exception as e:
+            logger.error(f"Erro no job {job.id}: {str(e)}\n{traceback.format_exc()}")
+            self.queue.fail(job.id, str(e))
+        finally:
+            with self.lock:
+                self.running -= 1
+
+    def run(self):
+        logger.info(f"Worker {OWNER} iniciado com {self.threads} threads")
+        last_recover = 0.0
+        while not self.stopping.is_set():
+            now = time.monotonic()
+            if now - last_recover >= settings.JOB_RECOVER_INTERVAL_SECONDS:
+                # Jobs de workers que caíram voltam para a fila
+                self.queue.recover(settings.JOB_MAX_ATTEMPTS)
+                last_recover = now
+            with self.lock:
+                free = self.threads - self.running
+            jobs = self.queue.claim(free) if free else []
+            for job in jobs:
+                with self.lock:
+                    self.running += 1
+                self.executor.submit(self.process, job)
+            if not jobs:
+                self.stopping.wait(settings.JOB_POLL_INTERVAL_SECONDS)
+        # Termina os jobs em andamento antes de sair
+        self.executor.shutdown(wait=True)
+        logger.info(f"Worker {OWNER} encerrado")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker de compressão do compactador")
+    parser.add_argument("--threads", type=int, default=settings.WORKER_THREADS, help="jobs compactados em paralelo")
+    args = parser.parse_args()
+
+    settings.COMPRESSED_DIR.mkdir(exist_ok=True)
+    settings.STATE_DIR.mkdir(exist_ok=True)
+    worker = Worker(JobQueue(settings.JOB_QUEUE_DB), max(args.threads, 1))
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: worker.stopping.set())
+    worker.run()
+
+
+if __name__ == "__main__":
+    main()